@@ -1,23 +1,18 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN, KMeans
-from scipy.stats import zscore
-import matplotlib.pyplot as plt
-import seaborn as sns
+import resource
 import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from collections import defaultdict
-
-# Load configuration
-with open('recon_config.json', 'r') as file:
-    config = json.load(file)
-
-# Load preprocessed datasets
-datasets = {}
-for recon_name, recon_info in config.items():
-    datasets[recon_name] = pd.read_csv(recon_info['file_path'])
-    print(f"Loaded {recon_name} with {len(datasets[recon_name])} records.")
+from recon_ingest import load_config, load_recon, iter_recon_chunks, print_cache_report
+from anomaly_ensemble import DETECTOR_COLUMNS, select_target_columns, model_dtype, model_matrix, fit_ensemble, score_ensemble, apply_flags, assign_categories, compare_profiles
+from model_registry import data_fingerprint, save_ensemble, load_ensemble
+from suppression_index import build_index, apply_suppression
+from pipeline_metrics import stage, labels, flush as flush_metrics
+from history_index import FeedSummary, history_keys, feed_values, history_features, load_index
+from plot_artifacts import PLOT_MODES, PLOT_DIR, plot_mode, ArtifactRenderer, StreamSample
 
 # Predefined anomaly categories
 anomaly_reasons = defaultdict(lambda: "New Anomaly Detected")
@@ -27,75 +22,41 @@ anomaly_reasons.update({category: category for category in predefined_categories
 # Feedback Mechanism: Placeholder for user feedback collection
 feedback_log = {}
 
-# Anomaly Detection
-for recon_name, recon_info in config.items():
-    data = datasets[recon_name]
-    print(f"
-Analyzing {recon_name} for anomalies...")
+# Chunked scoring defaults (override per recon in recon_config.json)
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_TRAIN_ROWS = 200000
 
-    # Select criteria and derived columns for anomaly detection
-    target_columns = recon_info['criteria_columns'] + recon_info['derived_columns']
-    target_columns = [col for col in target_columns if col in data.columns]
 
-    if not target_columns:
-        print(f"No valid columns for anomaly detection in {recon_name}. Skipping.")
-        continue
-
-    # Standardize data
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(data[target_columns].fillna(0))
-
-    # Statistical Anomaly Detection
-    z_scores = np.abs(zscore(scaled_data))
-    z_anomalies = (z_scores > 3).any(axis=1)
-
-    # Isolation Forest
-    iso_forest = IsolationForest(contamination=0.05, random_state=42)
-    iso_labels = iso_forest.fit_predict(scaled_data)
-    iso_anomalies = iso_labels == -1
-
-    # DBSCAN
-    dbscan = DBSCAN(eps=0.5, min_samples=5)
-    dbscan_labels = dbscan.fit_predict(scaled_data)
-    dbscan_anomalies = dbscan_labels == -1
-
-    # K-Means
-    kmeans = KMeans(n_clusters=3, random_state=42)
-    kmeans.fit(scaled_data)
-    distances = np.linalg.norm(scaled_data - kmeans.cluster_centers_[kmeans.labels_], axis=1)
-    kmeans_anomalies = distances > np.percentile(distances, 95)
-
-    # Combine anomaly indicators and classify
-    data['Z_Anomaly'] = z_anomalies
-    data['IF_Anomaly'] = iso_anomalies
-    data['DBSCAN_Anomaly'] = dbscan_anomalies
-    data['KMeans_Anomaly'] = kmeans_anomalies
-    data['Anomaly'] = data[['Z_Anomaly', 'IF_Anomaly', 'DBSCAN_Anomaly', 'KMeans_Anomaly']].any(axis=1)
-
-    # Assign anomaly category and reason
-    def get_anomaly_reason(row):
-        if recon_name == list(datasets.keys())[0]:  # Only for the first dataset
-            if row['Anomaly']:
-                reasons = []
-                if row['Z_Anomaly']:
-                    reasons.append("Inconsistent variations in outstanding balances")
-                if row['IF_Anomaly']:
-                    reasons.append("Huge spike in outstanding balances")
-                if row['DBSCAN_Anomaly']:
-                    reasons.append("Unusual patterns in transaction clusters")
-                if row['KMeans_Anomaly']:
-                    reasons.append("Outliers deviating significantly from expected clusters")
-                return ', '.join(reasons)
-            return "Consistent increase or decrease in outstanding balances or balances are in line with previous months"
-        return ""
-
-    data['Anomaly_Category'] = data.apply(lambda row: anomaly_reasons[row['Anomaly']] if row['Anomaly'] else "No Anomaly", axis=1)
-
-    if recon_name == list(datasets.keys())[0]:
-        data['Anomaly_Reason'] = data.apply(lambda row: get_anomaly_reason(row), axis=1)
-
-    # Visualization
+# Assign anomaly category and reason (reason texts are configured per recon
+# under "anomaly_reasons" in recon_config.json)
+
+def classify_anomalies(data, recon_info):
+    return assign_categories(data, anomaly_reasons[True], recon_info.get('anomaly_reasons'))
+
+
+# Known-false-positive suppression from analyst feedback
+
+def load_suppression_index(recon_name, recon_info):
+    if not recon_info.get('suppression', True):
+        return None
+    index = build_index(recon_name, recon_info)
+    if index['entries']:
+        print(f"Loaded {index['entries']} known false positive signatures for {recon_name}.")
+    return index
+
+
+def suppress_known(data, index, recon_info):
+    if index is None:
+        return 0
+    return apply_suppression(data, index, recon_info)
+
+
+# Visualization (pyplot and seaborn are only imported when figures are shown)
+
+def plot_anomalies(data, target_columns, recon_name):
     if len(target_columns) >= 2:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         plt.figure(figsize=(10, 6))
         sns.scatterplot(x=data[target_columns[0]], y=data[target_columns[1]], hue=data['Anomaly'], palette={0: 'blue', 1: 'red'})
         plt.title(f"Anomaly Detection for {recon_name}")
@@ -104,7 +65,294 @@ Analyzing {recon_name} for anomalies...")
         plt.grid(True)
         plt.show()
 
+
+def render_anomalies(renderer, data, target_columns, recon_name):
+    if len(target_columns) >= 2:
+        renderer.scatter(data, target_columns[0], target_columns[1], f"{recon_name}_anomalies",
+                         f"Anomaly Detection for {recon_name}")
+
+
+# Model registry: reuse an ensemble already fitted on the same config and
+# training data, otherwise fit one and register it.
+
+def fit_and_register(recon_name, recon_info, values, target_columns, executor=None):
+    fingerprint = data_fingerprint(values)
+    ensemble, entry = load_ensemble(recon_name, recon_info, fingerprint)
+    if ensemble is not None:
+        print(f"Reusing registered {recon_name} models fitted at {entry['created_at']}.")
+        return ensemble, score_ensemble(ensemble, values)
+
+    profile = recon_info.get('detector_profile', 'exact')
+    ensemble, flags = fit_ensemble(values, n_jobs=recon_info.get('n_jobs'), executor=executor, profile=profile)
+    save_ensemble(recon_name, recon_info, ensemble, target_columns, fingerprint)
+
+    if profile != 'exact' and recon_info.get('profile_report', False):
+        write_profile_report(recon_name, values)
+    return ensemble, flags
+
+
+# Agreement report for the "large" detector profile
+
+def write_profile_report(recon_name, values):
+    report = compare_profiles(values)
+    report_file = f"{recon_name}_profile_agreement.json"
+    with open(report_file, 'w') as file:
+        json.dump(report, file, indent=4)
+    for detector, stats in report['detectors'].items():
+        print(f"{recon_name} {detector}: {stats['agreement']:.1%} agreement with exact detector "
+              f"(jaccard {stats['jaccard']:.2f}) on {report['sample_rows']} sampled rows.")
+
+
+def load_registered(recon_name, recon_info, target_columns):
+    ensemble, entry = load_ensemble(recon_name, recon_info)
+    if ensemble is None or entry['target_columns'] != list(target_columns):
+        print(f"No registered models for {recon_name} match the current config; fitting instead.")
+        return None
+    print(f"Scoring {recon_name} with registered models fitted on {entry['n_train']} rows at {entry['created_at']}.")
+    return ensemble
+
+
+# In-memory detection over the whole dataset
+
+def detect_recon(recon_name, recon_info, data, score_only=False, executor=None, plot=True, renderer=None):
+    print(f"\nAnalyzing {recon_name} for anomalies...")
+
+    # Select criteria and derived columns for anomaly detection
+    target_columns = select_target_columns(recon_info, data.columns)
+
+    if not target_columns:
+        print(f"No valid columns for anomaly detection in {recon_name}. Skipping.")
+        return None
+
+    # Score with the registered ensemble, or fit on all rows and flag them
+    values = model_matrix(data, target_columns, model_dtype(recon_info))
+    ensemble = load_registered(recon_name, recon_info, target_columns) if score_only else None
+    with stage('score' if ensemble is not None else 'fit', rows_in=len(values)) as s:
+        if ensemble is not None:
+            flags = score_ensemble(ensemble, values)
+        else:
+            _, flags = fit_and_register(recon_name, recon_info, values, target_columns, executor)
+        s.flagged({detector: detector_flags.sum() for detector, detector_flags in flags.items()})
+
+    # Combine anomaly indicators, drop known false positives and classify
+    apply_flags(data, flags)
+    with stage('suppress', rows_in=len(data)) as s:
+        suppressed = suppress_known(data, load_suppression_index(recon_name, recon_info), recon_info)
+        s.set(suppressed=suppressed)
+    if suppressed:
+        print(f"Suppressed {suppressed} known false positives in {recon_name}.")
+    with stage('classify', rows_in=len(data)) as s:
+        classify_anomalies(data, recon_info)
+        s.rows_out(data['Anomaly'].sum())
+
+    # "Has this value broken before?" from the persistent history index; the
+    # detector run is the one that folds the feed in (once per fingerprint)
+    if recon_info.get('history_index'):
+        with stage('history', rows_in=len(data)):
+            history_features(recon_name, recon_info, data, update=True)
+
+    if renderer is not None:
+        render_anomalies(renderer, data, target_columns, recon_name)
+    elif plot:
+        with stage('plot', rows_in=len(data)):
+            plot_anomalies(data, target_columns, recon_name)
+
     # Save results
-    data.to_csv(f"{recon_name}_anomaly_results.csv", index=False)
+    with stage('save', rows_in=len(data)):
+        data.to_csv(f"{recon_name}_anomaly_results.csv", index=False)
+    return data
+
+
+# Bounded-memory detection: fit on a training window (or sample), then score
+# the feed chunk by chunk and append each chunk to the results file.
+
+def collect_training_rows(recon_name, recon_info, chunk_size):
+    train_rows = recon_info.get('train_rows', DEFAULT_TRAIN_ROWS)
+    train_fraction = recon_info.get('train_fraction')
+
+    parts = []
+    collected = 0
+    for i, chunk in enumerate(iter_recon_chunks(recon_name, recon_info, chunk_size)):
+        if train_fraction:
+            chunk = chunk.sample(frac=train_fraction, random_state=42 + i)
+        chunk = chunk.head(train_rows - collected)
+        parts.append(chunk)
+        collected += len(chunk)
+        if collected >= train_rows:
+            break
+
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True)
+
+
+def fit_chunked(recon_name, recon_info, chunk_size, executor=None):
+    with stage('collect_training') as s:
+        training = collect_training_rows(recon_name, recon_info, chunk_size)
+        s.rows_out(len(training))
+    target_columns = select_target_columns(recon_info, training.columns)
+
+    if training.empty or not target_columns:
+        return None, target_columns
+
+    with stage('fit', rows_in=len(training)) as s:
+        ensemble, flags = fit_and_register(recon_name, recon_info, model_matrix(training, target_columns, model_dtype(recon_info)),
+                                           target_columns, executor)
+        s.flagged({detector: detector_flags.sum() for detector, detector_flags in flags.items()})
+    print(f"Fitted {recon_name} ensemble on {len(training)} training rows.")
+    return ensemble, target_columns
+
+
+def detect_recon_chunked(recon_name, recon_info, score_only=False, executor=None, renderer=None):
+    print(f"\nAnalyzing {recon_name} for anomalies in chunked mode...")
+    chunk_size = recon_info.get('chunk_size', DEFAULT_CHUNK_SIZE)
+
+    ensemble = None
+    if score_only:
+        header = next(iter_recon_chunks(recon_name, recon_info, 1), pd.DataFrame())
+        target_columns = select_target_columns(recon_info, header.columns)
+        ensemble = load_registered(recon_name, recon_info, target_columns)
+    if ensemble is None:
+        ensemble, target_columns = fit_chunked(recon_name, recon_info, chunk_size, executor)
+
+    if ensemble is None or not target_columns:
+        print(f"No valid columns for anomaly detection in {recon_name}. Skipping.")
+        return 0
+
+    output_file = f"{recon_name}_anomaly_results.csv"
+    suppression_index = load_suppression_index(recon_name, recon_info)
+    scored = 0
+    flagged = 0
+    suppressed = 0
+    detector_counts = dict.fromkeys(DETECTOR_COLUMNS, 0)
+    plot_sample = StreamSample(target_columns[:2]) if renderer is not None and len(target_columns) >= 2 else None
+
+    # Chunks are judged against the stored history index; the feed is folded
+    # in once all chunks are scored
+    history = None
+    if recon_info.get('history_index'):
+        history = FeedSummary()
+        history_index = load_index(recon_name, [name for name, _ in history_keys(recon_info)])
+
+    with stage('score_chunks') as s:
+        for i, chunk in enumerate(iter_recon_chunks(recon_name, recon_info, chunk_size)):
+            flags = score_ensemble(ensemble, model_matrix(chunk, target_columns, model_dtype(recon_info)))
+            apply_flags(chunk, flags)
+            suppressed += suppress_known(chunk, suppression_index, recon_info)
+            classify_anomalies(chunk, recon_info)
+            if history is not None:
+                feed = feed_values(chunk, recon_info)
+                history_features(recon_name, recon_info, chunk, update=False, index=history_index, feed=feed)
+                history.add(feed)
+            chunk.to_csv(output_file, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            scored += len(chunk)
+            flagged += int(chunk['Anomaly'].sum())
+            for detector in DETECTOR_COLUMNS:
+                detector_counts[detector] += int(flags[detector].sum())
+            if plot_sample is not None:
+                plot_sample.add(chunk)
+        s.set(rows_in=scored, suppressed=suppressed, chunks=i + 1 if scored else 0)
+        s.rows_out(flagged)
+        s.flagged(detector_counts)
+
+    if history is not None:
+        with stage('history_update'):
+            history.apply(recon_name)
+
+    if plot_sample is not None:
+        render_anomalies(renderer, plot_sample.frame(), target_columns, recon_name)
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Scored {scored} rows of {recon_name} in chunks of {chunk_size}: {flagged} anomalies, "
+          f"{suppressed} known false positives suppressed (peak RSS {peak_rss_mb:.0f} MB).")
+    return scored
+
+
+# Key-partitioned detection in worker processes (see partition_runner); the
+# output shards are combined into the usual results file
+
+def detect_recon_partitioned(recon_name, recon_info):
+    from partition_runner import run_partitioned, combine, ShardFailure
+    try:
+        job, manifest = run_partitioned(recon_name, recon_info, workers=recon_info.get('shard_workers', 1))
+    except ShardFailure as failure:
+        print(f"Warning: {recon_name} stopped: {failure}. Run again to retry the failed shards.")
+        return 0
+    combine(job, manifest, f"{recon_name}_anomaly_results.csv")
+    return manifest['rows']
+
+
+def run_recon(recon_name, recon_info, score_only=False, executor=None, plot=True, renderer=None):
+    with labels(recon=recon_name):
+        if recon_info.get('scoring_mode') == 'chunked':
+            detect_recon_chunked(recon_name, recon_info, score_only, executor, renderer)
+            return None
+        if recon_info.get('scoring_mode') == 'partitioned':
+            detect_recon_partitioned(recon_name, recon_info)
+            return None
+
+        # Load preprocessed dataset
+        with stage('load') as s:
+            data = load_recon(recon_name, recon_info)
+            s.rows_out(len(data))
+        print(f"Loaded {recon_name} with {len(data)} records.")
+        return detect_recon(recon_name, recon_info, data, score_only, executor, plot, renderer)
+
+
+def detect_all(config, score_only=False, workers=1, plots=None, plot_dir=PLOT_DIR):
+    mode = plot_mode(plots)
+    renderer = ArtifactRenderer(plot_dir) if mode == 'artifact' else None
+
+    # Anomaly Detection
+    if workers > 1:
+        # Recons are orchestrated from threads; every detector fit runs in the
+        # shared process pool. Shown plots are drawn afterwards on the main
+        # thread; artifact plots are queued to the render thread as recons finish.
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor, \
+                ThreadPoolExecutor(len(config) or 1) as recon_threads:
+            futures = {recon_name: recon_threads.submit(run_recon, recon_name, recon_info,
+                                                        score_only or recon_info.get('score_only', False),
+                                                        executor, False, renderer)
+                       for recon_name, recon_info in config.items()}
+            results = {recon_name: future.result() for recon_name, future in futures.items()}
+
+        for recon_name, data in results.items():
+            if data is not None and mode == 'show':
+                with labels(recon=recon_name), stage('plot', rows_in=len(data)):
+                    plot_anomalies(data, select_target_columns(config[recon_name], data.columns), recon_name)
+    else:
+        results = {recon_name: run_recon(recon_name, recon_info, score_only or recon_info.get('score_only', False),
+                                         plot=mode == 'show', renderer=renderer)
+                   for recon_name, recon_info in config.items()}
+
+    if renderer is not None:
+        with stage('render_plots'):
+            paths = renderer.close()
+        print(f"Wrote {len(paths)} plots to {plot_dir}.")
+
+    print_cache_report()
+    metrics_file = flush_metrics()
+    if metrics_file:
+        print(f"Stage metrics written to {metrics_file}.")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ensemble anomaly detection for configured recons.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--score-only', action='store_true',
+                        help="score with registered models instead of refitting")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes for running recons and detectors in parallel")
+    parser.add_argument('--plots', choices=PLOT_MODES, default=None,
+                        help="show figures, skip them (headless) or write downsampled PNGs (artifact); "
+                             "defaults to ANOMALYZE_PLOTS or show")
+    parser.add_argument('--plot-dir', default=PLOT_DIR, help="output directory for artifact plots")
+    args = parser.parse_args(argv)
+
+    detect_all(load_config(args.config), args.score_only, args.workers, args.plots, args.plot_dir)
+    print("Anomaly detection completed for all datasets with classifications and feedback capabilities!")
+
 
-print("Anomaly detection completed for all datasets with classifications and feedback capabilities!")
+if __name__ == "__main__":
+    main()
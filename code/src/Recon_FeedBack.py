@@ -1,61 +1,36 @@
 import streamlit as st
 import pandas as pd
-import json
 import os
+from recon_ingest import load_config
+from feedback_store import FEEDBACK_DB
+from feedback_review import review_anomalies
 
 
-def save_feedback(feedback_log):
-    try:
-        feedback_file_path = os.path.join(os.getcwd(), 'feedback_log.json')
-        st.write("Feedback File Path:", feedback_file_path)  # Show the file path
+# Recon type of an uploaded results file ({recon_name}_anomaly_results*.csv)
 
-        # Check write permissions
-        try:
-            with open('feedback_log.json', 'w') as file:
-                json.dump({"test": "write check"}, file)
-            st.success("Write test successful!")
-        except Exception as e:
-            st.error(f"Error writing file: {e}")
+def infer_recon_type(file_name, config):
+    for recon_name in config:
+        if file_name.startswith(recon_name):
+            return recon_name
+    return None
 
-        # Save feedback
-        with open('feedback_log.json', 'w') as file:
-            json.dump(feedback_log, file, indent=4)
-        st.success("Feedback successfully saved!")
-    except Exception as e:
-        st.error(f"Failed to save feedback: {e}")
-
-
-feedback_log = {}
 
 st.title("Anomaly Feedback Tool")
 
+config = load_config() if os.path.exists('recon_config.json') else {}
+
 # Load detected anomalies from CSV
 anomaly_file = st.file_uploader("Upload CSV with Detected Anomalies:", type=["csv"])
-anomalies = []
+anomalies = pd.DataFrame()
 
 if anomaly_file is not None:
     data = pd.read_csv(anomaly_file)
     if 'Anomaly' in data.columns:
-        anomalies = data[data['Anomaly'] == 1].index.tolist()
-
-if anomalies:
-    selected_anomaly = st.selectbox("Select an Anomaly:", anomalies)
-    st.write("### Selected Anomaly Details:")
-    st.dataframe(data.iloc[selected_anomaly])  # Show the full row of the selected anomaly
-
-    feedback_type = st.selectbox("Feedback Type:", ["False Positive", "False Negative", "True Positive", "True Negative"])
-    comments = st.text_area("Comments:")
-
-    if st.button("Submit Feedback"):
-        if selected_anomaly is not None and feedback_type:
-            feedback_log[str(selected_anomaly)] = {
-                "feedback_type": feedback_type,
-                "comments": comments,
-                "anomaly_details": data.iloc[selected_anomaly].to_dict()  # Log the anomaly details
-            }
-            save_feedback(feedback_log)
-            st.success("Feedback submitted!")
-        else:
-            st.error("Please provide all required fields.")
+        anomalies = data[data['Anomaly'].astype(str).str.lower().isin(['true', '1'])]
+
+if not anomalies.empty:
+    st.write("Feedback Store:", os.path.abspath(FEEDBACK_DB))
+    review_anomalies(anomalies, config, run_id=anomaly_file.name,
+                     recon_type=infer_recon_type(anomaly_file.name, config))
 else:
     st.warning("No detected anomalies found. Please upload a valid CSV.")
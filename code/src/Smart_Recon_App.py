@@ -4,19 +4,31 @@ import pandas as pd
 import json
 import os
 import random
-from deap import base, creator, tools, algorithms
-import requests
-from smtplib import SMTP
-import smtplib
+from recon_ingest import load_recon, convert_types, cache_report
+from key_stats_store import score_feed, update_store, feed_fingerprint, feed_applied
+from recon_rules import detect_with_rules
+from recon_dates import normalize_dates
+from notification_dispatcher import NotificationDispatcher
+from suppression_index import build_index, apply_suppression
+from feedback_review import review_anomalies, show_preview
+from pipeline_metrics import stage, labels, flush as flush_metrics
+from app_cache import record_call, record_miss, metrics_report, pipeline_key
 
 
-# Load configuration from config.json
+# Load configuration from config.json (parsed once per uploaded content)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_config(content):
+    record_miss('config')
+    return json.loads(content)
+
 
 def load_config():
     try:
         config_file = st.file_uploader("Upload Configuration File (recon_config.json)", type=['json'])
         if config_file is not None:
-            config = json.load(config_file)
+            record_call('config')
+            config = parse_config(config_file.getvalue())
             st.success('Configuration loaded successfully.')
             return config
         else:
@@ -29,33 +41,53 @@ def load_config():
 
 # Data Ingestion using Config File
 
+def read_anomalies(config):
+    frames = {}
+    missing = []
+    for recon_type, details in config.items():
+        file_path = details.get('file_path')
+        if file_path and os.path.exists(file_path):
+            # Criteria columns come back already numeric from the ingestion cache
+            with stage('load', recon=recon_type) as s:
+                df = load_recon(recon_type, details)
+                s.rows_out(len(df))
+            df['Reconciliation_Type'] = recon_type
+
+            if recon_type == 'iHub_Reconciliation':
+                df['Recon_Frequency'] = 'Monthly'
+                # Mixed date formats are parsed per distinct value; rows whose
+                # date matches no format are reported and kept
+                normalize_dates(recon_type, {**details, 'date_columns': ['As of Date']}, df)
+                month_ends = df.groupby(df['As of Date'].dt.to_period('M'), dropna=False).tail(1)
+                df = month_ends
+
+            frames[recon_type] = df
+        else:
+            missing.append(recon_type)
+    return frames, missing
+
+
+# Keyed by config content and input file fingerprints, not by the frames
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_read_anomalies(cache_key, _config):
+    record_miss('load')
+    return read_anomalies(_config)
+
+
 def load_anomalies(config):
     try:
-        anomalies = pd.DataFrame()
-        for recon_type, details in config.items():
-            file_path = details.get('file_path')
-            if file_path and os.path.exists(file_path):
-                df = pd.read_csv(file_path)
-                df['Reconciliation_Type'] = recon_type
-
-                # Convert relevant columns to numeric
-                for col in details.get('criteria_columns', []):
-                    if col in df.columns:
-                        df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '').str.strip(), errors='coerce')
-
-                if recon_type == 'iHub_Reconciliation':
-                    df['Recon_Frequency'] = 'Monthly'
-                    df['As of Date'] = pd.to_datetime(df['As of Date'], errors='coerce')
-                    month_ends = df.groupby(df['As of Date'].dt.to_period('M')).tail(1)
-                    df = month_ends
-
-                st.success(f"Loaded {recon_type} Data from {file_path}")
-                st.dataframe(df)
-                anomalies = pd.concat([anomalies, df], ignore_index=True)
-            else:
-                st.warning(f"File path for {recon_type} not found or not specified in the configuration.")
-
-        return anomalies
+        record_call('load')
+        frames, missing = cached_read_anomalies(pipeline_key(config), config)
+        for recon_type, df in frames.items():
+            st.success(f"Loaded {recon_type} Data from {config[recon_type]['file_path']}")
+            show_preview(df)
+        for recon_type in missing:
+            st.warning(f"File path for {recon_type} not found or not specified in the configuration.")
+
+        report = cache_report()
+        st.caption(f"Ingestion cache: {report['hits']} hits, {report['misses']} misses")
+        return pd.concat(frames.values(), ignore_index=True) if frames else pd.DataFrame()
     except Exception as e:
         st.error(f'Failed to load anomalies: {e}')
         return pd.DataFrame()
@@ -63,107 +95,153 @@ def load_anomalies(config):
 
 # Anomaly Detection with Enhanced Error Handling
 
-def detect_anomalies(df, config):
-    anomalies = pd.DataFrame()
+def run_detection(df, config):
+    detected_frames = []
+    suppressed_counts = {}
     for recon_type, details in config.items():
-        criteria_columns = details.get('criteria_columns', [])
         recon_df = df[df['Reconciliation_Type'] == recon_type].copy()
+        with labels(recon=recon_type), stage('detect', rows_in=len(recon_df)) as s:
+            detected, suppressed = detect_recon(recon_type, details, recon_df)
+            s.rows_out(len(detected))
+            s.set(suppressed=suppressed)
+        if suppressed:
+            suppressed_counts[recon_type] = suppressed
+        detected_frames.append(detected)
+
+    anomalies = pd.concat(detected_frames, ignore_index=True) if detected_frames else pd.DataFrame()
+    flush_metrics()
+    return anomalies, suppressed_counts
+
+
+def detect_recon(recon_type, details, recon_df):
+    # Same typing as the ingestion layer (a no-op for frames from load_recon)
+    convert_types(recon_df, details)
+
+    if recon_type == 'iHub_Reconciliation' and details.get('key_stats', False):
+        # Judge only rows newer than each key's stored history against that
+        # key's running statistics (read-only; see update_key_history)
+        scored = score_feed(recon_type, details, recon_df)
+        detected = scored[scored['Key_Anomaly']].copy()
+        detected['Anomaly_Status'] = 'Anomaly'
+
+    else:
+        # Threshold and month-over-month rules from the recon's "rules" config
+        detected = detect_with_rules(recon_type, details, recon_df)
+
+    # Drop breaks analysts already marked as known false positives
+    suppressed = 0
+    if details.get('suppression', True):
+        suppressed = apply_suppression(detected, build_index(recon_type, details), details)
+        if suppressed:
+            detected = detected[~detected['Suppressed']]
+    return detected, suppressed
 
-        for col in criteria_columns:
-            if col in recon_df.columns:
-                recon_df[col] = pd.to_numeric(recon_df[col].astype(str).str.replace(',', '').str.strip(), errors='coerce')
-
-        if recon_type == 'iHub_Reconciliation':
-            threshold = details.get('anomaly_threshold', 5000)
-            grouped_df = recon_df.groupby(recon_df['As of Date'].dt.to_period('M'))
-
-            for _, group in grouped_df:
-                if not group.empty:
-                    for col in criteria_columns:
-                        breaks = group[col].diff().abs() > threshold
-                        if breaks.any():
-                            if breaks.sum() == group.shape[0] - 1:
-                                group['Anomaly_Status'] = 'Not An Anomaly'
-                            else:
-                                group['Anomaly_Status'] = 'Anomaly'
-                    anomalies = pd.concat([anomalies, group], ignore_index=True)
-
-        elif recon_type == 'Catalyst_Reconciliation':
-            threshold = details.get('anomaly_threshold', 1000)
-            recon_df = recon_df.dropna(subset=criteria_columns)
-
-            for col in criteria_columns:
-                detected = recon_df[recon_df[col] > threshold]
-                detected['Anomaly_Status'] = 'Anomaly'
-                anomalies = pd.concat([anomalies, detected], ignore_index=True)
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_run_detection(cache_key, _df, _config):
+    record_miss('detect')
+    return run_detection(_df, _config)
+
+
+def detect_anomalies(df, config):
+    record_call('detect')
+    detection_key = pipeline_key(config, include_feedback=True)
+    anomalies, suppressed_counts = cached_run_detection(detection_key, df, config)
+
+    for recon_type, suppressed in suppressed_counts.items():
+        st.write(f"Suppressed {suppressed} known false positives in {recon_type}.")
     st.write("Anomalies Detected:", len(anomalies))
-    st.dataframe(anomalies)
-    feedback_tool(anomalies)
-    automate_resolution(anomalies)
+    feedback_tool(anomalies, config, run_id=detection_key)
+
+    # Notifications are a side effect: send them once per input data and
+    # config, only when asked. New feedback changes the detection key but
+    # not this one, so it does not re-enable dispatch.
+    dispatch_key = pipeline_key(config)
+    dispatched = st.session_state.setdefault('dispatched_results', set())
+    already_sent = dispatch_key in dispatched
+    if st.button("Dispatch resolution notifications", disabled=already_sent or anomalies.empty):
+        automate_resolution(anomalies)
+        dispatched.add(dispatch_key)
+    elif already_sent:
+        st.info("Notifications for these results were already dispatched in this session.")
+
+    update_key_history(df, config)
     return anomalies
 
 
+# Folding a feed into the per-key statistics is an explicit step, separate
+# from rendering. The store records each applied feed's fingerprint, so a
+# feed is applied once across sessions and restarts, and detection keeps
+# scoring it against the history from before it.
+
+def update_key_history(df, config):
+    for recon_type, details in config.items():
+        if recon_type != 'iHub_Reconciliation' or not details.get('key_stats', False):
+            continue
+        recon_df = df[df['Reconciliation_Type'] == recon_type]
+        fingerprint = feed_fingerprint(recon_df, details)
+        if feed_applied(recon_type, fingerprint):
+            st.info(f"This {recon_type} feed is already part of the per-key history.")
+        elif st.button(f"Add this {recon_type} feed to the per-key history"):
+            applied = update_store(recon_type, details, recon_df, fingerprint=fingerprint)
+            st.success(f"Added {applied} new rows to the {recon_type} per-key history.")
+
+
 # Interactive Feedback Tool
 
-def feedback_tool(anomalies):
+def feedback_tool(anomalies, config, run_id=None):
     st.write("### Provide Feedback on Detected Anomalies")
-    for idx, row in anomalies.iterrows():
-        feedback = st.selectbox(f"Anomaly at index {idx} (Status: {row['Anomaly_Status']}):", ["Valid Anomaly", "False Positive", "Needs Review"], key=idx)
+    review_anomalies(anomalies, config, run_id=run_id, key='detected')
 
 
-# Automating Resolution Tasks with Actual Calls
+# Automating Resolution Tasks with Actual Calls (queued on a pooled dispatcher;
+# emails go out as digests over one SMTP connection)
 
 def automate_resolution(anomalies):
-    for idx, row in anomalies.iterrows():
-        severity = random.choice(['High', 'Medium', 'Low'])
+    severities = random.choices(['High', 'Medium', 'Low'], k=len(anomalies))
+    with NotificationDispatcher() as dispatcher:
+        for row, severity in zip(anomalies.to_dict('records'), severities):
+            if severity == 'High':
+                create_resolution_task(dispatcher, row)
+                call_api(dispatcher, row)
+                send_email(dispatcher, row)
 
-        if severity == 'High':
-            create_resolution_task(row)
-            call_api(row)
-            send_email(row)
-
-        elif severity == 'Medium':
-            send_email(row)
+            elif severity == 'Medium':
+                send_email(dispatcher, row)
 
+    st.write("Resolution notifications:", dispatcher.stats)
+    return dispatcher.stats
 
 
 # Sample Automation Functions with Dummy API and Email Calls
 
-def create_resolution_task(row):
-    print(f"Creating ServiceNow incident for anomaly {row['Reconciliation_Type']}.")
+def create_resolution_task(dispatcher, row):
     incident_data = {
         'short_description': f"Anomaly detected in {row['Reconciliation_Type']}",
-        'description': f"Detailed anomaly info: {row.to_dict()}",
+        'description': f"Detailed anomaly info: {row}",
         'urgency': '2',
         'impact': '2'
     }
-    try:
-        response = requests.post("https://servicenow-instance.com/api/now/table/incident", json=incident_data)
-        print(f"ServiceNow Incident Response: {response.status_code}")
-    except Exception as e:
-        print(f"Failed to create ServiceNow incident: {e}")
+    return dispatcher.create_incident(incident_data)
 
 
-def call_api(row):
-    print(f"Calling external API for anomaly {row['Reconciliation_Type']}.")
-    response = requests.post("https://dummy-api-endpoint.com/resolution", data={'anomaly_type': row['Reconciliation_Type']})
-    print(f"API Response: {response.status_code}")
+def call_api(dispatcher, row):
+    return dispatcher.call_api(data={'anomaly_type': row['Reconciliation_Type']})
 
 
-def send_email(row):
-    print(f"Sending email for anomaly {row['Reconciliation_Type']}. Using SMTP server smtp.yhc.com.")
-    try:
-        with smtplib.SMTP('smtp.yhc.com') as smtp:
-            sender = 'test_email@yhc.com'
-            recipient = 'team@example.com'
-            subject = f"Anomaly Detected in {row['Reconciliation_Type']}"
-            body = f"Anomaly details: {row.to_dict()}"
-            smtp.sendmail(sender, recipient, message)
-            print(f"Email sent to {recipient}.")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
+def send_email(dispatcher, row):
+    subject = f"Anomaly Detected in {row['Reconciliation_Type']}"
+    body = f"Anomaly details: {row}"
+    dispatcher.queue_email(subject, body)
+
+
+# Cache hit/miss metrics for this server process
 
+def show_cache_metrics():
+    st.sidebar.write("### Cache")
+    for stage, counts in metrics_report().items():
+        st.sidebar.metric(f"{stage} cache", f"{counts['hits']} hits", f"{counts['misses']} misses",
+                          delta_color='off')
 
 
 def main():
@@ -173,6 +251,7 @@ def main():
         anomalies = load_anomalies(config)
         if not anomalies.empty:
             detect_anomalies(anomalies, config)
+    show_cache_metrics()
 
 
 if __name__ == "__main__":
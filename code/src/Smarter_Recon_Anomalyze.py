@@ -2,17 +2,16 @@
 import pandas as pd
 import json
 import os
-import random
-from deap import base, creator, tools, algorithms
-import requests
-from smtplib import SMTP
+from recon_ingest import load_recon, print_cache_report
+from recon_rules import apply_rules
+from pipeline_metrics import stage, flush as flush_metrics
 
 
 # Load configuration from config.json
 
-def load_config():
+def load_config(path='recon_config.json'):
     try:
-        with open('recon_config.json', 'r') as file:
+        with open(path, 'r') as file:
             config = json.load(file)
         print('Configuration loaded successfully.')
         return config
@@ -21,19 +20,33 @@ def load_config():
         return {}
 
 
+# Frame display: rich output in notebooks, a preview on the console
+
+def show(df):
+    try:
+        from IPython.display import display
+        display(df)
+    except ImportError:
+        print(df.head(20))
+
+
 # Data Ingestion
 
 def load_anomalies(config):
     try:
-        anomalies = pd.DataFrame()
+        frames = []
         for recon_type, details in config.items():
             file_path = details.get('file_path')
             if file_path and os.path.exists(file_path):
-                df = pd.read_csv(file_path)
+                with stage('load', recon=recon_type) as s:
+                    df = load_recon(recon_type, details)
+                    s.rows_out(len(df))
                 df['Reconciliation_Type'] = recon_type
-                anomalies = pd.concat([anomalies, df], ignore_index=True)
+                frames.append(df)
+        anomalies = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
         print("Loaded Current and Historical Data")
-        display(anomalies)
+        print_cache_report()
+        show(anomalies)
         return anomalies
     except Exception as e:
         print(f'Error: Failed to load anomalies: {e}')
@@ -43,19 +56,21 @@ def load_anomalies(config):
 # Anomaly Detection
 
 def detect_anomalies(df, config):
-    anomalies = pd.DataFrame()
+    detected_frames = []
     for recon_type, details in config.items():
-        criteria_columns = details.get('criteria_columns', [])
-        threshold = details.get('anomaly_threshold', 1000)
         recon_df = df[df['Reconciliation_Type'] == recon_type]
 
-        if criteria_columns:
-            for col in criteria_columns:
-                detected = recon_df[recon_df[col] > threshold]
-                anomalies = pd.concat([anomalies, detected], ignore_index=True)
+        if details.get('criteria_columns'):
+            rules = details.get('rules') or [{'type': 'threshold', 'threshold': details.get('anomaly_threshold', 1000)}]
+            with stage('detect', rows_in=len(recon_df), recon=recon_type) as s:
+                detected = apply_rules(recon_df, rules, details)
+                s.rows_out(len(detected))
+            detected_frames.append(detected)
+
+    anomalies = pd.concat(detected_frames, ignore_index=True) if detected_frames else pd.DataFrame()
 
     print("Anomalies Detected:", len(anomalies))
-    display(anomalies)
+    show(anomalies)
     return anomalies
 
 
@@ -125,6 +140,7 @@ def main():
         for summary in summaries:
             operator_assist(summary)
             print("-", summary)
+    flush_metrics()
 
 
 if __name__ == "__main__":
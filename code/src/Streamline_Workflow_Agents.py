@@ -6,34 +6,23 @@ import pandas as pd
 import json
 import os
 import random
-from deap import base, creator, tools, algorithms
+from notification_dispatcher import NotificationDispatcher
+from feedback_store import FEEDBACK_DB, add_feedback, feedback_record
 
 
-def save_feedback(new_feedback):
+def save_feedback(new_feedback, recon_type=None, recon_info=None):
     try:
-        feedback_file_path = os.path.join(os.getcwd(), 'feedback_log.json')
-        print("Feedback File Path:", feedback_file_path)
+        print("Feedback Store:", os.path.abspath(FEEDBACK_DB))
 
-        if os.path.exists(feedback_file_path):
-            with open(feedback_file_path, 'r') as file:
-                existing_feedback = json.load(file)
-        else:
-            existing_feedback = {}
+        records = [feedback_record(value.get('anomaly_details', {}), recon_type, recon_info,
+                                   value.get('feedback_type'), value.get('comments', ''), anomaly_ref=key)
+                   for key, value in new_feedback.items()]
+        add_feedback(records)
 
-        for key, value in new_feedback.items():
-            if key not in existing_feedback:
-                existing_feedback[key] = value
-
-        with open(feedback_file_path, 'w') as file:
-            json.dump(existing_feedback, file, indent=4)
-
-        print('Success:')("Feedback successfully saved!")
-        # Removed Streamlit-specific session state = None
-        # Removed Streamlit-specific session state = ''
-        # Removed Streamlit-specific session state = ''
+        print("Success: Feedback successfully saved!")
 
     except Exception as e:
-        print('Error:')(f"Failed to save feedback: {e}")
+        print(f"Error: Failed to save feedback: {e}")
 
 
 def load_anomalies(file_path):
@@ -42,7 +31,7 @@ def load_anomalies(file_path):
         print("Available Columns:", df.columns)
         return df
     except Exception as e:
-        print('Error:')(f"Failed to load anomalies: {e}")
+        print(f"Error: Failed to load anomalies: {e}")
         return pd.DataFrame()
 
 
@@ -64,6 +53,7 @@ def evaluate(individual):
 
 
 def run_genetic_algorithm():
+    from deap import base, creator, tools, algorithms
     creator.create("FitnessMax", base.Fitness, weights=(1.0,))
     creator.create("Individual", list, fitness=creator.FitnessMax)
 
@@ -81,55 +71,45 @@ def run_genetic_algorithm():
     algorithms.eaSimple(population, toolbox, cxpb=0.5, mutpb=0.2, ngen=10, verbose=True)
 
 
-import requests
-from smtplib import SMTP
-
 def create_resolution_task(summary):
     print(f"Creating resolution task for: {summary}")
 
 
-def call_api(summary):
+def call_api(dispatcher, summary):
     print(f"Calling API for: {summary}")
     # Example API call placeholder
-    try:
-        response = requests.post("https://example-api.com/resolve", json={"summary": summary})
-        print("API Response:", response.status_code)
-    except Exception as e:
-        print("API call failed:", e)
+    return dispatcher.call_api(json={"summary": summary}, url="https://example-api.com/resolve")
 
 
-def send_email(summary):
+def send_email(dispatcher, summary):
     print(f"Sending email for: {summary}")
-    try:
-        with SMTP('smtp.example.com') as smtp:
-            smtp.sendmail("from@example.com", "to@example.com", f"Subject: Resolution Task
-{summary}")
-    except Exception as e:
-        print("Email failed:", e)
+    dispatcher.queue_email("Resolution Task", summary)
 
 
 def create_ticket(summary):
     print(f"Creating ticket for: {summary}")
 
 
-def operator_assist(summary):
+def operator_assist(dispatcher, summary):
     create_resolution_task(summary)
-    call_api(summary)
-    send_email(summary)
+    call_api(dispatcher, summary)
+    send_email(dispatcher, summary)
     create_ticket(summary)
 
 
-def main():
+def main(anomaly_file='iHub_Reconciliation_anomaly_results.csv'):
     print("Genetic AI for Anomaly Break Resolution")
 
-    anomaly_file = 'iHub_Reconciliation_anomaly_results.csv'
     anomalies = load_anomalies(anomaly_file)
     if not anomalies.empty:
         summaries = summarize_breaks(anomalies)
         print("Generated Resolution Summaries:")
-        for summary in summaries:
-            operator_assist(summary)
-            print("-", summary)
+        with NotificationDispatcher(smtp_host='smtp.example.com', email_sender='from@example.com',
+                                    email_recipient='to@example.com') as dispatcher:
+            for summary in summaries:
+                operator_assist(dispatcher, summary)
+                print("-", summary)
+        print("Notifications:", dispatcher.stats)
 
         print("Running Genetic AI Optimization...")
         run_genetic_algorithm()
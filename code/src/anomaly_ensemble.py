@@ -0,0 +1,379 @@
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import tempfile
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import DBSCAN, KMeans, MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors, KDTree
+from scipy.stats import zscore
+from pipeline_metrics import stage
+
+
+# Detector ensemble shared by the batch detector and the scoring paths.
+# fit_ensemble returns the fitted artifacts together with the flags for the
+# training rows (identical to fitting on the whole frame); score_ensemble
+# applies the same artifacts to rows that were not part of the fit.
+
+DETECTOR_COLUMNS = ['Z_Anomaly', 'IF_Anomaly', 'DBSCAN_Anomaly', 'KMeans_Anomaly']
+
+Z_THRESHOLD = 3
+KMEANS_PERCENTILE = 95
+DBSCAN_EPS = 0.5
+DBSCAN_MIN_SAMPLES = 5
+
+# "large" detector profile limits
+DENSITY_SAMPLE_ROWS = 50000
+MINIBATCH_SIZE = 4096
+AGREEMENT_SAMPLE_ROWS = 20000
+FOREST_CHUNK_ROWS = 10000
+
+
+# Engineered columns listed under "feature_columns" (e.g. "GL Balance_Diff")
+# join the model inputs when present, as they are in the pipeline graph
+
+def select_target_columns(recon_info, columns):
+    target_columns = recon_info['criteria_columns'] + recon_info['derived_columns'] + recon_info.get('feature_columns', [])
+    return [col for col in target_columns if col in columns]
+
+
+# Model inputs: float64 by default; "float32_model": true halves the matrix
+# (and the scaled copy) for large recons
+
+def model_dtype(recon_info):
+    return np.float32 if recon_info.get('float32_model', False) else None
+
+
+def model_matrix(data, target_columns, dtype=None):
+    if dtype is None:
+        return data[target_columns].fillna(0).to_numpy()
+    return data[target_columns].to_numpy(dtype=dtype, na_value=0)
+
+
+# Fit. Each detector is fitted by its own function on the standardized
+# matrix so the detectors can run serially or in separate worker processes
+# with the same results.
+
+def fit_zscore(scaled_data, n_jobs=None):
+    # Statistical Anomaly Detection
+    z_scores = np.abs(zscore(scaled_data))
+    z_anomalies = (z_scores > Z_THRESHOLD).any(axis=1)
+    return {'z_mean': scaled_data.mean(axis=0), 'z_std': scaled_data.std(axis=0)}, z_anomalies
+
+
+def fit_isolation_forest(scaled_data, n_jobs=None):
+    # Isolation Forest
+    iso_forest = IsolationForest(contamination=0.05, random_state=42, n_jobs=n_jobs)
+    iso_labels = iso_forest.fit_predict(scaled_data)
+    return {'iso_forest': iso_forest}, iso_labels == -1
+
+
+def fit_dbscan(scaled_data, n_jobs=None):
+    # DBSCAN (core samples are kept so new rows can be judged against them)
+    dbscan = DBSCAN(eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES, n_jobs=n_jobs)
+    dbscan_labels = dbscan.fit_predict(scaled_data)
+    return {'dbscan_eps': dbscan.eps, 'dbscan_core_indices': dbscan.core_sample_indices_}, dbscan_labels == -1
+
+
+def fit_kmeans(scaled_data, n_jobs=None):
+    # K-Means
+    kmeans = KMeans(n_clusters=3, random_state=42)
+    kmeans.fit(scaled_data)
+    distances = np.linalg.norm(scaled_data - kmeans.cluster_centers_[kmeans.labels_], axis=1)
+    kmeans_cutoff = np.percentile(distances, KMEANS_PERCENTILE)
+    return {'kmeans': kmeans, 'kmeans_cutoff': kmeans_cutoff}, distances > kmeans_cutoff
+
+
+# "large" profile: DBSCAN's noise rule evaluated with KD-trees instead of
+# materialized neighbourhoods. A row is a core point when its min_samples-th
+# nearest neighbour (itself included) lies within eps, DBSCAN's own rule with
+# its fixed min_samples. Core points are first looked for in a sample and
+# rows within eps of one are not noise; the remaining rows are settled
+# exactly (noise unless the row or a neighbour within eps is a core point),
+# so the flags equal DBSCAN's noise label at any size.
+
+def fit_density_outliers(scaled_data, n_jobs=None):
+    n_rows = len(scaled_data)
+    scaled_data = np.asarray(scaled_data)
+    if n_rows < DBSCAN_MIN_SAMPLES:
+        return {'dbscan_eps': DBSCAN_EPS, 'dbscan_core_indices': np.array([], dtype=np.intp)}, \
+            np.ones(n_rows, dtype=bool)
+    if n_rows > DENSITY_SAMPLE_ROWS:
+        rng = np.random.default_rng(42)
+        sample_idx = np.sort(rng.choice(n_rows, DENSITY_SAMPLE_ROWS, replace=False))
+    else:
+        sample_idx = np.arange(n_rows)
+
+    tree = KDTree(scaled_data)
+
+    def nearest(rows):
+        return tree.query(scaled_data[rows], k=DBSCAN_MIN_SAMPLES)
+
+    core_indices = sample_idx[nearest(sample_idx)[0][:, -1] <= DBSCAN_EPS]
+    noise = np.ones(n_rows, dtype=bool)
+    if len(core_indices):
+        distances, _ = KDTree(scaled_data[core_indices]).query(scaled_data, k=1)
+        noise = distances[:, 0] > DBSCAN_EPS
+
+    # Non-core rows have fewer than min_samples rows within eps, so all of
+    # their neighbours are among their min_samples nearest
+    candidates = np.flatnonzero(noise)
+    if len(candidates):
+        distances, neighbours = nearest(candidates)
+        within = distances <= DBSCAN_EPS
+        is_core = within[:, -1]
+        nearby = np.unique(neighbours[within & ~is_core[:, None]])
+        nearby_core = nearby[nearest(nearby)[0][:, -1] <= DBSCAN_EPS] if len(nearby) else nearby
+        reached = is_core | (within & np.isin(neighbours, nearby_core)).any(axis=1)
+        noise[candidates[reached]] = False
+        core_indices = np.union1d(core_indices, np.union1d(candidates[is_core], nearby_core))
+    return {'dbscan_eps': DBSCAN_EPS, 'dbscan_core_indices': core_indices}, noise
+
+
+def fit_minibatch_kmeans(scaled_data, n_jobs=None):
+    # Mini-batch K-Means
+    kmeans = MiniBatchKMeans(n_clusters=3, random_state=42, batch_size=MINIBATCH_SIZE, n_init=3)
+    kmeans.fit(scaled_data)
+    distances = np.linalg.norm(scaled_data - kmeans.cluster_centers_[kmeans.labels_], axis=1)
+    kmeans_cutoff = np.percentile(distances, KMEANS_PERCENTILE)
+    return {'kmeans': kmeans, 'kmeans_cutoff': kmeans_cutoff}, distances > kmeans_cutoff
+
+
+DETECTOR_FITS = {
+    'Z_Anomaly': fit_zscore,
+    'IF_Anomaly': fit_isolation_forest,
+    'DBSCAN_Anomaly': fit_dbscan,
+    'KMeans_Anomaly': fit_kmeans
+}
+
+DETECTOR_PROFILES = {
+    'exact': DETECTOR_FITS,
+    'large': dict(DETECTOR_FITS, DBSCAN_Anomaly=fit_density_outliers, KMeans_Anomaly=fit_minibatch_kmeans)
+}
+
+
+def detector_fits(profile='exact'):
+    if profile not in DETECTOR_PROFILES:
+        raise ValueError(f"Unknown detector profile '{profile}'. Expected one of {sorted(DETECTOR_PROFILES)}.")
+    return DETECTOR_PROFILES[profile]
+
+
+# Parallel fit: the standardized matrix is written once to a memory-mapped
+# .npy file (on /dev/shm when available) and every worker maps it read-only
+# instead of receiving a pickled copy.
+
+def _shared_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def _fit_mapped(detector, matrix_path, n_jobs, profile):
+    scaled_data = np.load(matrix_path, mmap_mode='r')
+    return detector_fits(profile)[detector](scaled_data, n_jobs)
+
+
+def _fit_detectors_parallel(scaled_data, executor, n_jobs, profile):
+    work_dir = tempfile.mkdtemp(prefix='anomalyze-', dir=_shared_dir())
+    try:
+        matrix_path = os.path.join(work_dir, 'scaled.npy')
+        np.save(matrix_path, scaled_data)
+        futures = {detector: executor.submit(_fit_mapped, detector, matrix_path, n_jobs, profile)
+                   for detector in detector_fits(profile)}
+        return {detector: future.result() for detector, future in futures.items()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _fit_timed(detector, fit, scaled_data, n_jobs):
+    with stage(f"fit_{detector}", rows_in=len(scaled_data)) as s:
+        artifacts, flags = fit(scaled_data, n_jobs)
+        s.flagged({detector: flags.sum()})
+    return artifacts, flags
+
+
+def fit_ensemble(values, n_jobs=None, executor=None, profile='exact', scaler=None):
+    # Standardize data (a given scaler is already fitted, e.g. on moments
+    # merged across the shards of a partitioned run)
+    if scaler is None:
+        scaler = StandardScaler()
+        scaled_data = scaler.fit_transform(values)
+    else:
+        scaled_data = scaler.transform(values)
+
+    if executor is None:
+        results = {detector: _fit_timed(detector, fit, scaled_data, n_jobs)
+                   for detector, fit in detector_fits(profile).items()}
+    else:
+        results = _fit_detectors_parallel(scaled_data, executor, n_jobs, profile)
+
+    ensemble = {'scaler': scaler, 'n_train': len(scaled_data), 'profile': profile}
+    flags = {}
+    for detector, (artifacts, detector_flags) in results.items():
+        ensemble.update(artifacts)
+        flags[detector] = detector_flags
+    ensemble['dbscan_core'] = scaled_data[ensemble.pop('dbscan_core_indices')]
+    return ensemble, flags
+
+
+# Agreement of the "large" profile with the exact detectors, measured on a
+# sample small enough for exact DBSCAN and full-batch KMeans.
+
+def compare_profiles(values, sample_rows=AGREEMENT_SAMPLE_ROWS):
+    if len(values) > sample_rows:
+        rng = np.random.default_rng(42)
+        values = values[np.sort(rng.choice(len(values), sample_rows, replace=False))]
+    scaled_data = StandardScaler().fit_transform(values)
+
+    report = {'sample_rows': len(scaled_data), 'detectors': {}}
+    for detector in ['DBSCAN_Anomaly', 'KMeans_Anomaly']:
+        _, exact = DETECTOR_PROFILES['exact'][detector](scaled_data)
+        _, large = DETECTOR_PROFILES['large'][detector](scaled_data)
+        either = np.sum(exact | large)
+        report['detectors'][detector] = {
+            'agreement': round(float(np.mean(exact == large)), 4),
+            'jaccard': round(float(np.sum(exact & large) / either), 4) if either else 1.0,
+            'exact_flagged': int(exact.sum()),
+            'large_flagged': int(large.sum())
+        }
+    return report
+
+
+# Score rows with an already fitted ensemble
+
+def _dbscan_noise(ensemble, scaled_data):
+    core = ensemble['dbscan_core']
+    if len(core) == 0:
+        return np.ones(len(scaled_data), dtype=bool)
+    if 'dbscan_index' not in ensemble:
+        ensemble['dbscan_index'] = NearestNeighbors(n_neighbors=1).fit(core)
+    distances, _ = ensemble['dbscan_index'].kneighbors(scaled_data)
+    return distances[:, 0] > ensemble['dbscan_eps']
+
+
+# IsolationForest flattened into one node table, so a small batch walks all
+# trees at once in NumPy instead of dispatching every tree through joblib.
+# Leaves point to themselves and carry their depth plus the expected path
+# length of their samples; the flags equal IsolationForest.predict.
+
+def _average_path_length(n_samples):
+    n_samples = np.asarray(n_samples, dtype=float)
+    lengths = np.where(n_samples <= 2, n_samples - 1, 0.0).clip(min=0)
+    large = n_samples > 2
+    lengths[large] = 2.0 * (np.log(n_samples[large] - 1.0) + np.euler_gamma) \
+        - 2.0 * (n_samples[large] - 1.0) / n_samples[large]
+    return lengths
+
+
+def compile_forest(iso_forest):
+    features, thresholds, children, leaf_depths, roots = [], [], [], [], []
+    offset = 0
+    for tree, tree_features in zip(iso_forest.estimators_, iso_forest.estimators_features_):
+        nodes = tree.tree_
+        left, right = nodes.children_left, nodes.children_right
+        is_leaf = left == -1
+        depth = np.zeros(nodes.node_count)
+        for node in range(nodes.node_count):
+            if not is_leaf[node]:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+        own = np.arange(nodes.node_count)
+        features.append(np.where(is_leaf, 0, np.asarray(tree_features)[np.maximum(nodes.feature, 0)]))
+        thresholds.append(np.where(is_leaf, np.inf, nodes.threshold))
+        children.append(np.stack([np.where(is_leaf, own, left), np.where(is_leaf, own, right)]) + offset)
+        leaf_depths.append(np.where(is_leaf, depth + _average_path_length(nodes.n_node_samples), 0.0))
+        roots.append(offset)
+        offset += nodes.node_count
+    return {'feature': np.concatenate(features), 'threshold': np.concatenate(thresholds),
+            'children': np.concatenate(children, axis=1), 'leaf_depth': np.concatenate(leaf_depths),
+            'roots': np.array(roots), 'max_depth': max(tree.get_depth() for tree in iso_forest.estimators_),
+            'normalizer': len(iso_forest.estimators_) * _average_path_length([iso_forest.max_samples_])[0],
+            'offset': iso_forest.offset_}
+
+
+def forest_outliers(forest, scaled_data):
+    # Trees split on float32 values, as IsolationForest.predict does
+    values = np.asarray(scaled_data, dtype=np.float32)
+    depths = np.empty(len(values))
+    for start in range(0, len(values), FOREST_CHUNK_ROWS):
+        chunk = values[start:start + FOREST_CHUNK_ROWS]
+        rows = np.arange(len(chunk))[:, None]
+        nodes = np.broadcast_to(forest['roots'], (len(chunk), len(forest['roots'])))
+        for _ in range(forest['max_depth']):
+            goes_right = chunk[rows, forest['feature'][nodes]] > forest['threshold'][nodes]
+            nodes = forest['children'][goes_right.astype(np.intp), nodes]
+        depths[start:start + FOREST_CHUNK_ROWS] = forest['leaf_depth'][nodes].sum(axis=1)
+    return -2.0 ** (-depths / forest['normalizer']) - forest['offset'] < 0
+
+
+def score_ensemble(ensemble, values):
+    scaled_data = ensemble['scaler'].transform(values)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.abs((scaled_data - ensemble['z_mean']) / ensemble['z_std'])
+    z_anomalies = (z_scores > Z_THRESHOLD).any(axis=1)
+
+    if 'iso_forest_compiled' in ensemble:
+        iso_anomalies = forest_outliers(ensemble['iso_forest_compiled'], scaled_data)
+    else:
+        iso_anomalies = ensemble['iso_forest'].predict(scaled_data) == -1
+
+    dbscan_anomalies = _dbscan_noise(ensemble, scaled_data)
+
+    kmeans = ensemble['kmeans']
+    labels = kmeans.predict(scaled_data)
+    distances = np.linalg.norm(scaled_data - kmeans.cluster_centers_[labels], axis=1)
+    kmeans_anomalies = distances > ensemble['kmeans_cutoff']
+
+    return {
+        'Z_Anomaly': z_anomalies,
+        'IF_Anomaly': iso_anomalies,
+        'DBSCAN_Anomaly': dbscan_anomalies,
+        'KMeans_Anomaly': kmeans_anomalies
+    }
+
+
+def apply_flags(data, flags):
+    for col in DETECTOR_COLUMNS:
+        data[col] = flags[col]
+    data['Anomaly'] = data[DETECTOR_COLUMNS].any(axis=1)
+    return data
+
+
+# Vectorized category and reason assignment. Each row's detector flags are
+# packed into a bitmask code (Z=1, IF=2, DBSCAN=4, KMeans=8) and the reason
+# string for every code is looked up from a table built once per recon.
+
+def anomaly_codes(data):
+    codes = np.zeros(len(data), dtype=np.uint8)
+    for bit, col in enumerate(DETECTOR_COLUMNS):
+        codes |= data[col].to_numpy(dtype=bool).astype(np.uint8) << bit
+    return codes
+
+
+def build_reason_table(reason_texts, separator=', '):
+    table = [reason_texts.get('No_Anomaly', '')]
+    for code in range(1, 1 << len(DETECTOR_COLUMNS)):
+        parts = [reason_texts[col] for bit, col in enumerate(DETECTOR_COLUMNS)
+                 if code >> bit & 1 and reason_texts.get(col)]
+        table.append(separator.join(parts))
+    return table
+
+
+def lookup_categorical(codes, table):
+    categories = list(dict.fromkeys(table))
+    positions = np.array([categories.index(text) for text in table])
+    return pd.Categorical.from_codes(positions[codes], categories=categories)
+
+
+SUPPRESSED_CATEGORY = "Known False Positive"
+
+
+def assign_categories(data, anomaly_category, reason_texts=None):
+    category_codes = data['Anomaly'].to_numpy(dtype=bool).astype(np.int8)
+    if 'Suppressed' in data.columns:
+        category_codes[data['Suppressed'].to_numpy(dtype=bool)] = 2
+    data['Anomaly_Category'] = pd.Categorical.from_codes(
+        category_codes, categories=["No Anomaly", anomaly_category, SUPPRESSED_CATEGORY])
+
+    if reason_texts:
+        data['Anomaly_Reason'] = lookup_categorical(anomaly_codes(data), build_reason_table(reason_texts))
+    return data
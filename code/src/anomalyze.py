@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+
+
+# Single entry point for the pipeline:
+#
+#   python anomalyze.py [--config recon_config.json] <command> [options]
+#
+# Commands: ingest, preprocess, detect, summarize, dispatch, feedback, run,
+# partition, serve. Only the standard library is imported up front; each command
+# imports the modules it needs (and through them pandas, scikit-learn,
+# matplotlib, ...) when it runs, so short jobs and --help do not pay for
+# libraries they never use.
+
+DEFAULT_CONFIG = 'recon_config.json'
+
+# Modules each command imports; also used by the startup benchmark
+COMMAND_MODULES = {
+    'ingest': ['recon_ingest'],
+    'preprocess': ['data_preprocessing'],
+    'detect': ['Anamoly_Detector'],
+    'summarize': ['Smarter_Recon_Anomalyze'],
+    'dispatch': ['Streamline_Workflow_Agents', 'notification_dispatcher'],
+    'feedback': ['feedback_store'],
+    'run': ['pipeline_graph'],
+    'partition': ['partition_runner'],
+    'serve': ['scoring_service']
+}
+
+
+def load_command_modules(command):
+    return [importlib.import_module(name) for name in COMMAND_MODULES[command]]
+
+
+def read_config(args):
+    from recon_ingest import load_config
+    if not os.path.exists(args.config):
+        raise SystemExit(f"Config file {args.config} not found; pass --config PATH.")
+    config = load_config(args.config)
+    recons = getattr(args, 'recon', None)
+    if recons:
+        missing = [name for name in recons if name not in config]
+        if missing:
+            raise SystemExit(f"Unknown recon(s) {missing} in {args.config}. Available: {sorted(config)}")
+        config = {name: config[name] for name in recons}
+    return config
+
+
+# Commands
+
+def cmd_ingest(args):
+    from recon_ingest import load_recon, print_cache_report
+    for recon_name, recon_info in read_config(args).items():
+        data = load_recon(recon_name, recon_info, use_cache=not args.no_cache)
+        print(f"Loaded {recon_name} with {len(data)} records and {len(data.columns)} columns.")
+    print_cache_report()
+
+
+def cmd_preprocess(args):
+    from data_preprocessing import preprocess
+    datasets = preprocess(read_config(args), args.plots, args.plot_dir)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for recon_name, data in datasets.items():
+            output_file = os.path.join(args.output_dir, f"{recon_name}_preprocessed.parquet")
+            data.to_parquet(output_file, index=False)
+            print(f"Saved {recon_name} features to {output_file}.")
+
+
+def cmd_detect(args):
+    from Anamoly_Detector import detect_all
+    from plot_artifacts import PLOT_DIR
+    detect_all(read_config(args), args.score_only, args.workers, args.plots, args.plot_dir or PLOT_DIR)
+
+
+def cmd_summarize(args):
+    from Smarter_Recon_Anomalyze import load_anomalies, detect_anomalies, summarize_breaks
+    config = read_config(args)
+    anomalies = load_anomalies(config)
+    summaries = summarize_breaks(detect_anomalies(anomalies, config)) if not anomalies.empty else []
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write('\n'.join(summaries) + ('\n' if summaries else ''))
+        print(f"Wrote {len(summaries)} break summaries to {args.output}.")
+    else:
+        for summary in summaries:
+            print("-", summary)
+
+
+def cmd_dispatch(args):
+    from Streamline_Workflow_Agents import load_anomalies, summarize_breaks, operator_assist
+    from notification_dispatcher import NotificationDispatcher
+    anomalies = load_anomalies(args.results)
+    if 'Anomaly' in anomalies.columns and not args.all_rows:
+        anomalies = anomalies[anomalies['Anomaly'].astype(str).str.lower().isin(['true', '1'])]
+    summaries = summarize_breaks(anomalies.head(args.limit) if args.limit else anomalies)
+    with NotificationDispatcher(stub=True if args.stub else None) as dispatcher:
+        for summary in summaries:
+            operator_assist(dispatcher, summary)
+    print("Notifications:", dispatcher.stats)
+
+
+def cmd_feedback(args):
+    import feedback_store
+    db_path = args.db or feedback_store.FEEDBACK_DB
+    if args.import_json:
+        config = read_config(args) if args.recon_type and os.path.exists(args.config) else {}
+        count = feedback_store.import_json_log(args.import_json, args.recon_type, config.get(args.recon_type),
+                                               db_path)
+        print(f"Imported {count} feedback entries from {args.import_json} into {db_path}.")
+        return
+
+    since = time.time() - args.since_days * 86400 if args.since_days else None
+    feedback = feedback_store.query_feedback(recon_type=args.recon_type, run_id=args.run_id,
+                                             feedback_types=args.type, since=since, expand=args.expand,
+                                             db_path=db_path)
+    if args.output:
+        feedback.to_csv(args.output, index=False)
+        print(f"Exported {len(feedback)} feedback entries to {args.output}.")
+    else:
+        print(feedback.to_string(index=False) if not feedback.empty else "No feedback entries match.")
+
+
+def cmd_run(args):
+    from pipeline_graph import run_pipeline, PIPELINE_DIR
+    run_pipeline(read_config(args), args.from_stage, args.to_stage, args.score_only, True if args.stub else None,
+                 args.pipeline_dir or PIPELINE_DIR)
+
+
+def cmd_partition(args):
+    from partition_runner import run_config, RUN_DIR, MAX_ATTEMPTS
+    if not run_config(read_config(args), args.shards, args.workers, args.run_dir or RUN_DIR,
+                      args.max_attempts or MAX_ATTEMPTS, args.combine, args.status):
+        raise SystemExit(1)
+
+
+def cmd_serve(args):
+    from scoring_service import serve, PORT, RELOAD_INTERVAL
+    from model_registry import REGISTRY_DIR
+    read_config(args)
+    serve(args.config, args.recon, args.host, args.port or PORT, args.socket, args.model_dir or REGISTRY_DIR,
+          RELOAD_INTERVAL if args.reload_interval is None else args.reload_interval)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='anomalyze', description="Recon anomaly detection pipeline.")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="path to recon_config.json")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help="load recon feeds and refresh the ingestion cache")
+    ingest.add_argument('--recon', action='append', help="only this recon (repeatable)")
+    ingest.add_argument('--no-cache', action='store_true', help="parse the CSVs without the ingestion cache")
+    ingest.set_defaults(handler=cmd_ingest)
+
+    # plot_artifacts.PLOT_MODES, spelled out so --help does not import numpy
+    plot_choices = ['show', 'headless', 'artifact']
+
+    preprocess = commands.add_parser('preprocess', help="clean feeds and build features")
+    preprocess.add_argument('--recon', action='append')
+    preprocess.add_argument('--plots', choices=plot_choices, default=None)
+    preprocess.add_argument('--plot-dir', default=None)
+    preprocess.add_argument('--output-dir', default=None, help="write {recon}_preprocessed.parquet files here")
+    preprocess.set_defaults(handler=cmd_preprocess)
+
+    detect = commands.add_parser('detect', help="run the detector ensemble")
+    detect.add_argument('--recon', action='append')
+    detect.add_argument('--score-only', action='store_true', help="score with registered models instead of refitting")
+    detect.add_argument('--workers', type=int, default=1)
+    detect.add_argument('--plots', choices=plot_choices, default=None)
+    detect.add_argument('--plot-dir', default=None)
+    detect.set_defaults(handler=cmd_detect)
+
+    summarize = commands.add_parser('summarize', help="apply the configured rules and summarize breaks")
+    summarize.add_argument('--recon', action='append')
+    summarize.add_argument('--output', default=None, help="write summaries to this file instead of stdout")
+    summarize.set_defaults(handler=cmd_summarize)
+
+    dispatch = commands.add_parser('dispatch', help="send resolution notifications for a detector results file")
+    dispatch.add_argument('results', help="{recon}_anomaly_results.csv")
+    dispatch.add_argument('--all-rows', action='store_true', help="include rows that were not flagged")
+    dispatch.add_argument('--limit', type=int, default=None)
+    dispatch.add_argument('--stub', action='store_true', help="record calls against fake endpoints")
+    dispatch.set_defaults(handler=cmd_dispatch)
+
+    feedback = commands.add_parser('feedback', help="query, export or import analyst feedback")
+    feedback.add_argument('--db', default=None, help="feedback database (default: ANOMALYZE_FEEDBACK_DB or feedback.db)")
+    feedback.add_argument('--recon-type', default=None)
+    feedback.add_argument('--run-id', default=None)
+    feedback.add_argument('--type', action='append', help="feedback type filter (repeatable)")
+    feedback.add_argument('--since-days', type=float, default=None)
+    feedback.add_argument('--expand', action='store_true', help="one column per key and value field")
+    feedback.add_argument('--output', default=None, help="export to CSV")
+    feedback.add_argument('--import-json', default=None, help="import a legacy feedback_log.json")
+    feedback.set_defaults(handler=cmd_feedback)
+
+    # pipeline_graph.STAGE_ORDER
+    stages = ['ingest', 'features', 'detect', 'summarize', 'dispatch']
+
+    run = commands.add_parser('run', help="run the memoized stage graph from ingestion to dispatch")
+    run.add_argument('--recon', action='append')
+    run.add_argument('--from-stage', choices=stages, default=None,
+                     help="rerun this stage and every later one even if their inputs are unchanged")
+    run.add_argument('--to-stage', choices=stages, default=None, help="stop after this stage")
+    run.add_argument('--score-only', action='store_true')
+    run.add_argument('--stub', action='store_true', help="dispatch against fake endpoints")
+    run.add_argument('--pipeline-dir', default=None, help="where stage artifacts are stored (default .pipeline_cache)")
+    run.set_defaults(handler=cmd_run)
+
+    partition = commands.add_parser('partition', help="run recons as key-partitioned shards in worker processes")
+    partition.add_argument('--recon', action='append')
+    partition.add_argument('--shards', type=int, default=None, help="shard count (default: 'shards' or 16)")
+    partition.add_argument('--workers', type=int, default=1, help="worker processes on this machine")
+    partition.add_argument('--run-dir', default=None,
+                           help="run directory shared by all machines (default partitioned_runs)")
+    partition.add_argument('--max-attempts', type=int, default=None, help="attempts per shard in this process")
+    partition.add_argument('--combine', action='store_true', help="also write {recon}_anomaly_results.csv")
+    partition.add_argument('--status', action='store_true', help="show progress of the runs instead")
+    partition.set_defaults(handler=cmd_partition)
+
+    serve = commands.add_parser('serve', help="keep registered models warm and score micro-batches over HTTP")
+    serve.add_argument('--recon', action='append')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=None, help="TCP port (default: ANOMALYZE_SERVE_PORT or 8765)")
+    serve.add_argument('--socket', default=None, help="listen on this Unix socket instead of TCP")
+    serve.add_argument('--model-dir', default=None, help="model registry to load from (default model_registry)")
+    serve.add_argument('--reload-interval', type=float, default=None,
+                       help="seconds between checks for new models (default 2; 0 disables hot reload)")
+    serve.set_defaults(handler=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+from recon_ingest import file_fingerprint
+from feedback_store import FEEDBACK_DB
+
+
+# Cache keys and hit/miss accounting for the Streamlit apps. Streamlit reruns
+# the whole script on every widget interaction; cached stages are keyed by a
+# hash of the config content and the fingerprints (path, mtime, size) of the
+# files they read, so a rerun only recomputes when an input really changed.
+
+cache_metrics = {}
+
+
+def record_call(stage):
+    cache_metrics.setdefault(stage, {'calls': 0, 'misses': 0})['calls'] += 1
+
+
+def record_miss(stage):
+    cache_metrics.setdefault(stage, {'calls': 0, 'misses': 0})['misses'] += 1
+
+
+def metrics_report():
+    report = {}
+    for stage, counts in cache_metrics.items():
+        hits = counts['calls'] - counts['misses']
+        report[stage] = {'hits': hits, 'misses': counts['misses'],
+                         'hit_rate': round(hits / counts['calls'], 4) if counts['calls'] else 0.0}
+    return report
+
+
+def content_hash(payload):
+    if isinstance(payload, bytes):
+        return hashlib.sha256(payload).hexdigest()
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _optional_fingerprint(path):
+    return file_fingerprint(path) if path and os.path.exists(path) else None
+
+
+def input_fingerprints(config):
+    return {recon_type: _optional_fingerprint(details.get('file_path')) for recon_type, details in config.items()}
+
+
+def feedback_fingerprints():
+    return [_optional_fingerprint(FEEDBACK_DB), _optional_fingerprint(f"{FEEDBACK_DB}-wal")]
+
+
+# Key for a pipeline stage: config content plus the input file fingerprints.
+# Detection also depends on the feedback store (suppression), including its
+# WAL file where recent writes land.
+
+def pipeline_key(config, include_feedback=False):
+    parts = {'config': content_hash(config), 'inputs': input_fingerprints(config)}
+    if include_feedback:
+        parts['feedback'] = feedback_fingerprints()
+    return content_hash(parts)
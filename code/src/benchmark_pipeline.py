@@ -0,0 +1,271 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.preprocessing import StandardScaler
+from recon_generator import generate
+from recon_ingest import load_recon
+from recon_rules import detect_with_rules
+from anomaly_ensemble import select_target_columns, model_matrix, detector_fits, apply_flags, assign_categories
+from pipeline_metrics import PeakSampler
+
+
+# Scaling benchmark for the detection pipeline. Synthetic iHub feeds of
+# increasing size (and, optionally, extra numeric feature columns) are run
+# through each stage of Anamoly_Detector and the rule engine used by
+# Smart_Recon_App; every stage records wall time, CPU time and peak RSS growth.
+# Results are written as JSON, and --compare checks a run against a saved
+# baseline and exits non-zero when a stage regresses beyond the tolerance.
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_WIDTHS = [0]
+STAGES = ['load', 'load_cached', 'scale', 'zscore', 'isolation_forest', 'dbscan', 'kmeans', 'reasons', 'rules',
+          'save']
+DETECTOR_STAGES = {'zscore': 'Z_Anomaly', 'isolation_forest': 'IF_Anomaly', 'dbscan': 'DBSCAN_Anomaly',
+                   'kmeans': 'KMeans_Anomaly'}
+
+# Exact DBSCAN needs memory for every eps-neighbourhood; above this size the
+# stage is skipped unless the "large" profile is benchmarked
+DEFAULT_MAX_DBSCAN_ROWS = 1_000_000
+
+# Regression thresholds for --compare: relative slowdown, plus absolute floors
+# so sub-millisecond noise on small stages is not reported
+DEFAULT_TOLERANCE = 0.25
+MIN_SECONDS = 0.1
+MIN_MEMORY_MB = 16
+
+# Cold-start targets (seconds) for the anomalyze CLI, checked by --startup:
+# --help must stay on the standard library, and each command may only pay for
+# the libraries it uses (scikit-learn is expected only for detect and serve)
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'anomalyze.py')
+STARTUP_TARGETS = {'help': 0.25, 'ingest': 1.0, 'preprocess': 1.5, 'detect': 3.0, 'summarize': 1.5,
+                   'dispatch': 1.5, 'feedback': 1.0, 'run': 1.0, 'partition': 1.0, 'serve': 3.0}
+
+BENCH_RECON = {
+    'key_columns': ['Company', 'Account', 'AU', 'Currency'],
+    'criteria_columns': ['GL Balance', 'iHub Balance'],
+    'derived_columns': ['Balance Difference'],
+    'historical_columns': ['Account', 'Secondary Account', 'Primary Account'],
+    'date_columns': ['As of Date'],
+    'rules': [{'type': 'group_diff', 'columns': ['GL Balance', 'iHub Balance'], 'group_by': 'As of Date',
+               'period': 'M', 'threshold': 5000}],
+    'suppression': False
+}
+
+
+def measure(stage, fn, rows, repeat=1):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        with PeakSampler(interval=0.005) as sampler:
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            result = fn()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+        timing = {'stage': stage, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+                  'peak_rss_delta_mb': round(sampler.peak - sampler.start, 1),
+                  'rows_per_s': round(rows / wall) if wall > 0 else None}
+        if best is None or timing['wall_s'] < best['wall_s']:
+            best = timing
+    return result, best
+
+
+# Synthetic input: an iHub feed plus `width` extra numeric feature columns
+
+def bench_frame(rows, width, seed=0):
+    data = pd.concat([chunk for chunk, _ in generate('ihub', rows, keys=max(1, rows // 12), seed=seed)],
+                     ignore_index=True)
+    rng = np.random.default_rng([seed, width])
+    for i in range(width):
+        data[f"Feature_{i}"] = rng.normal(0, 1, rows).round(4)
+    return data
+
+
+def bench_recon(file_path, width):
+    recon_info = dict(BENCH_RECON, file_path=file_path)
+    recon_info['criteria_columns'] = BENCH_RECON['criteria_columns'] + [f"Feature_{i}" for i in range(width)]
+    return recon_info
+
+
+def run_size(rows, width, work_dir, profile='exact', repeat=1, max_dbscan_rows=DEFAULT_MAX_DBSCAN_ROWS,
+             n_jobs=None):
+    file_path = os.path.join(work_dir, f"bench_{rows}_{width}.csv")
+    bench_frame(rows, width).to_csv(file_path, index=False)
+    recon_info = bench_recon(file_path, width)
+    cache_dir = os.path.join(work_dir, 'cache')
+    results = []
+
+    def record(stage, fn):
+        result, timing = measure(stage, fn, rows, repeat)
+        results.append(dict(timing, rows=rows, width=width, profile=profile))
+        print(f"{rows:>11} rows  width {width:>3}  {stage:<17} {timing['wall_s']:>9.3f}s  "
+              f"cpu {timing['cpu_s']:>9.3f}s  +{timing['peak_rss_delta_mb']:>8.1f} MB")
+        return result
+
+    data = record('load', lambda: load_recon('bench', recon_info, use_cache=False))
+    load_recon('bench', recon_info, cache_dir=cache_dir)
+    record('load_cached', lambda: load_recon('bench', recon_info, cache_dir=cache_dir))
+
+    target_columns = select_target_columns(recon_info, data.columns)
+    values = model_matrix(data, target_columns)
+    scaled = record('scale', lambda: StandardScaler().fit_transform(values))
+
+    fits = detector_fits(profile)
+    flags = {}
+    for stage, detector in DETECTOR_STAGES.items():
+        if stage == 'dbscan' and profile == 'exact' and rows > max_dbscan_rows:
+            print(f"{rows:>11} rows  width {width:>3}  {stage:<17} skipped (above --max-dbscan-rows)")
+            results.append({'stage': stage, 'rows': rows, 'width': width, 'profile': profile, 'skipped': True})
+            flags[detector] = np.zeros(rows, dtype=bool)
+            continue
+        flags[detector] = record(stage, lambda fit=fits[detector]: fit(scaled, n_jobs)[1])
+
+    def reasons():
+        apply_flags(data, flags)
+        return assign_categories(data, "New Anomaly Detected", {col: col for col in flags})
+
+    record('reasons', reasons)
+    record('rules', lambda: detect_with_rules('bench', recon_info, data))
+    record('save', lambda: data.to_csv(os.path.join(work_dir, 'bench_results.csv'), index=False))
+
+    os.remove(file_path)
+    return results
+
+
+def environment():
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, widths=DEFAULT_WIDTHS, profile='exact', repeat=1,
+                  max_dbscan_rows=DEFAULT_MAX_DBSCAN_ROWS, n_jobs=None):
+    work_dir = tempfile.mkdtemp(prefix='anomalyze_bench_')
+    try:
+        results = []
+        for width in widths:
+            for rows in sizes:
+                results.extend(run_size(rows, width, work_dir, profile, repeat, max_dbscan_rows, n_jobs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'environment': environment(), 'settings': {'profile': profile, 'repeat': repeat, 'n_jobs': n_jobs},
+            'results': results}
+
+
+# Cold start: each command's imports are timed in a fresh interpreter
+
+def startup_command(command):
+    if command == 'help':
+        return [sys.executable, CLI_PATH, '--help']
+    code = f"import anomalyze; anomalyze.load_command_modules({command!r})"
+    return [sys.executable, '-c', code]
+
+
+def run_startup(targets=STARTUP_TARGETS, repeat=3):
+    env = dict(os.environ, MPLBACKEND='Agg',
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(CLI_PATH), os.environ.get('PYTHONPATH')])))
+    results = []
+    for command, target in targets.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(startup_command(command), env=env, check=True, stdout=subprocess.DEVNULL)
+            wall = time.perf_counter() - start
+            best = wall if best is None else min(best, wall)
+        result = {'command': command, 'wall_s': round(best, 4), 'target_s': target, 'ok': best <= target}
+        results.append(result)
+        print(f"{command:<11} {best:>7.3f}s  target {target:>5.2f}s  {'ok' if result['ok'] else 'OVER TARGET'}")
+    return {'environment': environment(), 'settings': {'repeat': repeat}, 'startup': results}
+
+
+# Regression check against a baseline run
+
+def _keyed(report):
+    return {(r['rows'], r['width'], r['profile'], r['stage']): r for r in report['results'] if not r.get('skipped')}
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE, min_seconds=MIN_SECONDS, min_memory_mb=MIN_MEMORY_MB):
+    base_results = _keyed(baseline)
+    regressions = []
+    for key, result in _keyed(current).items():
+        base = base_results.get(key)
+        if base is None:
+            continue
+        checks = [('wall_s', min_seconds), ('peak_rss_delta_mb', min_memory_mb)]
+        for metric, floor in checks:
+            before, after = base[metric], result[metric]
+            if after - before > floor and after > before * (1 + tolerance):
+                regressions.append({'rows': key[0], 'width': key[1], 'profile': key[2], 'stage': key[3],
+                                    'metric': metric, 'baseline': before, 'current': after,
+                                    'ratio': round(after / before, 2) if before > 0 else None})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline stages at increasing data sizes.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated row counts, e.g. 10000,100000,1000000,10000000")
+    parser.add_argument('--widths', default=','.join(map(str, DEFAULT_WIDTHS)),
+                        help="comma-separated counts of extra numeric feature columns")
+    parser.add_argument('--profile', choices=['exact', 'large'], default='exact')
+    parser.add_argument('--repeat', type=int, default=1, help="runs per stage; the fastest is kept")
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--max-dbscan-rows', type=int, default=DEFAULT_MAX_DBSCAN_ROWS)
+    parser.add_argument('--output', default=None,
+                        help="results JSON (default: benchmark_results.json, or startup_results.json with --startup)")
+    parser.add_argument('--compare', default=None, help="baseline JSON to check this run against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--startup', action='store_true',
+                        help="time the anomalyze CLI cold start per command against STARTUP_TARGETS instead")
+    parser.add_argument('--startup-target', type=float, default=None,
+                        help="one target in seconds for every command (with --startup)")
+    args = parser.parse_args()
+    args.output = args.output or ('startup_results.json' if args.startup else 'benchmark_results.json')
+
+    if args.startup:
+        targets = {command: args.startup_target or target for command, target in STARTUP_TARGETS.items()}
+        report = run_startup(targets, max(args.repeat, 3))
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+        print(f"Startup results saved to {args.output}.")
+        if not all(r['ok'] for r in report['startup']):
+            sys.exit(1)
+        return
+
+    report = run_benchmark([int(size) for size in args.sizes.split(',')],
+                           [int(width) for width in args.widths.split(',')],
+                           args.profile, args.repeat, args.max_dbscan_rows, args.n_jobs)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"Benchmark results saved to {args.output}.")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, report, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['stage']} ({r['rows']} rows, width {r['width']}, {r['profile']}): "
+                  f"{r['metric']} {r['baseline']} -> {r['current']} (x{r['ratio']})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,87 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import json
-
-# Load configuration
-with open('recon_config.json', 'r') as file:
-    config = json.load(file)
-
-# Load reconciliation datasets
-datasets = {}
-for recon_name, recon_info in config.items():
-    datasets[recon_name] = pd.read_csv(recon_info['file_path'])
-    print(f"Loaded {recon_name} data with {len(datasets[recon_name])} records.")
-
-# Data Cleaning - Handling missing values
-for recon_name, data in datasets.items():
-    data.fillna('Unknown', inplace=True)
-
-# Feature Engineering
-for recon_name, recon_info in config.items():
-    data = datasets[recon_name]
-
-    # Convert relevant columns to numeric if applicable
-    for col in recon_info['criteria_columns'] + recon_info['derived_columns']:
-        if col in data.columns:
-            data[col] = pd.to_numeric(data[col], errors='coerce')
-        else:
-            print(f"Warning: '{col}' not found in {recon_name} dataset. Skipping.")
+import argparse
+from recon_ingest import load_config, load_recon, convert_types, print_cache_report
+from feature_engine import fill_missing, build_features
+from recon_dates import normalize_dates
+from pipeline_metrics import stage, flush as flush_metrics
+from plot_artifacts import PLOT_MODES, plot_mode, numeric_histogram, show_histogram, ArtifactRenderer
 
-    # Calculate differences for criteria columns
-    for col in recon_info['criteria_columns']:
-        if col in data.columns and pd.api.types.is_numeric_dtype(data[col]):
-            diff_col = f"{col}_Diff"
-            data[diff_col] = data[col].diff().fillna(0).abs()
-        else:
-            print(f"Warning: '{col}' not found or not numeric in {recon_name}. Skipping.")
 
-    # Normalize differences for derived columns
-    for col in recon_info['derived_columns']:
-        if col in data.columns and pd.api.types.is_numeric_dtype(data[col]):
-            norm_col = f"Normalized_{col}_Diff"
-            data[norm_col] = data[col].abs() / (data[col].mean() + 1e-5)
-        else:
-            print(f"Warning: '{col}' not found or not numeric in {recon_name}. Skipping.")
+# Load reconciliation datasets (only the configured columns are needed here)
+
+def load_datasets(config):
+    datasets = {}
+    for recon_name, recon_info in config.items():
+        with stage('load', recon=recon_name) as s:
+            datasets[recon_name] = load_recon(recon_name, recon_info, project=True)
+            s.rows_out(len(datasets[recon_name]))
+        print(f"Loaded {recon_name} data with {len(datasets[recon_name])} records.")
+    print_cache_report()
+    return datasets
+
+
+# Data Cleaning - date columns parsed with the recon's date_formats, missing
+# values filled by column type, so numeric columns keep their dtype
+
+def clean(recon_name, recon_info, data):
+    normalize_dates(recon_name, recon_info, data)
+    with stage('clean', rows_in=len(data), recon=recon_name):
+        fill_missing(data, recon_info)
+    return data
+
+
+# Feature Engineering - per-key diffs, lags and rolling statistics declared
+# under "features" in recon_config.json (see feature_engine)
+
+def engineer_features(recon_name, recon_info, data):
+    with stage('features', rows_in=len(data), recon=recon_name) as s:
+        convert_types(data, recon_info)
+        build_features(recon_name, recon_info, data)
+        s.rows_out(len(data))
+    return data
 
-    # Feature for historical pattern check
-    for hist_col in recon_info['historical_columns']:
-        if hist_col in data.columns:
-            data[f"Is_Historical_{hist_col}"] = data[hist_col].duplicated(keep=False).astype(int)
+
+# Data Exploration (headless skips it, artifact writes PNGs). The histogram
+# is binned column by column instead of stacking every cell.
+
+def plot_distributions(datasets, mode=None, plot_dir=None):
+    mode = plot_mode(mode)
+    if mode == 'headless':
+        return []
+    renderer = ArtifactRenderer(*([plot_dir] if plot_dir else [])) if mode == 'artifact' else None
+    for recon_name, data in datasets.items():
+        counts, edges = numeric_histogram(data, bins=20)
+        title = f"Distribution of Numeric Differences - {recon_name}"
+        if renderer is not None:
+            renderer.histogram(counts, edges, f"{recon_name}_numeric_distribution", title)
         else:
-            print(f"Warning: '{hist_col}' not found in {recon_name} dataset. Skipping.")
-
-# Data Exploration
-for recon_name, data in datasets.items():
-    plt.figure(figsize=(10, 6))
-    sns.histplot(data.select_dtypes(include=np.number).stack(), bins=20, kde=True)
-    plt.title(f"Distribution of Numeric Differences - {recon_name}")
-    plt.xlabel("Value")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.show()
-
-print("Configurable Data Ingestion and Preprocessing Completed!")
+            show_histogram(counts, edges, title)
+    if renderer is None:
+        return []
+    paths = renderer.close()
+    print(f"Wrote {len(paths)} plots to {renderer.plot_dir}.")
+    return paths
+
+
+def preprocess(config, plots=None, plot_dir=None):
+    datasets = load_datasets(config)
+    for recon_name, recon_info in config.items():
+        clean(recon_name, recon_info, datasets[recon_name])
+        engineer_features(recon_name, recon_info, datasets[recon_name])
+    plot_distributions(datasets, plots, plot_dir)
+    flush_metrics()
+    return datasets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Configurable data ingestion and preprocessing.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--plots', choices=PLOT_MODES, default=None)
+    parser.add_argument('--plot-dir', default=None)
+    args = parser.parse_args(argv)
+
+    preprocess(load_config(args.config), args.plots, args.plot_dir)
+    print("Configurable Data Ingestion and Preprocessing Completed!")
+
+
+if __name__ == "__main__":
+    main()
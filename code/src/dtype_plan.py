@@ -0,0 +1,137 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# Compact dtypes for recon frames, planned from recon_config.json. With
+# "dtype_plan": true (or a dict of options) on a recon, its key_columns and
+# historical_columns become categoricals, other text columns do too when their
+# values repeat (distinct values at most category_ratio of the rows), and
+# integer columns are downcast to the smallest type that holds them. Float
+# columns are left alone so detector inputs do not change; the model matrix
+# can be built as float32 separately with "float32_model". The plan is applied
+# by the ingestion layer, so the detector, preprocessing, the Streamlit apps
+# and the pipeline graph all see the same dtypes.
+
+DEFAULT_OPTIONS = {'category_ratio': 0.5, 'categorical': [], 'downcast_integers': True}
+INTEGER_TYPES = [np.int8, np.int16, np.int32]
+
+
+def plan_options(recon_info):
+    options = recon_info.get('dtype_plan')
+    if not options:
+        return None
+    return {**DEFAULT_OPTIONS, **(options if isinstance(options, dict) else {})}
+
+
+def categorical_columns(recon_info, options):
+    columns = list(recon_info.get('key_columns', [])) + list(options['categorical'])
+    for entry in recon_info.get('historical_columns', []):
+        columns.extend([entry] if isinstance(entry, str) else entry)
+    return set(columns)
+
+
+# Smallest integer type that holds the values and their differences, so
+# diffs and period-over-period rules cannot overflow
+
+def smallest_integer(values):
+    if values.empty:
+        return None
+    low, high = int(values.min()), int(values.max())
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max and high - low <= info.max:
+            return np.dtype(dtype)
+    return None
+
+
+# Target dtype per column that should change
+
+def plan_dtypes(data, recon_info):
+    options = plan_options(recon_info)
+    if options is None:
+        return {}
+    categorical = categorical_columns(recon_info, options)
+    plan = {}
+    for col in data.columns:
+        dtype = data[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype) \
+                or pd.api.types.is_datetime64_any_dtype(dtype):
+            continue
+        is_text = pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+        if col in categorical or (is_text and data[col].nunique() <= options['category_ratio'] * len(data)):
+            plan[col] = 'category'
+        elif options['downcast_integers'] and pd.api.types.is_integer_dtype(dtype) \
+                and not pd.api.types.is_extension_array_dtype(dtype):
+            target = smallest_integer(data[col])
+            if target is not None and target.itemsize < dtype.itemsize:
+                plan[col] = target
+    return plan
+
+
+def apply_plan(data, recon_info, plan=None):
+    plan = plan_dtypes(data, recon_info) if plan is None else plan
+    for col, dtype in plan.items():
+        if col in data.columns:
+            data[col] = data[col].astype(dtype)
+    return data
+
+
+# One plan for every chunk of a streamed feed, derived from its first chunk.
+# Integer downcasts use the whole column's (low, high) from ranges, e.g. the
+# Parquet statistics; without a range the first chunk cannot tell whether a
+# later chunk overflows, so the column keeps its type.
+
+def stream_plan(first_chunk, recon_info, ranges=None):
+    plan = plan_dtypes(first_chunk, recon_info)
+    ranges = ranges or {}
+    for col, dtype in list(plan.items()):
+        if dtype == 'category':
+            continue
+        target = smallest_integer(pd.Series(ranges[col])) if col in ranges else None
+        if target is not None and target.itemsize < first_chunk[col].dtype.itemsize:
+            plan[col] = target
+        else:
+            del plan[col]
+    return plan
+
+
+def frame_mb(data):
+    return data.memory_usage(deep=True).sum() / 2 ** 20
+
+
+# Memory of each configured feed with default and planned dtypes
+
+def memory_report(recon_name, recon_info):
+    from recon_ingest import load_recon
+    data = load_recon(recon_name, dict(recon_info, dtype_plan=False))
+    before = data.memory_usage(deep=True)
+    plan = plan_dtypes(data, dict(recon_info, dtype_plan=recon_info.get('dtype_plan') or True))
+    after = data.astype(plan).memory_usage(deep=True)
+    columns = [{'column': col, 'dtype': str(data[col].dtype), 'planned': str(plan.get(col, data[col].dtype)),
+                'mb_before': round(before[col] / 2 ** 20, 3), 'mb_after': round(after[col] / 2 ** 20, 3)}
+               for col in data.columns]
+    return {'recon': recon_name, 'rows': len(data), 'mb_before': round(before.sum() / 2 ** 20, 2),
+            'mb_after': round(after.sum() / 2 ** 20, 2), 'ratio': round(before.sum() / after.sum(), 2),
+            'columns': columns}
+
+
+def main():
+    from recon_ingest import load_config
+    parser = argparse.ArgumentParser(description="Report frame memory with default and planned dtypes.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--columns', action='store_true', help="show every column")
+    args = parser.parse_args()
+
+    for recon_name, recon_info in load_config(args.config).items():
+        report = memory_report(recon_name, recon_info)
+        print(f"{recon_name}: {report['rows']} rows, {report['mb_before']:.2f} MB -> {report['mb_after']:.2f} MB "
+              f"({report['ratio']:.1f}x smaller)")
+        if args.columns:
+            for col in report['columns']:
+                print(f"  {col['column']:<30} {col['dtype']:>10} -> {col['planned']:<10} "
+                      f"{col['mb_before']:>9.3f} MB -> {col['mb_after']:.3f} MB")
+
+
+if __name__ == "__main__":
+    main()
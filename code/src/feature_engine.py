@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from recon_dates import date_values
+
+
+# Feature engine for recon feeds. Missing values are filled per column type
+# (text and categorical columns get a placeholder, numeric columns keep NaN
+# unless a fill value is configured) so numeric columns are never upcast to
+# object. Features are declared per recon under "features" in
+# recon_config.json:
+#
+#   {"type": "diff", "columns": ["GL Balance"], "periods": 1, "abs": true, "fill": 0}
+#   {"type": "lag", "columns": ["GL Balance"], "periods": 1}
+#   {"type": "rolling_mean", "columns": ["GL Balance"], "window": 3}   (also rolling_std/min/max/sum)
+#   {"type": "ratio_to_mean", "columns": ["Balance Difference"]}
+#   {"type": "is_historical", "columns": ["Account"]}
+#
+# Diffs, lags and rolling statistics are computed within each key_columns
+# group, ordered by the first date column, with grouped vectorized operations;
+# the output keeps the input row order. Without "features", the legacy set
+# ({col}_Diff, Normalized_{col}_Diff, Is_Historical_{col}) is built, now per key.
+# With "history_index": true, is_historical features come from the persistent
+# history index (seen / broke on an earlier date) instead of duplicates within
+# the loaded file.
+
+DEFAULT_FILL = {'text': 'Unknown', 'numeric': None}
+ROLLING_STATS = {'rolling_mean': 'Mean', 'rolling_std': 'Std', 'rolling_min': 'Min', 'rolling_max': 'Max',
+                 'rolling_sum': 'Sum'}
+GROUPED_TYPES = {'diff', 'lag', *ROLLING_STATS}
+
+
+# Missing values by column type
+
+def fill_missing(data, recon_info):
+    fill = {**DEFAULT_FILL, **recon_info.get('fill_missing', {})}
+    for col in data.columns:
+        values = data[col]
+        if not values.hasnans:
+            continue
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if fill['text'] is not None:
+                if fill['text'] not in values.cat.categories:
+                    values = values.cat.add_categories([fill['text']])
+                data[col] = values.fillna(fill['text'])
+        elif pd.api.types.is_bool_dtype(values.dtype) or pd.api.types.is_datetime64_any_dtype(values.dtype):
+            continue
+        elif pd.api.types.is_numeric_dtype(values.dtype):
+            if fill['numeric'] is not None:
+                data[col] = values.fillna(fill['numeric'])
+        elif fill['text'] is not None:
+            data[col] = values.fillna(fill['text'])
+    return data
+
+
+# Feature definitions
+
+def legacy_features(recon_info):
+    return [
+        {'type': 'diff', 'columns': recon_info.get('criteria_columns', []), 'abs': True, 'fill': 0},
+        {'type': 'ratio_to_mean', 'columns': recon_info.get('derived_columns', [])},
+        {'type': 'is_historical', 'columns': recon_info.get('historical_columns', [])}
+    ]
+
+
+def feature_name(feature, col):
+    kind = feature['type']
+    if 'name' in feature:
+        return feature['name'].format(col=col)
+    if kind == 'diff':
+        periods = feature.get('periods', 1)
+        return f"{col}_Diff" if periods == 1 else f"{col}_Diff{periods}"
+    if kind == 'lag':
+        return f"{col}_Lag{feature.get('periods', 1)}"
+    if kind in ROLLING_STATS:
+        return f"{col}_Rolling{ROLLING_STATS[kind]}{feature['window']}"
+    if kind == 'ratio_to_mean':
+        return f"Normalized_{col}_Diff"
+    if kind == 'is_historical':
+        return f"Is_Historical_{col}"
+    raise ValueError(f"Unknown feature type '{kind}'.")
+
+
+# Row order for grouped features: stable by the first parseable date column
+# (undated rows last), file order when there is none
+
+def date_order(data, recon_info):
+    dates = date_values(data, recon_info)
+    if dates is None:
+        return np.arange(len(data))
+    return np.argsort(dates, kind='stable')
+
+
+def _grouped_values(kind, feature, grouped, col, n_keys):
+    if kind == 'diff':
+        return grouped[col].diff(feature.get('periods', 1))
+    if kind == 'lag':
+        return grouped[col].shift(feature.get('periods', 1))
+    rolling = grouped[col].rolling(feature['window'], min_periods=feature.get('min_periods', 1))
+    values = getattr(rolling, ROLLING_STATS[kind].lower())()
+    return values.droplevel(list(range(n_keys))) if n_keys else values
+
+
+def build_features(recon_name, recon_info, data):
+    features = recon_info.get('features') or legacy_features(recon_info)
+    numeric = {col for col in data.columns if pd.api.types.is_numeric_dtype(data[col].dtype)}
+    key_columns = [col for col in recon_info.get('key_columns', []) if col in data.columns]
+
+    grouped_columns = sorted({col for feature in features if feature['type'] in GROUPED_TYPES
+                              for col in feature['columns'] if col in numeric})
+    grouped = None
+    if grouped_columns:
+        # Positional frame in date order; results are mapped back by position
+        order = date_order(data, recon_info)
+        frame = data[key_columns + grouped_columns].iloc[order].reset_index(drop=True)
+        frame.index = order
+        grouped = frame.groupby(key_columns, sort=False, dropna=False) if key_columns else frame
+
+    historical = []
+    for feature in features:
+        kind = feature['type']
+        for col in feature['columns']:
+            if col not in data.columns:
+                print(f"Warning: '{col}' not found in {recon_name} dataset. Skipping.")
+                continue
+            name = feature_name(feature, col)
+            if kind == 'is_historical':
+                if recon_info.get('history_index'):
+                    historical.append(col)
+                else:
+                    data[name] = data[col].duplicated(keep=False).astype(np.int8)
+                continue
+            if col not in numeric:
+                print(f"Warning: '{col}' is not numeric in {recon_name}. Skipping.")
+                continue
+            if kind == 'ratio_to_mean':
+                data[name] = data[col].abs() / (data[col].mean() + 1e-5)
+                continue
+
+            values = _grouped_values(kind, feature, grouped, col, len(key_columns)).sort_index()
+            values = values.to_numpy(dtype=float, na_value=np.nan)
+            if feature.get('fill') is not None:
+                values = np.where(np.isnan(values), feature['fill'], values)
+            data[name] = np.abs(values) if feature.get('abs') else values
+
+    if historical:
+        from history_index import history_features
+        history_features(recon_name, recon_info, data, entries=historical)
+    return data
@@ -0,0 +1,145 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+from feedback_store import add_feedback, feedback_record
+
+
+# Paginated review of large anomaly sets. Filtering and sorting run on the
+# server over the full frame; only one fixed-size page is sent to the browser,
+# rendered as an editable grid with a selection column. Analysts label the
+# selected rows in bulk and each submit is a single batched feedback write.
+
+PAGE_SIZE = 50
+PREVIEW_ROWS = 200
+FEEDBACK_TYPES = ["False Positive", "False Negative", "True Positive", "True Negative"]
+SEVERITIES = ['High', 'Medium', 'Low']
+SIGNAL_COLUMNS = ['Z_Anomaly', 'IF_Anomaly', 'DBSCAN_Anomaly', 'KMeans_Anomaly']
+
+
+# Severity from the number of signals behind a row: detector flags from
+# Anamoly_Detector results, or breaching columns (Breach_Mask bits) from the
+# rule engine. An explicit Severity column is used as is.
+
+def signal_counts(anomalies):
+    counts = np.zeros(len(anomalies), dtype=np.int64)
+    for col in SIGNAL_COLUMNS:
+        if col in anomalies.columns:
+            counts += anomalies[col].astype(str).str.lower().isin(['true', '1']).to_numpy(dtype=np.int64)
+    if 'Breach_Mask' in anomalies.columns:
+        mask = pd.to_numeric(anomalies['Breach_Mask'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        for bit in range(int(mask.max()).bit_length() if mask.size else 0):
+            counts += (mask >> bit) & 1
+    return counts
+
+
+def severity(anomalies):
+    if 'Severity' in anomalies.columns:
+        return anomalies['Severity'].astype(str)
+    counts = signal_counts(anomalies)
+    return pd.Series(np.select([counts >= 3, counts == 2], ['High', 'Medium'], 'Low'), index=anomalies.index)
+
+
+def category(anomalies):
+    for col in ['Anomaly_Category', 'Anomaly_Status']:
+        if col in anomalies.columns:
+            return anomalies[col].astype(str)
+    return pd.Series('Anomaly', index=anomalies.index)
+
+
+# Review frame: the anomaly rows plus the columns the filters work on. The
+# original index is kept so feedback can reference the source row.
+
+def review_frame(anomalies, recon_type=None):
+    frame = anomalies.copy()
+    if 'Reconciliation_Type' not in frame.columns:
+        frame['Reconciliation_Type'] = recon_type
+    frame['Review_Category'] = category(frame)
+    frame['Severity'] = pd.Categorical(severity(frame), categories=SEVERITIES)
+    return frame
+
+
+def filter_anomalies(frame, recons=None, categories=None, severities=None):
+    keep = np.ones(len(frame), dtype=bool)
+    if recons:
+        keep &= frame['Reconciliation_Type'].isin(recons).to_numpy()
+    if categories:
+        keep &= frame['Review_Category'].isin(categories).to_numpy()
+    if severities:
+        keep &= frame['Severity'].isin(severities).to_numpy()
+    return frame[keep]
+
+
+def sort_anomalies(frame, column=None, ascending=True):
+    if not column or column not in frame.columns:
+        return frame
+    return frame.sort_values(column, ascending=ascending, kind='stable', na_position='last')
+
+
+def page_count(n_rows, page_size=PAGE_SIZE):
+    return max(1, -(-n_rows // page_size))
+
+
+def page_slice(frame, page, page_size=PAGE_SIZE):
+    start = (page - 1) * page_size
+    return frame.iloc[start:start + page_size]
+
+
+def feedback_records(rows, config, feedback_type, comments='', run_id=None):
+    return [feedback_record(row, row.get('Reconciliation_Type'), config.get(row.get('Reconciliation_Type')),
+                            feedback_type, comments, run_id=run_id, anomaly_ref=ref)
+            for ref, row in zip(rows.index, rows.to_dict('records'))]
+
+
+# Bounded preview for large frames
+
+def show_preview(df, rows=PREVIEW_ROWS):
+    st.dataframe(df.head(rows))
+    if len(df) > rows:
+        st.caption(f"Showing the first {rows} of {len(df)} rows.")
+
+
+# Streamlit review widget
+
+def review_anomalies(anomalies, config, run_id=None, recon_type=None, key='review', page_size=PAGE_SIZE):
+    frame = review_frame(anomalies, recon_type)
+
+    filters = st.columns(3)
+    recons = filters[0].multiselect("Recon", sorted(frame['Reconciliation_Type'].dropna().unique()), key=f"{key}_recon")
+    categories = filters[1].multiselect("Category", sorted(frame['Review_Category'].unique()), key=f"{key}_category")
+    severities = filters[2].multiselect("Severity", SEVERITIES, key=f"{key}_severity")
+
+    ordering = st.columns(2)
+    sort_column = ordering[0].selectbox("Sort by", [None] + list(frame.columns), key=f"{key}_sort")
+    ascending = ordering[1].radio("Order", ["Ascending", "Descending"], horizontal=True,
+                                  key=f"{key}_order") == "Ascending"
+
+    filtered = sort_anomalies(filter_anomalies(frame, recons, categories, severities), sort_column, ascending)
+    pages = page_count(len(filtered), page_size)
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    page_rows = page_slice(filtered, page, page_size)
+    st.caption(f"{len(filtered)} of {len(frame)} anomalies match; showing rows "
+               f"{(page - 1) * page_size + 1 if len(filtered) else 0}-{(page - 1) * page_size + len(page_rows)}.")
+
+    # The form keeps selections and label choices client-side until submit
+    with st.form(f"{key}_form"):
+        grid = page_rows.copy()
+        grid.insert(0, 'Select', False)
+        edited = st.data_editor(grid, disabled=[col for col in grid.columns if col != 'Select'],
+                                hide_index=False, key=f"{key}_grid_{page}")
+        select_all = st.checkbox("Apply to every row matching the filters", key=f"{key}_all")
+        feedback_type = st.selectbox("Feedback Type:", FEEDBACK_TYPES, key=f"{key}_type")
+        comments = st.text_area("Comments:", key=f"{key}_comments")
+        submitted = st.form_submit_button("Submit Feedback")
+
+    if submitted:
+        selected = filtered if select_all else page_rows[edited['Select'].to_numpy(dtype=bool)]
+        if selected.empty:
+            st.error("Select at least one anomaly.")
+            return 0
+        try:
+            saved = add_feedback(feedback_records(selected, config, feedback_type, comments, run_id=run_id))
+            st.success(f"Saved feedback for {saved} anomalies.")
+            return saved
+        except Exception as e:
+            st.error(f"Failed to save feedback: {e}")
+    return 0
@@ -0,0 +1,159 @@
+import sqlite3
+import json
+import os
+import time
+import hashlib
+import pandas as pd
+
+
+# Feedback storage backed by SQLite in WAL mode. Each submission is a single
+# INSERT (a batch is one transaction), so writes do not slow down as the log
+# grows and concurrent Streamlit sessions do not overwrite each other.
+# Entries keep the recon's key column values and its criteria/derived values
+# rather than the full anomaly row, and are indexed by recon type, key and
+# run ID for bulk queries.
+
+FEEDBACK_DB = os.environ.get('ANOMALYZE_FEEDBACK_DB', 'feedback.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    run_id TEXT,
+    recon_type TEXT,
+    key_hash TEXT,
+    key_values TEXT,
+    feature_values TEXT,
+    anomaly_ref TEXT,
+    feedback_type TEXT NOT NULL,
+    comments TEXT,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_feedback_recon ON feedback (recon_type, created_at);
+CREATE INDEX IF NOT EXISTS ix_feedback_key ON feedback (recon_type, key_hash);
+CREATE INDEX IF NOT EXISTS ix_feedback_run ON feedback (run_id);
+"""
+
+COLUMNS = ['created_at', 'run_id', 'recon_type', 'key_hash', 'key_values', 'feature_values', 'anomaly_ref',
+           'feedback_type', 'comments', 'model_version']
+
+# Columns added after the first schema version: (name, type)
+MIGRATIONS = [('model_version', 'TEXT')]
+
+
+def connect(db_path=FEEDBACK_DB):
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    existing = {row[1] for row in connection.execute('PRAGMA table_info(feedback)')}
+    for column, column_type in MIGRATIONS:
+        if column not in existing:
+            connection.execute(f"ALTER TABLE feedback ADD COLUMN {column} {column_type}")
+    return connection
+
+
+def _json_value(value):
+    if pd.isna(value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def key_hash(key_values):
+    payload = json.dumps([str(value) for value in key_values], separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# Build a feedback record from an anomaly row (dict or Series)
+
+def feedback_record(row, recon_type, recon_info, feedback_type, comments='', run_id=None, anomaly_ref=None):
+    row = dict(row)
+    key_columns = recon_info.get('key_columns', []) if recon_info else []
+    value_columns = (recon_info.get('criteria_columns', []) + recon_info.get('derived_columns', [])) if recon_info else []
+    key_values = {col: _json_value(row.get(col)) for col in key_columns}
+    feature_values = {col: _json_value(row.get(col)) for col in value_columns if col in row}
+    return {
+        'created_at': time.time(),
+        'run_id': run_id,
+        'recon_type': recon_type,
+        'key_hash': key_hash([key_values[col] for col in key_columns]) if key_columns else None,
+        'key_values': json.dumps(key_values),
+        'feature_values': json.dumps(feature_values),
+        'anomaly_ref': None if anomaly_ref is None else str(anomaly_ref),
+        'feedback_type': feedback_type,
+        'comments': comments,
+        'model_version': str(recon_info['model_version']) if recon_info and 'model_version' in recon_info else None
+    }
+
+
+def add_feedback(records, db_path=FEEDBACK_DB):
+    if isinstance(records, dict):
+        records = [records]
+    rows = [tuple(record.get(col) for col in COLUMNS) for record in records]
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.executemany(
+                f"INSERT INTO feedback ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    finally:
+        connection.close()
+    return len(rows)
+
+
+# Bulk query for review and downstream training
+
+def query_feedback(recon_type=None, run_id=None, key_values=None, feedback_types=None, since=None,
+                   model_version=None, expand=False, db_path=FEEDBACK_DB):
+    clauses = []
+    params = []
+    if recon_type is not None:
+        clauses.append('recon_type = ?')
+        params.append(recon_type)
+    if run_id is not None:
+        clauses.append('run_id = ?')
+        params.append(run_id)
+    if key_values is not None:
+        clauses.append('key_hash = ?')
+        params.append(key_hash(key_values))
+    if feedback_types:
+        clauses.append(f"feedback_type IN ({', '.join('?' * len(feedback_types))})")
+        params.extend(feedback_types)
+    if since is not None:
+        clauses.append('created_at >= ?')
+        params.append(since)
+    if model_version is not None:
+        clauses.append('model_version = ?')
+        params.append(str(model_version))
+
+    query = 'SELECT * FROM feedback'
+    if clauses:
+        query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY id'
+
+    connection = connect(db_path)
+    try:
+        feedback = pd.read_sql_query(query, connection, params=params)
+    finally:
+        connection.close()
+
+    if expand and not feedback.empty:
+        keys = pd.json_normalize(feedback['key_values'].map(json.loads).tolist())
+        values = pd.json_normalize(feedback['feature_values'].map(json.loads).tolist())
+        feedback = pd.concat([feedback.drop(columns=['key_values', 'feature_values']),
+                              keys.add_prefix('key.'), values.add_prefix('value.')], axis=1)
+    return feedback
+
+
+# One-off import of a legacy feedback_log.json
+
+def import_json_log(json_path, recon_type=None, recon_info=None, db_path=FEEDBACK_DB):
+    with open(json_path, 'r') as file:
+        feedback_log = json.load(file)
+    records = [feedback_record(entry.get('anomaly_details', {}), recon_type, recon_info,
+                               entry.get('feedback_type'), entry.get('comments', ''), anomaly_ref=ref)
+               for ref, entry in feedback_log.items() if isinstance(entry, dict) and entry.get('feedback_type')]
+    return add_feedback(records, db_path)
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from recon_ingest import load_config, load_recon
+from recon_dates import date_values
+
+
+# Persistent history of each recon's historical_columns. For every value (or
+# tuple of values, when an entry of historical_columns is a list of columns)
+# the index keeps a 64-bit hash, the first and last date it was seen, how many
+# rows carried it, how many of those were breaks and the first and last break
+# date. Each new feed is summarized with a grouped aggregation and folded in
+# once: the fingerprint of each applied summary is recorded, and a feed whose
+# fingerprint is already recorded is skipped. Lookups only read: they hash
+# the new rows and binary-search the sorted hashes, so "has this account
+# broken before?" costs O(new rows log history) without loading the history
+# rows themselves. A value is historical for a row when it
+# was seen on an earlier date, which also holds when a feed is re-run.
+
+INDEX_DIR = os.environ.get('ANOMALYZE_HISTORY_DIR', 'history_index')
+MAX_FEEDS = 1000
+BREAK_COLUMNS = ['Match Status', 'MatchStatus']
+INDEX_COLUMNS = ['hash', 'first_seen', 'last_seen', 'rows', 'breaks', 'first_break', 'last_break']
+NEVER = np.datetime64('NaT', 'ns')
+ALWAYS = np.datetime64(np.iinfo(np.int64).max, 'ns')
+
+
+def index_dir_for(recon_name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, recon_name)
+
+
+# History keys: each historical_columns entry is a column or a list of columns
+
+def history_keys(recon_info, columns=None):
+    keys = []
+    for entry in recon_info.get('historical_columns', []):
+        cols = [entry] if isinstance(entry, str) else list(entry)
+        if columns is None or all(col in columns for col in cols):
+            keys.append(('_'.join(cols), cols))
+    return keys
+
+
+# Values are hashed as strings (so 5 from a CSV and '5' from another feed
+# hash alike); each distinct value is converted and hashed once, and the
+# column hashes of a tuple are combined
+
+def column_hashes(values):
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    hashed = pd.util.hash_array(np.append(np.asarray(uniques, dtype=object).astype(str), 'None').astype(object))
+    return hashed[codes]
+
+
+def value_hashes(data, cols):
+    hashes = [column_hashes(data[col]) for col in cols]
+    if len(hashes) == 1:
+        return hashes[0]
+    return pd.util.hash_pandas_object(pd.DataFrame(dict(enumerate(hashes))), index=False).to_numpy()
+
+
+def row_dates(data, recon_info):
+    dates = date_values(data, recon_info)
+    return np.full(len(data), NEVER) if dates is None else dates
+
+
+# A break is a row whose break_column (default: Match Status) is one of
+# break_values, or contains "break" when no values are configured
+
+def break_flags(data, recon_info):
+    column = recon_info.get('break_column') or next((col for col in BREAK_COLUMNS if col in data.columns), None)
+    if column is None or column not in data.columns:
+        return np.zeros(len(data), dtype=bool)
+    values = data[column].astype(str)
+    if recon_info.get('break_values'):
+        return values.isin(recon_info['break_values']).to_numpy()
+    return values.str.contains('break', case=False, regex=False).to_numpy()
+
+
+# One feed: per-key value hashes, row dates and break flags, computed once
+# and shared by the summary and the lookups
+
+def feed_values(data, recon_info, entries=None):
+    keys = history_keys(recon_info if entries is None else {'historical_columns': entries}, data.columns)
+    return {'hashes': {name: value_hashes(data, cols) for name, cols in keys},
+            'dates': row_dates(data, recon_info), 'breaks': break_flags(data, recon_info)}
+
+
+# Summaries and merging
+
+def summarize_key(hashes, dates, breaks):
+    frame = pd.DataFrame({'hash': hashes, 'date': dates, 'break': breaks.astype(np.int64),
+                          'break_date': np.where(breaks, dates, NEVER)})
+    summary = frame.groupby('hash', sort=False).agg(
+        first_seen=('date', 'min'), last_seen=('date', 'max'), rows=('date', 'size'), breaks=('break', 'sum'),
+        first_break=('break_date', 'min'), last_break=('break_date', 'max'))
+    return summary.reset_index()[INDEX_COLUMNS]
+
+
+def merge_index(index, batch):
+    if index is not None and not index.empty:
+        batch = pd.concat([index, batch], ignore_index=True).groupby('hash', sort=False).agg(
+            first_seen=('first_seen', 'min'), last_seen=('last_seen', 'max'), rows=('rows', 'sum'),
+            breaks=('breaks', 'sum'), first_break=('first_break', 'min'), last_break=('last_break', 'max')
+        ).reset_index()
+    return batch.sort_values('hash', kind='stable', ignore_index=True)[INDEX_COLUMNS]
+
+
+# A feed (or the chunks or shards of one) folded into per-key summaries, with
+# a fingerprint per key so a feed already applied to a key is not counted twice
+
+class FeedSummary:
+    def __init__(self):
+        self.summaries = {}
+
+    def add(self, feed):
+        for name, hashes in feed['hashes'].items():
+            self.summaries[name] = merge_index(self.summaries.get(name),
+                                               summarize_key(hashes, feed['dates'], feed['breaks']))
+        return self
+
+    # Taken from the sorted summary, so the same rows give the same
+    # fingerprint whether they arrive whole, in chunks or in shards
+
+    def digest(self, name):
+        digest = hashlib.sha256(name.encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(self.summaries[name], index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def apply(self, recon_name, index_dir=INDEX_DIR):
+        manifest = load_manifest(recon_name, index_dir)
+        os.makedirs(index_dir_for(recon_name, index_dir), exist_ok=True)
+        index = {}
+        for name, summary in self.summaries.items():
+            digest = self.digest(name)
+            applied = manifest['feeds'].setdefault(name, [])
+            if digest in applied:
+                index[name] = load_key(recon_name, name, index_dir)
+                continue
+            index[name] = merge_index(load_key(recon_name, name, index_dir), summary)
+            _write(_key_file(recon_name, name, index_dir), lambda path: index[name].to_parquet(path, index=False))
+            manifest['feeds'][name] = (applied + [digest])[-MAX_FEEDS:]
+            manifest['values'][name] = int(len(index[name]))
+
+        manifest['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        def write_manifest(path):
+            with open(path, 'w') as file:
+                json.dump(manifest, file, indent=4)
+        _write(_manifest_file(recon_name, index_dir), write_manifest)
+        return index
+
+
+# Storage: one Parquet file per history key, sorted by hash, plus a manifest
+# of the feeds applied to each key
+
+def _key_file(recon_name, name, index_dir):
+    return os.path.join(index_dir_for(recon_name, index_dir), f"{name}.parquet")
+
+
+def _manifest_file(recon_name, index_dir):
+    return os.path.join(index_dir_for(recon_name, index_dir), 'manifest.json')
+
+
+def _write(path, write):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    write(tmp_file)
+    os.replace(tmp_file, path)
+
+
+def load_key(recon_name, name, index_dir=INDEX_DIR, columns=None):
+    path = _key_file(recon_name, name, index_dir)
+    return pd.read_parquet(path, columns=columns) if os.path.exists(path) else None
+
+
+def load_manifest(recon_name, index_dir=INDEX_DIR):
+    path = _manifest_file(recon_name, index_dir)
+    if not os.path.exists(path):
+        return {'feeds': {}, 'values': {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def load_index(recon_name, names, index_dir=INDEX_DIR):
+    return {name: load_key(recon_name, name, index_dir, LOOKUP_COLUMNS) for name in names}
+
+
+def update_index(recon_name, recon_info, data, index_dir=INDEX_DIR, feed=None):
+    return FeedSummary().add(feed or feed_values(data, recon_info)).apply(recon_name, index_dir)
+
+
+# Lookups: per row, the first date the value was seen and first broke (NaT
+# when never) and its break count
+
+LOOKUP_COLUMNS = ['hash', 'first_seen', 'first_break', 'breaks']
+
+
+def lookup(keyed, hashes):
+    found = {'first_seen': np.full(len(hashes), NEVER), 'first_break': np.full(len(hashes), NEVER),
+             'breaks': np.zeros(len(hashes), dtype=np.int64)}
+    if keyed is None or keyed.empty:
+        return found
+    known = keyed['hash'].to_numpy()
+    positions = np.minimum(np.searchsorted(known, hashes), len(known) - 1)
+    hit = known[positions] == hashes
+    for field in found:
+        found[field] = np.where(hit, keyed[field].to_numpy()[positions], found[field])
+    return found
+
+
+# Lookup index for a feed that may not be applied yet: the stored index with
+# the feed's own summary folded in memory, so earlier rows of the same feed
+# count too. Nothing is written.
+
+def with_feed(recon_name, feed, index_dir=INDEX_DIR):
+    stored = load_index(recon_name, feed['hashes'], index_dir)
+    applied = load_manifest(recon_name, index_dir)['feeds']
+    summary = FeedSummary().add(feed)
+    index = {}
+    for name, keyed in stored.items():
+        if summary.digest(name) in applied.get(name, []):
+            index[name] = keyed
+            continue
+        index[name] = pd.concat([keyed, summary.summaries[name][LOOKUP_COLUMNS]], ignore_index=True).groupby(
+            'hash', sort=True).agg(first_seen=('first_seen', 'min'), first_break=('first_break', 'min'),
+                                   breaks=('breaks', 'sum')).reset_index()[LOOKUP_COLUMNS]
+    return index
+
+
+# Is_Historical_{key}: the value was seen on an earlier date; Broke_Before_{key}:
+# it broke on an earlier date. Undated rows count any history. Lookups are
+# read-only: rows are judged against `index` when given, otherwise against
+# the stored index with this feed folded in memory (see with_feed). With
+# update=True the feed is also folded into the stored index, once per feed
+# fingerprint; only the run that ingests a feed should ask for that.
+
+def history_features(recon_name, recon_info, data, update=False, index=None, entries=None, index_dir=INDEX_DIR,
+                     feed=None):
+    feed = feed or feed_values(data, recon_info, entries)
+    if update:
+        index = update_index(recon_name, recon_info, data, index_dir, feed)
+    elif index is None:
+        index = with_feed(recon_name, feed, index_dir)
+    dates = np.where(np.isnat(feed['dates']), ALWAYS, feed['dates'])
+    for name, hashes in feed['hashes'].items():
+        found = lookup(index.get(name), hashes)
+        data[f"Is_Historical_{name}"] = (found['first_seen'] < dates).astype(np.int8)
+        data[f"Broke_Before_{name}"] = (found['first_break'] < dates).astype(np.int8)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update or query the persistent history index of a recon.")
+    parser.add_argument('command', choices=['update', 'query'])
+    parser.add_argument('recon', help="recon name from the configuration")
+    parser.add_argument('file', nargs='?', help="feed to fold in or look up (default: the configured file)")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    args = parser.parse_args()
+
+    recon_info = load_config(args.config)[args.recon]
+    if args.file:
+        recon_info = dict(recon_info, file_path=args.file)
+    data = load_recon(args.recon, recon_info)
+
+    if args.command == 'update':
+        index = update_index(args.recon, recon_info, data, args.index_dir)
+        for name, keyed in index.items():
+            print(f"History index for {args.recon} {name} holds {len(keyed)} values.")
+        return
+
+    history_features(args.recon, recon_info, data, update=False, index_dir=args.index_dir)
+    output_file = f"{args.recon}_history.csv"
+    data.to_csv(output_file, index=False)
+    for name, _ in history_keys(recon_info, data.columns):
+        print(f"{name}: {int(data[f'Is_Historical_{name}'].sum())} of {len(data)} rows seen before, "
+              f"{int(data[f'Broke_Before_{name}'].sum())} broke before.")
+    print(f"Results saved to {output_file}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
+import time
+import os
+from recon_ingest import load_config, convert_types
+from recon_dates import date_values
+
+
+# Persistent per-key statistics for month-end scoring. For every key tuple in
+# a recon's key_columns the store keeps a row count and, per criteria and
+# derived column, a running count of non-missing values, their mean and sum
+# of squared deviations (M2) and the last value, plus the last date seen. New rows are scored against their own key's
+# history and folded in with Chan's parallel update, so a month-end run costs
+# O(new rows) instead of a rescan of the whole history.
+#
+# Scoring and updating are separate steps. score_feed only reads: a feed is
+# scored against the store as it was before that feed was applied, so
+# scoring it again (another session, a restart, a cache miss) gives the same
+# result. update_store folds a feed in once: applied feeds are recorded by a
+# fingerprint of their rows, and applying the same rows again is a no-op. The
+# check and the write run under a lock file, so two sessions applying the same
+# feed apply it once.
+
+STORE_DIR = os.environ.get('ANOMALYZE_KEY_STATS_DIR', 'key_stats')
+LOCK_TIMEOUT = float(os.environ.get('ANOMALYZE_KEY_STATS_LOCK_TIMEOUT', 300))
+
+DEFAULT_KEY_Z_THRESHOLD = 3
+DEFAULT_MIN_HISTORY = 3
+
+
+def tracked_columns(recon_info, columns=None):
+    tracked = recon_info.get('criteria_columns', []) + recon_info.get('derived_columns', [])
+    return [col for col in tracked if columns is None or col in columns]
+
+
+def store_path(recon_name, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"{recon_name}.parquet")
+
+
+def load_store(recon_name, store_dir=STORE_DIR):
+    path = store_path(recon_name, store_dir)
+    if not os.path.exists(path):
+        return None
+    store = pd.read_parquet(path)
+    # Stores written before per-column counts used the row count
+    for col in [col[:-len('__mean')] for col in store.columns if col.endswith('__mean')]:
+        if f"{col}__count" not in store.columns:
+            store[f"{col}__count"] = store['count']
+    return store
+
+
+def save_store(recon_name, store, store_dir=STORE_DIR, path=None):
+    os.makedirs(store_dir, exist_ok=True)
+    path = path or store_path(recon_name, store_dir)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    store.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, path)
+
+
+# Applied feeds: their fingerprints, plus a snapshot of the store from before
+# the latest one so that feed can still be scored against its own baseline
+
+def _previous_path(recon_name, store_dir):
+    return os.path.join(store_dir, f"{recon_name}.previous.parquet")
+
+
+def _manifest_path(recon_name, store_dir):
+    return os.path.join(store_dir, f"{recon_name}.json")
+
+
+def load_manifest(recon_name, store_dir=STORE_DIR):
+    path = _manifest_path(recon_name, store_dir)
+    if not os.path.exists(path):
+        return {'feeds': {}, 'latest': None}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _save_manifest(recon_name, manifest, store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    path = _manifest_path(recon_name, store_dir)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(tmp_file, path)
+
+
+# Fingerprint of a feed's rows over the columns the store uses, with keys as
+# strings, values as floats and dates parsed, so the same file hashes alike
+# whether it comes from the CLI or the ingestion cache
+
+def feed_fingerprint(df, recon_info):
+    df, date_col = _with_dates(df, recon_info)
+    columns = tracked_columns(recon_info, df.columns)
+    frame = pd.DataFrame({col: df[col].astype(object).where(df[col].notna(), None).astype(str).to_numpy()
+                          for col in recon_info['key_columns']})
+    for col in columns:
+        frame[col] = df[col].to_numpy(dtype=float)
+    if date_col is not None:
+        frame[date_col] = df[date_col].to_numpy(dtype='datetime64[ns]')
+    digest = hashlib.sha256(json.dumps(list(frame.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def feed_applied(recon_name, fingerprint, store_dir=STORE_DIR):
+    return fingerprint in load_manifest(recon_name, store_dir)['feeds']
+
+
+def _date_column(recon_info):
+    date_columns = recon_info.get('date_columns', [])
+    return date_columns[0] if date_columns else None
+
+
+def _with_dates(df, recon_info):
+    date_col = _date_column(recon_info)
+    if date_col is None or date_col not in df.columns:
+        return df, None
+    if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        df = df.assign(**{date_col: date_values(df, recon_info, date_col)})
+    return df, date_col
+
+
+# Summarize a batch of rows per key (count, mean, M2, last values, last date)
+
+def summarize_batch(df, recon_info):
+    key_columns = recon_info['key_columns']
+    columns = tracked_columns(recon_info, df.columns)
+    df, date_col = _with_dates(df, recon_info)
+    if date_col is not None:
+        df = df.sort_values(date_col, kind='stable')
+
+    grouped = df.groupby(key_columns, dropna=False, sort=False)
+    summary = grouped.size().rename('count').to_frame()
+    for col in columns:
+        summary[f"{col}__count"] = grouped[col].count()
+        summary[f"{col}__mean"] = grouped[col].mean()
+        summary[f"{col}__m2"] = (grouped[col].var(ddof=0) * summary[f"{col}__count"]).fillna(0)
+        summary[f"{col}__last"] = grouped[col].last()
+    if date_col is not None:
+        summary['last_date'] = grouped[date_col].max()
+    return summary.reset_index()
+
+
+# Merge a batch summary into the store
+
+def merge_summaries(store, batch, recon_info):
+    if store is None or store.empty:
+        return batch
+
+    key_columns = recon_info['key_columns']
+    merged = store.merge(batch, on=key_columns, how='outer', suffixes=('', '__new'))
+
+    # Each column's mean and M2 are weighted by its own non-missing count
+    for col in tracked_columns(recon_info):
+        if f"{col}__mean__new" not in merged.columns:
+            continue
+        n_a = merged[f"{col}__count"].fillna(0) if f"{col}__count" in merged.columns else merged['count'].fillna(0)
+        n_b = merged[f"{col}__count__new"].fillna(0)
+        total = n_a + n_b
+        mean_a = merged[f"{col}__mean"].fillna(0)
+        mean_b = merged[f"{col}__mean__new"].fillna(0)
+        delta = mean_b - mean_a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            merged[f"{col}__mean"] = (mean_a + delta * n_b / total).where(total > 0)
+            merged[f"{col}__m2"] = (merged[f"{col}__m2"].fillna(0) + merged[f"{col}__m2__new"].fillna(0)
+                                    + (delta ** 2 * n_a * n_b / total).where(total > 0, 0))
+        merged[f"{col}__count"] = total.astype('int64')
+        merged[f"{col}__last"] = merged[f"{col}__last__new"].combine_first(merged[f"{col}__last"])
+
+    if 'last_date__new' in merged.columns:
+        merged['last_date'] = merged[['last_date', 'last_date__new']].max(axis=1)
+    merged['count'] = (merged['count'].fillna(0) + merged['count__new'].fillna(0)).astype('int64')
+    return merged[[col for col in merged.columns if not col.endswith('__new')]]
+
+
+# Score rows against their own key's history: change since the key's last
+# value and z-score against the key's running mean and variance.
+
+def score_rows(df, store, recon_info):
+    key_columns = recon_info['key_columns']
+    columns = tracked_columns(recon_info, df.columns)
+    threshold = recon_info.get('key_z_threshold', DEFAULT_KEY_Z_THRESHOLD)
+    min_history = recon_info.get('key_min_history', DEFAULT_MIN_HISTORY)
+
+    scored = df.copy()
+    if store is None or store.empty:
+        scored['Key_History'] = 0
+        scored['Key_Anomaly'] = False
+        return scored
+
+    stats_columns = key_columns + ['count'] + [f"{col}__{stat}" for col in columns
+                                               for stat in ['count', 'mean', 'm2', 'last']]
+    history = scored[key_columns].merge(store[stats_columns], on=key_columns, how='left')
+    count = history['count'].fillna(0).to_numpy()
+    key_anomaly = np.zeros(len(scored), dtype=bool)
+
+    for col in columns:
+        values = scored[col].to_numpy(dtype=float)
+        mean = history[f"{col}__mean"].to_numpy()
+        col_count = history[f"{col}__count"].fillna(0).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(history[f"{col}__m2"].to_numpy() / col_count)
+            z = (values - mean) / std
+        z = np.where(std > 0, z, 0.0)
+        scored[f"{col}_Key_Change"] = values - history[f"{col}__last"].to_numpy()
+        scored[f"{col}_Key_Z"] = z
+        key_anomaly |= (np.abs(np.nan_to_num(z)) > threshold) & (col_count >= min_history)
+
+    scored['Key_History'] = count.astype('int64')
+    scored['Key_Anomaly'] = key_anomaly
+    return scored
+
+
+# Score new rows and fold them into the store. Rows dated on or before their
+# key's last_date were already applied and are skipped, so re-running a
+# month-end file does not double count it.
+
+def new_rows(df, store, recon_info):
+    df, date_col = _with_dates(df, recon_info)
+    if store is None or store.empty or date_col is None or 'last_date' not in store.columns:
+        return df
+    key_columns = recon_info['key_columns']
+    last_dates = df[key_columns].merge(store[key_columns + ['last_date']], on=key_columns, how='left')['last_date']
+    is_new = last_dates.isna().to_numpy() | (df[date_col].to_numpy() > last_dates.to_numpy())
+    return df[is_new]
+
+
+# The store a feed is judged against: the snapshot from before it when it is
+# the latest applied feed, otherwise the current store
+
+def baseline_store(recon_name, fingerprint, store_dir=STORE_DIR):
+    if load_manifest(recon_name, store_dir)['latest'] == fingerprint:
+        path = _previous_path(recon_name, store_dir)
+        return pd.read_parquet(path) if os.path.exists(path) else None
+    return load_store(recon_name, store_dir)
+
+
+# Read-only scoring of a feed's new rows
+
+def score_feed(recon_name, recon_info, df, store_dir=STORE_DIR, fingerprint=None):
+    fingerprint = fingerprint or feed_fingerprint(df, recon_info)
+    store = baseline_store(recon_name, fingerprint, store_dir)
+    return score_rows(new_rows(df, store, recon_info), store, recon_info)
+
+
+# Lock file around an update; one left behind by a crashed writer is taken
+# over after LOCK_TIMEOUT seconds
+
+def _lock_path(recon_name, store_dir):
+    return os.path.join(store_dir, f"{recon_name}.lock")
+
+
+def acquire_lock(path, poll=0.1):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    while True:
+        try:
+            if time.time() - os.path.getmtime(path) > LOCK_TIMEOUT:
+                os.remove(path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            time.sleep(poll)
+            continue
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'pid': os.getpid(), 'claimed_at': time.time()}, file)
+        return
+
+
+def release_lock(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Fold a feed into the store once; returns the number of rows applied (0 when
+# the feed was already applied or has no rows newer than the store)
+
+def update_store(recon_name, recon_info, df, store_dir=STORE_DIR, fingerprint=None):
+    fingerprint = fingerprint or feed_fingerprint(df, recon_info)
+    lock_file = _lock_path(recon_name, store_dir)
+    acquire_lock(lock_file)
+    try:
+        return _apply_feed(recon_name, recon_info, df, store_dir, fingerprint)
+    finally:
+        release_lock(lock_file)
+
+
+def _apply_feed(recon_name, recon_info, df, store_dir, fingerprint):
+    manifest = load_manifest(recon_name, store_dir)
+    if fingerprint in manifest['feeds']:
+        return 0
+    store = load_store(recon_name, store_dir)
+    fresh = new_rows(df, store, recon_info)
+    if not fresh.empty:
+        previous = _previous_path(recon_name, store_dir)
+        if store is not None:
+            save_store(recon_name, store, store_dir, path=previous)
+        elif os.path.exists(previous):
+            os.remove(previous)
+        save_store(recon_name, merge_summaries(store, summarize_batch(fresh, recon_info), recon_info), store_dir)
+        manifest['latest'] = fingerprint
+    manifest['feeds'][fingerprint] = {'rows': len(fresh), 'applied_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    _save_manifest(recon_name, manifest, store_dir)
+    return len(fresh)
+
+
+def score_and_update(recon_name, recon_info, df, store_dir=STORE_DIR):
+    fingerprint = feed_fingerprint(df, recon_info)
+    scored = score_feed(recon_name, recon_info, df, store_dir, fingerprint)
+    update_store(recon_name, recon_info, df, store_dir, fingerprint)
+    return scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a month-end file against per-key history and update the store.")
+    parser.add_argument('recon', help="recon name from the configuration")
+    parser.add_argument('file', help="new month-end CSV")
+    parser.add_argument('--config', default='recon_config.json')
+    args = parser.parse_args()
+
+    recon_info = load_config(args.config)[args.recon]
+    df = convert_types(pd.read_csv(args.file), recon_info)
+    scored = score_and_update(args.recon, recon_info, df)
+    output_file = f"{args.recon}_key_scores.csv"
+    scored.to_csv(output_file, index=False)
+    print(f"Scored {len(scored)} new rows of {args.recon} against per-key history: "
+          f"{int(scored['Key_Anomaly'].sum())} key anomalies. Results saved to {output_file}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+import os
+import hashlib
+import time
+import joblib
+import numpy as np
+
+
+# Persisted model registry: fitted ensembles (scaler, z-score statistics,
+# IsolationForest, DBSCAN core samples, KMeans and its distance cutoff) are
+# stored per recon, keyed by a hash of the recon's config entry and a
+# fingerprint of the training matrix. Daily runs can then score new rows
+# without refitting.
+
+REGISTRY_DIR = os.environ.get('ANOMALYZE_MODEL_DIR', 'model_registry')
+
+# Config keys that change the fitted models (plus every train_* key): the
+# model columns and the keys that decide how their features are built (the
+# feature definitions, their key grouping and date order, and where
+# is_historical comes from). Other keys (reasons, rules, suppression, stores,
+# run options, ...) do not, so editing them keeps the registered models valid.
+MODEL_KEYS = {'criteria_columns', 'derived_columns', 'feature_columns', 'features', 'key_columns', 'date_columns',
+              'historical_columns', 'history_index', 'detector_profile', 'float32_model'}
+
+# Ensemble entries rebuilt from the stored detectors when they are loaded
+RUNTIME_KEYS = {'dbscan_index', 'iso_forest_compiled'}
+
+
+def config_hash(recon_info):
+    model_config = {key: value for key, value in recon_info.items()
+                    if key in MODEL_KEYS or key.startswith('train_')}
+    payload = json.dumps(model_config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+def data_fingerprint(values):
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256()
+    digest.update(str((values.shape, values.dtype.str)).encode('utf-8'))
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _recon_dir(recon_name, registry_dir):
+    return os.path.join(registry_dir, recon_name)
+
+
+def _index_path(recon_name, registry_dir):
+    return os.path.join(_recon_dir(recon_name, registry_dir), 'index.json')
+
+
+def _read_index(recon_name, registry_dir):
+    index_file = _index_path(recon_name, registry_dir)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file, 'r') as file:
+        return json.load(file)
+
+
+def _write_index(recon_name, index, registry_dir):
+    index_file = _index_path(recon_name, registry_dir)
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(index, file, indent=4)
+    os.replace(tmp_file, index_file)
+
+
+# Save a fitted ensemble
+
+def save_ensemble(recon_name, recon_info, ensemble, target_columns, fingerprint, registry_dir=REGISTRY_DIR):
+    recon_dir = _recon_dir(recon_name, registry_dir)
+    os.makedirs(recon_dir, exist_ok=True)
+
+    cfg_hash = config_hash(recon_info)
+    model_file = f"{cfg_hash[:12]}-{fingerprint[:12]}.joblib"
+    artifacts = {key: value for key, value in ensemble.items() if key not in RUNTIME_KEYS}
+    artifacts['target_columns'] = list(target_columns)
+
+    tmp_file = os.path.join(recon_dir, f"{model_file}.{os.getpid()}.tmp")
+    joblib.dump(artifacts, tmp_file)
+    os.replace(tmp_file, os.path.join(recon_dir, model_file))
+
+    entry = {
+        'model_file': model_file,
+        'config_hash': cfg_hash,
+        'data_fingerprint': fingerprint,
+        'target_columns': list(target_columns),
+        'n_train': int(ensemble.get('n_train', 0)),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    index = _read_index(recon_name, registry_dir)
+    recon_entries = index.setdefault(cfg_hash, {'latest': None, 'entries': {}})
+    recon_entries['entries'][fingerprint] = entry
+    recon_entries['latest'] = fingerprint
+    _write_index(recon_name, index, registry_dir)
+    return entry
+
+
+# Look up a fitted ensemble. With a fingerprint only that exact training set
+# matches; without one the latest ensemble fitted for this config is returned.
+
+def find_entry(recon_name, recon_info, fingerprint=None, registry_dir=REGISTRY_DIR):
+    recon_entries = _read_index(recon_name, registry_dir).get(config_hash(recon_info))
+    if recon_entries is None:
+        return None
+    if fingerprint is None:
+        fingerprint = recon_entries['latest']
+    return recon_entries['entries'].get(fingerprint)
+
+
+def load_ensemble(recon_name, recon_info, fingerprint=None, registry_dir=REGISTRY_DIR):
+    entry = find_entry(recon_name, recon_info, fingerprint, registry_dir)
+    if entry is None:
+        return None, None
+    model_path = os.path.join(_recon_dir(recon_name, registry_dir), entry['model_file'])
+    if not os.path.exists(model_path):
+        return None, None
+    return joblib.load(model_path), entry
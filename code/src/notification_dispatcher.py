@@ -0,0 +1,252 @@
+import os
+import time
+import threading
+import smtplib
+from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Notification dispatcher for resolution tasks. HTTP calls (ServiceNow
+# incidents, resolution API) go through a bounded thread pool over pooled
+# requests sessions, with per-call timeouts, retries with exponential backoff
+# and a token-bucket rate limit. Emails are collected and sent as digest
+# batches over one reused SMTP connection. With stub=True (or
+# ANOMALYZE_DISPATCH_STUB=1) fake HTTP and SMTP endpoints record every call so
+# the whole flow can run offline.
+
+SERVICENOW_URL = "https://servicenow-instance.com/api/now/table/incident"
+RESOLUTION_API_URL = "https://dummy-api-endpoint.com/resolution"
+SMTP_HOST = 'smtp.yhc.com'
+EMAIL_SENDER = 'test_email@yhc.com'
+EMAIL_RECIPIENT = 'team@example.com'
+
+DEFAULT_SETTINGS = {
+    'max_workers': 8,
+    'max_pending': 64,
+    'pool_size': 16,
+    'connect_timeout': 3.05,
+    'read_timeout': 10,
+    'retries': 3,
+    'backoff': 0.5,
+    'rate_per_second': 20,
+    'digest_size': 50,
+    'smtp_timeout': 10,
+    'smtp_host': SMTP_HOST,
+    'email_sender': EMAIL_SENDER,
+    'email_recipient': EMAIL_RECIPIENT
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# Fake endpoints for offline runs
+
+class StubResponse:
+    def __init__(self, status_code=201):
+        self.status_code = status_code
+
+
+class StubSession:
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, url, timeout=None, **kwargs):
+        with self._lock:
+            self.calls.append({'url': url, 'timeout': timeout, **kwargs})
+        return StubResponse(201)
+
+    def close(self):
+        pass
+
+
+class StubSMTP:
+    def __init__(self, host=None, timeout=None):
+        self.host = host
+        self.sent = []
+
+    def send_message(self, message):
+        self.sent.append(message)
+
+    def noop(self):
+        return 250, b'OK'
+
+    def quit(self):
+        pass
+
+
+# Token-bucket rate limiter shared by the worker threads
+
+class RateLimiter:
+    def __init__(self, rate_per_second):
+        self.rate = float(rate_per_second)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _pooled_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class NotificationDispatcher:
+    def __init__(self, stub=None, **settings):
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self.stub = stub if stub is not None else os.environ.get('ANOMALYZE_DISPATCH_STUB') == '1'
+        self.stats = {'http_sent': 0, 'http_failed': 0, 'retries': 0, 'emails_queued': 0, 'digests_sent': 0,
+                      'digests_failed': 0}
+
+        self._local = threading.local()
+        self._sessions = []
+        self._pending = threading.BoundedSemaphore(self.settings['max_pending'])
+        self._executor = ThreadPoolExecutor(self.settings['max_workers'], thread_name_prefix='dispatch')
+        self._mailer = ThreadPoolExecutor(1, thread_name_prefix='dispatch-smtp')
+        self._limiter = RateLimiter(self.settings['rate_per_second'])
+        self._lock = threading.Lock()
+        self._emails = []
+        self._smtp = None
+
+    # HTTP
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = StubSession() if self.stub else _pooled_session(self.settings['pool_size'])
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _post(self, url, **kwargs):
+        timeout = (self.settings['connect_timeout'], self.settings['read_timeout'])
+        for attempt in range(self.settings['retries'] + 1):
+            self._limiter.acquire()
+            try:
+                response = self._session().post(url, timeout=timeout, **kwargs)
+                status = response.status_code
+                if 200 <= status < 300:
+                    self._count('http_sent')
+                    return status
+                if status not in RETRY_STATUS:
+                    # Rejected (400, 401, 404, 409, ...): retrying will not help
+                    print(f"Request to {url} was rejected with status {status}")
+                    self._count('http_failed')
+                    return status
+                if attempt == self.settings['retries']:
+                    print(f"Request to {url} failed with status {status} after {attempt + 1} attempts")
+            except Exception as e:
+                if attempt == self.settings['retries']:
+                    print(f"Request to {url} failed: {e}")
+            if attempt < self.settings['retries']:
+                self._count('retries')
+                time.sleep(self.settings['backoff'] * 2 ** attempt)
+        self._count('http_failed')
+        return None
+
+    def _submit(self, url, **kwargs):
+        # Blocks the caller once max_pending requests are queued
+        self._pending.acquire()
+        future = self._executor.submit(self._post, url, **kwargs)
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def create_incident(self, incident_data, url=SERVICENOW_URL):
+        return self._submit(url, json=incident_data)
+
+    def call_api(self, data=None, json=None, url=RESOLUTION_API_URL):
+        return self._submit(url, data=data, json=json)
+
+    # Email digests
+
+    def queue_email(self, subject, body):
+        with self._lock:
+            self._emails.append((subject, body))
+            self.stats['emails_queued'] += 1
+            ready = len(self._emails) >= self.settings['digest_size']
+        if ready:
+            self._mailer.submit(self.flush_emails)
+
+    def _smtp_connection(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except Exception:
+                self._smtp = None
+        smtp_class = StubSMTP if self.stub else smtplib.SMTP
+        self._smtp = smtp_class(self.settings['smtp_host'], timeout=self.settings['smtp_timeout'])
+        return self._smtp
+
+    # Runs on the single mailer thread, which owns the SMTP connection
+
+    def flush_emails(self):
+        with self._lock:
+            batch, self._emails = self._emails, []
+        if not batch:
+            return
+
+        message = EmailMessage()
+        message['From'] = self.settings['email_sender']
+        message['To'] = self.settings['email_recipient']
+        message['Subject'] = f"Anomaly digest: {len(batch)} notifications"
+        message.set_content("\n\n".join(f"{subject}\n{body}" for subject, body in batch))
+
+        for attempt in range(self.settings['retries'] + 1):
+            try:
+                self._smtp_connection().send_message(message)
+                self._count('digests_sent')
+                return
+            except Exception as e:
+                self._smtp = None
+                if attempt == self.settings['retries']:
+                    print(f"Failed to send email digest: {e}")
+                else:
+                    time.sleep(self.settings['backoff'] * 2 ** attempt)
+        self._count('digests_failed')
+
+    # Shutdown
+
+    def close(self):
+        self._mailer.submit(self.flush_emails)
+        self._mailer.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        for session in self._sessions:
+            session.close()
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
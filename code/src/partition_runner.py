@@ -0,0 +1,756 @@
+import os
+import glob
+import json
+import time
+import socket
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from app_cache import content_hash
+from recon_ingest import load_config, iter_recon_chunks, file_fingerprint, convert_types
+from history_index import value_hashes
+from pipeline_metrics import stage, labels, flush as flush_metrics
+
+
+# Partitioned execution for feeds that do not fit in one frame. The feed is
+# streamed once and hash-partitioned by its key_columns into Parquet shards,
+# so every row of a key lands in the same shard and per-key features (diffs,
+# lags, rolling statistics, key statistics) are exact within a shard. Shards
+# are then processed by worker processes in four map passes, each followed by
+# a reduce step that merges what the shards reported:
+#
+#   profile   column sums for ratio_to_mean, value counts for is_historical
+#             columns that are not the key, history index summaries
+#             -> global means, repeated values, updated history index
+#   features  cleaning and feature engineering with those global values,
+#             moments of the model inputs and a training sample
+#             -> scaler and z-score parameters from the merged moments, the
+#                ensemble fitted on the merged sample
+#   cutoff    histogram of KMeans distances
+#             -> global percentile cutoff
+#   score     detector flags, suppression, categories, per-key scores
+#             -> output shards and manifest.json
+#
+# Every run lives in partitioned_runs/{recon}_{hash}/ (hash of the config
+# entry, the source file fingerprint and the shard count). A finished shard
+# leaves a marker and is never rerun; a failed shard is retried up to
+# max_attempts times and, if it still fails, the run stops with its error in
+# the manifest and picks up from there when started again. Shards and steps
+# are claimed with lock files, so several processes or machines sharing the
+# filesystem can work on the same run.
+
+RUN_DIR = os.environ.get('ANOMALYZE_PARTITION_DIR', 'partitioned_runs')
+LOCK_TIMEOUT = float(os.environ.get('ANOMALYZE_SHARD_LOCK_TIMEOUT', 3600))
+DEFAULT_SHARDS = 16
+DEFAULT_PARTITION_ROWS = 1000000
+DEFAULT_TRAIN_ROWS = 200000
+MAX_ATTEMPTS = 2
+POLL_SECONDS = 2
+HISTOGRAM_BINS = 10000
+SAMPLE_SEED = 42
+ROW_COLUMN = 'Source_Row'
+PASSES = ['profile', 'features', 'cutoff', 'score']
+
+
+class ShardFailure(RuntimeError):
+    def __init__(self, stage_name, errors):
+        self.stage_name = stage_name
+        self.errors = errors
+        super().__init__(f"{len(errors)} shard(s) failed in the {stage_name} pass: {errors}")
+
+
+# Runs and their files
+
+def job_for(recon_name, recon_info, shards=None, run_dir=RUN_DIR):
+    shards = int(shards or recon_info.get('shards', DEFAULT_SHARDS))
+    key = content_hash({'config': recon_info, 'source': file_fingerprint(recon_info['file_path']), 'shards': shards})
+    return {'recon_name': recon_name, 'recon_info': recon_info, 'shards': shards,
+            'dir': os.path.join(run_dir, f"{recon_name}_{key[:16]}")}
+
+
+def _path(job, *parts):
+    return os.path.join(job['dir'], *parts)
+
+
+def _shard_name(shard):
+    return f"shard-{shard:04d}"
+
+
+def _shard_file(job, pass_name, shard, suffix):
+    return _path(job, pass_name, f"{_shard_name(shard)}.{suffix}")
+
+
+def _write(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    write(tmp_file)
+    os.replace(tmp_file, path)
+
+
+def _write_json(path, payload):
+    def write(tmp_file):
+        with open(tmp_file, 'w') as file:
+            json.dump(payload, file, indent=4, default=str)
+    _write(path, write)
+
+
+def _read_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_npy(path, values):
+    def write(tmp_file):
+        with open(tmp_file, 'wb') as file:
+            np.save(file, values)
+    _write(path, write)
+
+
+# Lock files: created exclusively, and taken over once older than
+# LOCK_TIMEOUT (the process that held them is assumed dead)
+
+def claim(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(path) > LOCK_TIMEOUT:
+            os.remove(path)
+    except OSError:
+        pass
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as file:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'claimed_at': time.time()}, file)
+    return True
+
+
+def release(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# A step run once per run (partitioning and the reduce steps); other
+# processes wait for its result
+
+def once(job, name, step):
+    done_file = _path(job, 'steps', f"{name}.json")
+    lock_file = _path(job, 'steps', f"{name}.lock")
+    while not os.path.exists(done_file):
+        if claim(lock_file):
+            try:
+                if not os.path.exists(done_file):
+                    with stage(f"reduce_{name}"):
+                        _write_json(done_file, step(job))
+            finally:
+                release(lock_file)
+        else:
+            time.sleep(POLL_SECONDS)
+    return _read_json(done_file)
+
+
+# Partition: stream the feed and append each chunk's rows to their shard
+
+def shard_ids(data, key_columns, shards, offset):
+    if not key_columns:
+        return (np.arange(len(data)) + offset) % shards
+    return (value_hashes(data, key_columns) % np.uint64(shards)).astype(np.int64)
+
+
+class ShardWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        self.writers = {}
+        self.parts = {}
+
+    def write(self, shard, frame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        writer = self.writers.get(shard)
+        if writer is not None and not writer.schema.equals(table.schema):
+            try:
+                table = table.cast(writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                # A chunk typed differently (e.g. ints, then floats with
+                # NaN) starts a new part file
+                writer.close()
+                writer = None
+        if writer is None:
+            part = self.parts[shard] = self.parts.get(shard, -1) + 1
+            path = os.path.join(self.directory, _shard_name(shard), f"part-{part:04d}.parquet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writer = self.writers[shard] = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def partition(job):
+    import shutil
+    recon_name, recon_info, shards = job['recon_name'], job['recon_info'], job['shards']
+    key_columns = recon_info.get('key_columns', [])
+    if not key_columns:
+        print(f"Warning: {recon_name} has no key_columns; rows are spread over the shards in turn.")
+    tmp_dir = _path(job, 'input.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    rows = np.zeros(shards, dtype=np.int64)
+    offset = 0
+    writer = ShardWriter(tmp_dir)
+    try:
+        for chunk in iter_recon_chunks(recon_name, recon_info, recon_info.get('partition_rows', DEFAULT_PARTITION_ROWS)):
+            chunk[ROW_COLUMN] = np.arange(offset, offset + len(chunk))
+            ids = shard_ids(chunk, key_columns, shards, offset)
+            order = np.argsort(ids, kind='stable')
+            bounds = np.searchsorted(ids[order], np.arange(shards + 1))
+            for shard in np.flatnonzero(np.diff(bounds)):
+                writer.write(shard, chunk.iloc[order[bounds[shard]:bounds[shard + 1]]])
+            rows += np.diff(bounds)
+            offset += len(chunk)
+    finally:
+        writer.close()
+    shutil.rmtree(_path(job, 'input'), ignore_errors=True)
+    os.replace(tmp_dir, _path(job, 'input'))
+    print(f"Partitioned {offset} rows of {recon_name} into {shards} shards "
+          f"({int(rows.min())} to {int(rows.max())} rows per shard).")
+    return {'rows': rows.tolist(), 'total': offset}
+
+
+def load_shard(job, shard):
+    paths = sorted(glob.glob(os.path.join(_path(job, 'input', _shard_name(shard)), '*.parquet')))
+    return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+
+
+def prepare(job, shard):
+    from data_preprocessing import clean
+    data = convert_types(load_shard(job, shard), job['recon_info'])
+    return clean(job['recon_name'], job['recon_info'], data)
+
+
+# Features that need the whole feed: ratio_to_mean (the column mean) and
+# is_historical on columns that are not the key (a value can occur in
+# several shards). With history_index, is_historical comes from the index.
+
+def global_features(recon_info):
+    from feature_engine import legacy_features, feature_name
+    key_columns = set(recon_info.get('key_columns', []))
+    ratios, historical = [], []
+    for feature in recon_info.get('features') or legacy_features(recon_info):
+        for col in feature['columns']:
+            if feature['type'] == 'ratio_to_mean':
+                ratios.append((feature_name(feature, col), col))
+            elif feature['type'] == 'is_historical' and not recon_info.get('history_index') \
+                    and not (key_columns and key_columns <= {col}):
+                historical.append((feature_name(feature, col), col))
+    return ratios, historical
+
+
+# Per-process cache of the run's reduced context
+
+_loaded = {}
+
+
+def _cached(path, load):
+    if path not in _loaded:
+        _loaded[path] = load(path)
+    return _loaded[path]
+
+
+def profile_shard(job, shard):
+    from history_index import feed_values, summarize_key
+    recon_info = job['recon_info']
+    data = prepare(job, shard)
+    ratios, historical = global_features(recon_info)
+
+    sums = {col: [float(data[col].sum()), int(data[col].count())] for _, col in ratios
+            if col in data.columns and pd.api.types.is_numeric_dtype(data[col].dtype)}
+    for name, col in historical:
+        if col in data.columns:
+            hashes, counts = np.unique(value_hashes(data, [col]), return_counts=True)
+            frame = pd.DataFrame({'hash': hashes, 'rows': counts})
+            _write(_shard_file(job, 'profile', shard, f"{name}.parquet"), lambda path: frame.to_parquet(path, index=False))
+
+    if recon_info.get('history_index'):
+        feed = feed_values(data, recon_info)
+        for name, hashes in feed['hashes'].items():
+            summary = summarize_key(hashes, feed['dates'], feed['breaks'])
+            _write(_shard_file(job, 'profile', shard, f"history-{name}.parquet"),
+                   lambda path: summary.to_parquet(path, index=False))
+    return {'rows': len(data), 'sums': sums}
+
+
+def reduce_profile(job):
+    recon_name, recon_info = job['recon_name'], job['recon_info']
+    shards = active_shards(job)
+    results = shard_results(job, 'profile')
+    ratios, historical = global_features(recon_info)
+
+    means = {}
+    for _, col in ratios:
+        total, count = np.sum([result['sums'].get(col, [0.0, 0]) for result in results], axis=0)
+        means[col] = float(total / count) if count else None
+
+    for name, col in historical:
+        paths = [path for path in (_shard_file(job, 'profile', shard, f"{name}.parquet") for shard in shards)
+                 if os.path.exists(path)]
+        if paths:
+            counts = pd.concat([pd.read_parquet(path) for path in paths]).groupby('hash')['rows'].sum()
+            _write_npy(_path(job, 'context', f"repeated-{name}.npy"),
+                       np.sort(counts.index.to_numpy(dtype=np.uint64)[counts.to_numpy() > 1]))
+
+    # The feed's per-key summaries are merged across shards and folded into
+    # the persistent index once (keyed by content, so a rerun is a no-op);
+    # shards then look rows up as if the feed had been folded in first
+    digests = {}
+    if recon_info.get('history_index'):
+        from history_index import FeedSummary, history_keys, merge_index, LOOKUP_COLUMNS
+        summary = FeedSummary()
+        for name, _ in history_keys(recon_info):
+            parts = [pd.read_parquet(path) for path in
+                     (_shard_file(job, 'profile', shard, f"history-{name}.parquet") for shard in shards)
+                     if os.path.exists(path)]
+            if not parts:
+                continue
+            feed = parts[0] if len(parts) == 1 else merge_index(pd.concat(parts[1:], ignore_index=True), parts[0])
+            summary.summaries[name] = merge_index(None, feed)
+            digests[name] = summary.digest(name)
+        for name, index in summary.apply(recon_name).items():
+            _write(_path(job, 'context', f"history-{name}.parquet"),
+                   lambda path: index[LOOKUP_COLUMNS].to_parquet(path, index=False))
+
+    return {'rows': int(sum(result['rows'] for result in results)), 'means': means, 'history_digests': digests}
+
+
+def apply_context(job, data, context):
+    recon_name, recon_info = job['recon_name'], job['recon_info']
+    ratios, historical = global_features(recon_info)
+    for name, col in ratios:
+        if name in data.columns and context['means'].get(col) is not None:
+            data[name] = data[col].abs() / (context['means'][col] + 1e-5)
+    for name, col in historical:
+        path = _path(job, 'context', f"repeated-{name}.npy")
+        if name in data.columns and os.path.exists(path):
+            data[name] = np.isin(value_hashes(data, [col]), _cached(path, np.load)).astype(np.int8)
+    if recon_info.get('history_index'):
+        from history_index import history_features
+        index = {}
+        for name in context['history_digests']:
+            path = _path(job, 'context', f"history-{name}.parquet")
+            if os.path.exists(path):
+                index[name] = _cached(path, pd.read_parquet)
+        history_features(recon_name, recon_info, data, update=False, index=index)
+    return data
+
+
+def features_shard(job, shard):
+    from data_preprocessing import engineer_features
+    from anomaly_ensemble import select_target_columns, model_dtype, model_matrix
+    recon_name, recon_info = job['recon_name'], job['recon_info']
+    context = _read_json(_path(job, 'steps', 'profile.json'))
+
+    # The shared history index is only read here; it was updated in the reduce
+    data = engineer_features(recon_name, dict(recon_info, history_index=False), prepare(job, shard))
+    apply_context(job, data, context)
+    _write(_shard_file(job, 'features', shard, 'parquet'), lambda path: data.to_parquet(path, index=False))
+
+    target_columns = select_target_columns(recon_info, data.columns)
+    values = model_matrix(data, target_columns, model_dtype(recon_info))
+    mean = values.mean(axis=0, dtype=np.float64)
+    m2 = ((values - mean) ** 2).sum(axis=0)
+    fraction = min(1.0, recon_info.get('train_rows', DEFAULT_TRAIN_ROWS) / context['rows'])
+    sample = values[np.random.default_rng(SAMPLE_SEED + shard).random(len(values)) < fraction]
+    _write_npy(_shard_file(job, 'features', shard, 'sample.npy'), sample)
+    return {'rows': len(values), 'target_columns': target_columns, 'mean': mean.tolist(), 'm2': m2.tolist()}
+
+
+# Chan's parallel update of (count, mean, M2), as in key_stats_store
+
+def merge_moments(results):
+    n, mean, m2 = 0, 0.0, 0.0
+    for result in results:
+        n_b, mean_b, m2_b = result['rows'], np.asarray(result['mean']), np.asarray(result['m2'])
+        total = n + n_b
+        delta = mean_b - mean
+        mean = mean + delta * n_b / total
+        m2 = m2 + m2_b + delta ** 2 * n * n_b / total
+        n = total
+    return n, mean, m2
+
+
+def merged_scaler(n, mean, m2):
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    scaler.mean_ = mean
+    scaler.var_ = m2 / n
+    scaler.scale_ = np.where(scaler.var_ > 0, np.sqrt(scaler.var_), 1.0)
+    scaler.n_features_in_ = len(mean)
+    scaler.n_samples_seen_ = n
+    return scaler
+
+
+def kmeans_distances(ensemble, scaled_data):
+    kmeans = ensemble['kmeans']
+    return np.linalg.norm(scaled_data - kmeans.cluster_centers_[kmeans.predict(scaled_data)], axis=1)
+
+
+def reduce_features(job):
+    import joblib
+    from anomaly_ensemble import fit_ensemble
+    recon_name, recon_info = job['recon_name'], job['recon_info']
+    results = shard_results(job, 'features')
+    target_columns = results[0]['target_columns'] if results else []
+    if not target_columns:
+        raise ValueError(f"No valid columns for anomaly detection in {recon_name}.")
+    if any(result['target_columns'] != target_columns for result in results):
+        raise ValueError(f"Shards of {recon_name} disagree on the model columns.")
+
+    # Scaler and z-score parameters from all rows; the detectors are fitted on
+    # the merged sample, standardized with the global scaler
+    n, mean, m2 = merge_moments(results)
+    scaler = merged_scaler(n, mean, m2)
+    sample = np.concatenate([np.load(_shard_file(job, 'features', shard, 'sample.npy'))
+                             for shard in active_shards(job)])
+    ensemble, _ = fit_ensemble(sample, n_jobs=recon_info.get('n_jobs'),
+                               profile=recon_info.get('detector_profile', 'exact'), scaler=scaler)
+    ensemble['z_mean'] = np.zeros(len(mean))
+    ensemble['z_std'] = (scaler.var_ > 0).astype(float)
+    ensemble['n_train'] = len(sample)
+
+    upper = float(kmeans_distances(ensemble, scaler.transform(sample)).max()) * 4 or 1.0
+    _write(_path(job, 'context', 'model.joblib'),
+           lambda path: joblib.dump({'ensemble': ensemble, 'target_columns': target_columns}, path))
+    print(f"Fitted {recon_name} ensemble on {len(sample)} sampled rows; scaler from {n} rows.")
+    return {'rows': int(n), 'target_columns': target_columns, 'sample_rows': len(sample), 'histogram_upper': upper}
+
+
+def load_model(job):
+    import joblib
+    return _cached(_path(job, 'context', 'model.joblib'), joblib.load)
+
+
+def shard_matrix(job, shard, target_columns):
+    from anomaly_ensemble import model_dtype, model_matrix
+    data = pd.read_parquet(_shard_file(job, 'features', shard, 'parquet'), columns=target_columns)
+    return model_matrix(data, target_columns, model_dtype(job['recon_info']))
+
+
+def cutoff_shard(job, shard):
+    model = load_model(job)
+    upper = _read_json(_path(job, 'steps', 'features.json'))['histogram_upper']
+    ensemble = model['ensemble']
+    distances = kmeans_distances(ensemble, ensemble['scaler'].transform(shard_matrix(job, shard, model['target_columns'])))
+    counts, _ = np.histogram(distances, bins=HISTOGRAM_BINS, range=(0, upper))
+    return {'counts': counts.tolist(), 'above': int((distances > upper).sum()), 'max': float(distances.max())}
+
+
+# Percentile from the merged histogram, interpolated like np.percentile
+# between the two ranked distances around it; each ranked distance is placed
+# evenly within its bin, so the error is below 1/HISTOGRAM_BINS of the range
+
+def histogram_percentile(counts, above, upper, maximum, q):
+    cumulative = np.cumsum(counts)
+    width = upper / len(counts)
+
+    def ranked(k):
+        if k >= cumulative[-1]:
+            return maximum
+        b = int(np.searchsorted(cumulative, k, side='right'))
+        before = cumulative[b - 1] if b else 0
+        return (b + (k - before + 0.5) / counts[b]) * width
+
+    rank = q / 100 * (cumulative[-1] + above - 1)
+    low = int(np.floor(rank))
+    return ranked(low) + (rank - low) * (ranked(low + 1) - ranked(low)) if rank > low else ranked(low)
+
+
+def reduce_cutoff(job):
+    from anomaly_ensemble import KMEANS_PERCENTILE
+    results = shard_results(job, 'cutoff')
+    counts = np.sum([result['counts'] for result in results], axis=0)
+    cutoff = histogram_percentile(counts, sum(result['above'] for result in results),
+                                  _read_json(_path(job, 'steps', 'features.json'))['histogram_upper'],
+                                  max(result['max'] for result in results), KMEANS_PERCENTILE)
+    return {'kmeans_cutoff': float(cutoff)}
+
+
+def score_shard(job, shard):
+    from Anamoly_Detector import classify_anomalies, suppress_known
+    from anomaly_ensemble import DETECTOR_COLUMNS, score_ensemble, apply_flags
+    recon_name, recon_info = job['recon_name'], job['recon_info']
+    model = load_model(job)
+    ensemble = dict(model['ensemble'], kmeans_cutoff=_read_json(_path(job, 'steps', 'cutoff.json'))['kmeans_cutoff'])
+
+    data = pd.read_parquet(_shard_file(job, 'features', shard, 'parquet'))
+    flags = score_ensemble(ensemble, shard_matrix(job, shard, model['target_columns']))
+    apply_flags(data, flags)
+    suppressed = suppress_known(data, suppression_index(recon_name, recon_info), recon_info)
+    classify_anomalies(data, recon_info)
+
+    # Per-key scores against each key's own rows (all of them are in this shard)
+    if recon_info.get('key_stats') and recon_info.get('key_columns'):
+        from key_stats_store import summarize_batch, score_rows
+        data = score_rows(data, summarize_batch(data, recon_info), recon_info)
+
+    output_file = _shard_file(job, 'output', shard, 'parquet')
+    _write(output_file, lambda path: data.to_parquet(path, index=False))
+    return {'rows': len(data), 'flagged': int(data['Anomaly'].sum()), 'suppressed': int(suppressed),
+            'detectors': {detector: int(flags[detector].sum()) for detector in DETECTOR_COLUMNS},
+            'file': os.path.relpath(output_file, job['dir'])}
+
+
+def suppression_index(recon_name, recon_info):
+    if not recon_info.get('suppression', True):
+        return None
+    from suppression_index import build_index
+    return _cached(('suppression', recon_name), lambda _: build_index(recon_name, recon_info))
+
+
+def write_manifest(job, status='complete', failure=None):
+    partitioned = _read_json(_path(job, 'steps', 'partition.json'))
+    manifest = {'recon': job['recon_name'], 'status': status, 'shards': job['shards'],
+                'source': file_fingerprint(job['recon_info']['file_path']),
+                'config_hash': content_hash(job['recon_info']), 'rows': partitioned['total'],
+                'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if failure is not None:
+        manifest['failed'] = {'pass': failure.stage_name,
+                              'shards': {_shard_name(shard): error for shard, error in failure.errors.items()}}
+    else:
+        outputs = []
+        for shard in active_shards(job):
+            done = _read_json(_shard_file(job, 'score', shard, 'json'))
+            outputs.append({'shard': shard, 'host': done['host'], 'attempt': done['attempt'], **done['result']})
+        manifest.update({
+            'flagged': sum(output['flagged'] for output in outputs),
+            'suppressed': sum(output['suppressed'] for output in outputs),
+            'kmeans_cutoff': _read_json(_path(job, 'steps', 'cutoff.json'))['kmeans_cutoff'],
+            'outputs': outputs
+        })
+    _write_json(_path(job, 'manifest.json'), manifest)
+    return manifest
+
+
+SHARD_TASKS = {'profile': profile_shard, 'features': features_shard, 'cutoff': cutoff_shard, 'score': score_shard}
+REDUCE_STEPS = {'profile': reduce_profile, 'features': reduce_features, 'cutoff': reduce_cutoff,
+                'score': write_manifest}
+
+
+# Map passes. Shards are claimed one at a time as workers free up, so
+# processes on other machines take the shards this one has not started.
+
+def active_shards(job):
+    return [shard for shard, rows in enumerate(job['rows']) if rows]
+
+
+def shard_results(job, pass_name):
+    return [_read_json(_shard_file(job, pass_name, shard, 'json'))['result'] for shard in active_shards(job)]
+
+
+def run_task(pass_name, job, shard, attempt):
+    lock_file = _shard_file(job, pass_name, shard, 'lock')
+    failed_file = _shard_file(job, pass_name, shard, 'failed')
+    try:
+        with labels(recon=job['recon_name']), stage(f"shard_{pass_name}") as s:
+            result = SHARD_TASKS[pass_name](job, shard)
+            s.set(shard=shard, attempt=attempt)
+            s.rows_out(result.get('rows', 0))
+        _write_json(_shard_file(job, pass_name, shard, 'json'),
+                    {'shard': shard, 'attempt': attempt, 'host': socket.gethostname(), 'pid': os.getpid(),
+                     'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'result': result})
+        release(failed_file)
+        return None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        _write_json(failed_file, {'shard': shard, 'attempt': attempt, 'host': socket.gethostname(), 'error': error})
+        return error
+    finally:
+        release(lock_file)
+
+
+# Worker processes, kept across passes so each imports pandas and
+# scikit-learn once; native thread pools are split between the workers
+
+def _limit_threads(threads):
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads)
+
+
+class WorkerPool:
+    def __init__(self, workers):
+        self.workers = max(workers, 1)
+        self.executor = None
+
+    def submit(self, *args):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_limit_threads,
+                                                initargs=(max(1, (os.cpu_count() or 1) // self.workers),))
+        return self.executor.submit(*args)
+
+    def reset(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None
+
+
+def run_pass(job, pass_name, pool=None, max_attempts=MAX_ATTEMPTS):
+    shards = active_shards(job)
+    attempts = dict.fromkeys(shards, 0)
+    errors = {}
+    running = {}
+    slots = pool.workers if pool is not None else 1
+
+    def finished(shard, error):
+        if error is not None:
+            errors[shard] = error
+            print(f"Warning: {job['recon_name']} {pass_name} {_shard_name(shard)} failed "
+                  f"(attempt {attempts[shard]} of {max_attempts}): {error}")
+
+    while True:
+        pending = [shard for shard in shards if shard not in running.values()
+                   and not os.path.exists(_shard_file(job, pass_name, shard, 'json'))]
+        if not pending and not running:
+            return
+        started = False
+        for shard in pending:
+            if len(running) >= slots:
+                break
+            if attempts[shard] >= max_attempts or not claim(_shard_file(job, pass_name, shard, 'lock')):
+                continue
+            attempts[shard] += 1
+            started = True
+            if pool is None:
+                finished(shard, run_task(pass_name, job, shard, attempts[shard]))
+            else:
+                running[pool.submit(run_task, pass_name, job, shard, attempts[shard])] = shard
+
+        if running:
+            done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                shard = running.pop(future)
+                try:
+                    error = future.result()
+                except Exception as e:
+                    # The worker died (e.g. killed for memory) before it could
+                    # record the failure
+                    release(_shard_file(job, pass_name, shard, 'lock'))
+                    error = f"{type(e).__name__}: {e}"
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                finished(shard, error)
+            if broken and not running:
+                pool.reset()
+        elif not started:
+            if all(attempts[shard] >= max_attempts for shard in pending):
+                raise ShardFailure(pass_name, {shard: errors.get(shard, 'failed elsewhere') for shard in pending})
+            # Shards claimed by other processes
+            time.sleep(POLL_SECONDS)
+
+
+def run_partitioned(recon_name, recon_info, shards=None, workers=1, run_dir=RUN_DIR, max_attempts=MAX_ATTEMPTS):
+    job = job_for(recon_name, recon_info, shards, run_dir)
+    print(f"\nRunning {recon_name} in {job['shards']} key-partitioned shards under {job['dir']}...")
+    with labels(recon=recon_name):
+        job['rows'] = once(job, 'partition', partition)['rows']
+        pool = WorkerPool(workers) if workers > 1 else None
+        try:
+            for pass_name in PASSES:
+                run_pass(job, pass_name, pool, max_attempts)
+                once(job, pass_name, REDUCE_STEPS[pass_name])
+        except ShardFailure as failure:
+            write_manifest(job, 'failed', failure)
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+    manifest = _read_json(_path(job, 'manifest.json'))
+    print(f"Scored {manifest['rows']} rows of {recon_name} in {len(manifest['outputs'])} shards: "
+          f"{manifest['flagged']} anomalies, {manifest['suppressed']} known false positives suppressed.")
+    return job, manifest
+
+
+# Output shards in shard order, appended to one CSV (the Source_Row column
+# gives each row's position in the feed)
+
+def combine(job, manifest, output_file):
+    for i, output in enumerate(manifest['outputs']):
+        data = pd.read_parquet(_path(job, output['file']))
+        data.to_csv(output_file, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    print(f"Results saved to {output_file}.")
+    return output_file
+
+
+def run_status(job):
+    print(f"{job['recon_name']} ({job['dir']}):")
+    if not os.path.exists(_path(job, 'steps', 'partition.json')):
+        print("  not partitioned yet")
+        return
+    job['rows'] = _read_json(_path(job, 'steps', 'partition.json'))['rows']
+    for pass_name in PASSES:
+        counts = {'done': 0, 'running': 0, 'failed': 0}
+        for shard in active_shards(job):
+            if os.path.exists(_shard_file(job, pass_name, shard, 'json')):
+                counts['done'] += 1
+            elif os.path.exists(_shard_file(job, pass_name, shard, 'lock')):
+                counts['running'] += 1
+            elif os.path.exists(_shard_file(job, pass_name, shard, 'failed')):
+                counts['failed'] += 1
+        print(f"  {pass_name}: {counts['done']} of {len(active_shards(job))} shards done, "
+              f"{counts['running']} running, {counts['failed']} failed")
+
+
+# Run (or report on) every recon of a config; False when a recon stopped on
+# failed shards
+
+def run_config(config, shards=None, workers=1, run_dir=RUN_DIR, max_attempts=MAX_ATTEMPTS, combined=False,
+               status=False):
+    failed = []
+    for recon_name, recon_info in config.items():
+        if status:
+            run_status(job_for(recon_name, recon_info, shards, run_dir))
+            continue
+        try:
+            job, manifest = run_partitioned(recon_name, recon_info, shards, workers, run_dir, max_attempts)
+        except ShardFailure as failure:
+            print(f"Warning: {recon_name} stopped: {failure}. Run again to retry the failed shards.")
+            failed.append(recon_name)
+            continue
+        if combined:
+            combine(job, manifest, f"{recon_name}_anomaly_results.csv")
+    flush_metrics()
+    return not failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run recons as key-partitioned shards in worker processes.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--recon', action='append', help="only this recon (repeatable)")
+    parser.add_argument('--shards', type=int, default=None, help=f"shard count (default: 'shards' or {DEFAULT_SHARDS})")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes on this machine")
+    parser.add_argument('--run-dir', default=RUN_DIR, help="run directory shared by all machines")
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help="attempts per shard in this process")
+    parser.add_argument('--combine', action='store_true', help="also write {recon}_anomaly_results.csv")
+    parser.add_argument('--status', action='store_true', help="show progress of the runs instead")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.recon:
+        config = {name: config[name] for name in args.recon}
+    if not run_config(config, args.shards, args.workers, args.run_dir, args.max_attempts, args.combine, args.status):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import pandas as pd
+from app_cache import content_hash, feedback_fingerprints
+from recon_ingest import load_config, load_recon, file_fingerprint, print_cache_report
+from pipeline_metrics import stage as metric_stage, labels, flush as flush_metrics
+
+
+# Pipeline stage graph. Ingestion, feature engineering, detection,
+# summarization and dispatch are declared in STAGES with the stages they
+# consume, the recon_config.json keys they depend on and any external inputs
+# (source file, feedback store, model registry). Stages run per recon and hand
+# their output (an artifact) to the next stage in memory, so detection scores
+# the engineered feature frame instead of re-reading the CSV. Every artifact
+# is also stored under .pipeline_cache/, keyed by a hash of the stage's config
+# keys, external inputs and the content hashes of its input artifacts: a stage
+# whose key is unchanged is skipped, and because keys use content hashes, a
+# touched file with the same data does not rerun detection. --from-stage
+# forces a stage and everything after it to rerun; --to-stage stops early.
+
+PIPELINE_DIR = os.environ.get('ANOMALYZE_PIPELINE_DIR', '.pipeline_cache')
+
+
+# Content hashes of artifacts (frames hashed row by row, the rest as JSON)
+
+def artifact_hash(artifact):
+    if isinstance(artifact, pd.DataFrame):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([[str(col) for col in artifact.columns],
+                                  [str(dtype) for dtype in artifact.dtypes]]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(artifact, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    return content_hash(artifact)
+
+
+# Stored artifacts: frames as Parquet, everything else as JSON, each with a
+# small JSON entry holding its key and content hash so a skipped stage does
+# not load its artifact unless a later stage needs it
+
+class ArtifactStore:
+    def __init__(self, root=PIPELINE_DIR):
+        self.root = root
+
+    def _base(self, stage_name, recon_name, key):
+        return os.path.join(self.root, stage_name, f"{recon_name}_{key[:16]}")
+
+    def lookup(self, stage_name, recon_name, key):
+        try:
+            with open(f"{self._base(stage_name, recon_name, key)}.json") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or not os.path.exists(os.path.join(self.root, stage_name, entry['file'])):
+            return None
+        return entry
+
+    def load(self, stage_name, entry):
+        path = os.path.join(self.root, stage_name, entry['file'])
+        if entry['format'] == 'parquet':
+            return pd.read_parquet(path)
+        with open(path) as file:
+            return json.load(file)
+
+    def save(self, stage_name, recon_name, key, artifact):
+        digest = artifact_hash(artifact)
+        base = self._base(stage_name, recon_name, key)
+        file_format = 'parquet' if isinstance(artifact, pd.DataFrame) else 'artifact.json'
+        path = f"{base}.{file_format}"
+        try:
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            if file_format == 'parquet':
+                artifact.to_parquet(tmp_path, index=False)
+            else:
+                with open(tmp_path, 'w') as file:
+                    json.dump(artifact, file, default=str)
+            os.replace(tmp_path, path)
+
+            entry = {'key': key, 'artifact_hash': digest, 'format': 'parquet' if file_format == 'parquet' else 'json',
+                     'file': os.path.basename(path), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            tmp_entry = f"{base}.json.{os.getpid()}.tmp"
+            with open(tmp_entry, 'w') as file:
+                json.dump(entry, file, indent=4)
+            os.replace(tmp_entry, f"{base}.json")
+            self._remove_stale(stage_name, recon_name, os.path.basename(base))
+        except Exception as e:
+            print(f"Warning: could not store the {stage_name} artifact for {recon_name}: {e}")
+        return digest
+
+    def _remove_stale(self, stage_name, recon_name, keep):
+        stage_dir = os.path.join(self.root, stage_name)
+        pattern = re.compile(re.escape(recon_name) + r'_[0-9a-f]{16}\.')
+        for name in os.listdir(stage_dir):
+            if pattern.match(name) and not name.startswith(f"{keep}."):
+                try:
+                    os.remove(os.path.join(stage_dir, name))
+                except OSError:
+                    pass
+
+
+# Stages. Each takes the recon, its config entry, the artifacts of the stages
+# it declares as inputs and the run options, and returns its artifact.
+
+def run_ingest(recon_name, recon_info, inputs, options):
+    return load_recon(recon_name, recon_info)
+
+
+def run_features(recon_name, recon_info, inputs, options):
+    from data_preprocessing import engineer_features
+    return engineer_features(recon_name, recon_info, inputs['ingest'].copy())
+
+
+def run_detect(recon_name, recon_info, inputs, options):
+    from Anamoly_Detector import detect_recon
+    score_only = options.get('score_only') or recon_info.get('score_only', False)
+    return detect_recon(recon_name, recon_info, inputs['features'].copy(), score_only, plot=False)
+
+
+def run_summarize(recon_name, recon_info, inputs, options):
+    from Streamline_Workflow_Agents import summarize_breaks
+    detected = inputs['detect']
+    if detected is None:
+        return []
+    return summarize_breaks(detected[detected['Anomaly'].astype(bool)])
+
+
+def run_dispatch(recon_name, recon_info, inputs, options):
+    from Streamline_Workflow_Agents import operator_assist
+    from notification_dispatcher import NotificationDispatcher
+    with NotificationDispatcher(stub=options.get('stub')) as dispatcher:
+        for summary in inputs['summarize']:
+            operator_assist(dispatcher, summary)
+    return dict(dispatcher.stats)
+
+
+# External inputs that are not artifacts of an earlier stage
+
+def source_file(recon_name, recon_info, options):
+    return {'file': file_fingerprint(recon_info['file_path'])}
+
+
+def detection_inputs(recon_name, recon_info, options):
+    external = {'score_only': bool(options.get('score_only') or recon_info.get('score_only', False))}
+    if recon_info.get('suppression', True):
+        external['feedback'] = feedback_fingerprints()
+    if external['score_only']:
+        from model_registry import REGISTRY_DIR
+        index_file = os.path.join(REGISTRY_DIR, recon_name, 'index.json')
+        external['registry'] = file_fingerprint(index_file) if os.path.exists(index_file) else None
+    return external
+
+
+def dispatch_inputs(recon_name, recon_info, options):
+    return {'stub': bool(options.get('stub'))}
+
+
+# inputs: upstream stages; config_keys: recon_config.json keys the stage reads
+# (None for the whole entry); external: extra key inputs; outputs: files the
+# stage writes, which must exist for a stored artifact to be reused
+
+STAGES = {
+    'ingest': {'inputs': [], 'config_keys': ['file_path', 'criteria_columns', 'derived_columns', 'key_columns',
+                                             'historical_columns', 'dtype_plan'],
+               'external': source_file, 'run': run_ingest},
+    'features': {'inputs': ['ingest'], 'config_keys': ['criteria_columns', 'derived_columns', 'historical_columns',
+                                                       'key_columns', 'date_columns', 'date_formats', 'features',
+                                                       'history_index', 'break_column', 'break_values'],
+                 'run': run_features},
+    'detect': {'inputs': ['features'], 'config_keys': None, 'external': detection_inputs, 'run': run_detect,
+               'outputs': lambda recon_name: [f"{recon_name}_anomaly_results.csv"]},
+    'summarize': {'inputs': ['detect'], 'config_keys': [], 'run': run_summarize},
+    'dispatch': {'inputs': ['summarize'], 'config_keys': [], 'external': dispatch_inputs, 'run': run_dispatch}
+}
+STAGE_ORDER = list(STAGES)
+
+
+def stage_key(stage_name, recon_name, recon_info, input_hashes, options):
+    spec = STAGES[stage_name]
+    config_keys = spec['config_keys']
+    config = recon_info if config_keys is None else {key: recon_info.get(key) for key in config_keys}
+    external = spec['external'](recon_name, recon_info, options) if 'external' in spec else None
+    return content_hash({'stage': stage_name, 'config': config, 'external': external, 'inputs': input_hashes})
+
+
+def _stages_to_run(from_stage=None, to_stage=None):
+    for name in [from_stage, to_stage]:
+        if name is not None and name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}'. Expected one of {STAGE_ORDER}.")
+    last = STAGE_ORDER.index(to_stage) + 1 if to_stage else len(STAGE_ORDER)
+    forced = set(STAGE_ORDER[STAGE_ORDER.index(from_stage):last]) if from_stage else set()
+    return STAGE_ORDER[:last], forced
+
+
+# Run one recon through the graph. Artifacts of skipped stages are loaded
+# only when a stage that runs needs them, or for the final stage's result.
+
+def run_recon(recon_name, recon_info, order, forced, options, store):
+    entries, artifacts, hashes, status = {}, {}, {}, {}
+
+    def artifact(name):
+        if name not in artifacts:
+            artifacts[name] = store.load(name, entries[name])
+        return artifacts[name]
+
+    for name in order:
+        spec = STAGES[name]
+        key = stage_key(name, recon_name, recon_info, {i: hashes[i] for i in spec['inputs']}, options)
+        entry = None if name in forced else store.lookup(name, recon_name, key)
+        if entry is not None and all(os.path.exists(path) for path in spec.get('outputs', lambda _: [])(recon_name)):
+            entries[name] = entry
+            hashes[name] = entry['artifact_hash']
+            status[name] = 'cached'
+            continue
+
+        inputs = {i: artifact(i) for i in spec['inputs']}
+        with metric_stage(name):
+            artifacts[name] = spec['run'](recon_name, recon_info, inputs, options)
+        hashes[name] = store.save(name, recon_name, key, artifacts[name])
+        status[name] = 'ran'
+
+    return {'status': status, 'hashes': hashes, 'output': artifact(order[-1]) if order else None}
+
+
+def run_pipeline(config, from_stage=None, to_stage=None, score_only=False, stub=None, pipeline_dir=PIPELINE_DIR):
+    order, forced = _stages_to_run(from_stage, to_stage)
+    options = {'score_only': score_only, 'stub': stub}
+    store = ArtifactStore(pipeline_dir)
+    results = {}
+    for recon_name, recon_info in config.items():
+        with labels(recon=recon_name):
+            results[recon_name] = run_recon(recon_name, recon_info, order, forced, options, store)
+        summary = ', '.join(f"{name} {state}" for name, state in results[recon_name]['status'].items())
+        print(f"{recon_name}: {summary}.")
+    print_cache_report()
+    flush_metrics()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the recon pipeline as a graph of memoized stages.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--recon', action='append', help="only this recon (repeatable)")
+    parser.add_argument('--from-stage', choices=STAGE_ORDER, default=None,
+                        help="rerun this stage and every later one even if their inputs are unchanged")
+    parser.add_argument('--to-stage', choices=STAGE_ORDER, default=None, help="stop after this stage")
+    parser.add_argument('--score-only', action='store_true', help="score with registered models instead of refitting")
+    parser.add_argument('--stub', action='store_true', help="dispatch against fake endpoints")
+    parser.add_argument('--pipeline-dir', default=PIPELINE_DIR, help="where stage artifacts are stored")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.recon:
+        config = {name: config[name] for name in args.recon}
+    run_pipeline(config, args.from_stage, args.to_stage, args.score_only, True if args.stub else None,
+                 args.pipeline_dir)
+
+
+if __name__ == "__main__":
+    main()
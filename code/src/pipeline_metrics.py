@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import threading
+import resource
+import contextvars
+from contextlib import contextmanager
+
+
+# Per-stage instrumentation for detection runs. Wrap a stage in
+#
+#   with stage('fit', rows_in=len(data)) as s:
+#       ...
+#       s.rows_out(len(result))
+#       s.flagged({'IF_Anomaly': 12})
+#
+# to record wall time, process CPU time, RSS before and after, peak RSS growth,
+# rows in/out and per-detector flag counts. Labels such as the recon name are
+# set once with `with labels(recon=...)` and inherited by nested stages.
+# Records are appended as JSON lines to metrics/pipeline_metrics.jsonl and
+# the latest value per stage is written to a Prometheus textfile
+# (metrics/anomalyze.prom) on flush(). Metrics are off unless
+# ANOMALYZE_METRICS=1 (or enable() is called); when off, stage() returns a
+# shared no-op object.
+
+METRICS_DIR = os.environ.get('ANOMALYZE_METRICS_DIR', 'metrics')
+JSONL_FILE = 'pipeline_metrics.jsonl'
+PROM_FILE = 'anomalyze.prom'
+SAMPLE_INTERVAL = 0.01
+
+settings = {'enabled': os.environ.get('ANOMALYZE_METRICS') == '1', 'metrics_dir': METRICS_DIR}
+RUN_ID = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+_labels = contextvars.ContextVar('metric_labels', default={})
+_lock = threading.Lock()
+_latest = {}
+
+
+def enable(metrics_dir=None):
+    settings['enabled'] = True
+    if metrics_dir:
+        settings['metrics_dir'] = metrics_dir
+
+
+def disable():
+    settings['enabled'] = False
+
+
+def enabled():
+    return settings['enabled']
+
+
+# Memory: current RSS from /proc, sampled on a background thread while a
+# stage runs (falls back to the process high-water mark elsewhere)
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+class PeakSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start = self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return False
+
+
+@contextmanager
+def labels(**values):
+    token = _labels.set({**_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+class Stage:
+    def __init__(self, name, rows_in=None, **stage_labels):
+        self.labels = {'stage': name, **_labels.get(), **stage_labels}
+        self.record = {'run_id': RUN_ID, **self.labels, 'rows_in': rows_in, 'rows_out': None, 'flagged': {}}
+
+    def rows_out(self, rows):
+        self.record['rows_out'] = int(rows)
+
+    def flagged(self, counts):
+        self.record['flagged'].update({detector: int(count) for detector, count in counts.items()})
+
+    # Extra fields go to the JSON log only
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def __enter__(self):
+        self._sampler = PeakSampler().__enter__()
+        self._started_at = time.time()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self._sampler.__exit__()
+        self.record.update({
+            'started_at': round(self._started_at, 3),
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_rss_delta_mb': round(self._sampler.peak - self._sampler.start, 2),
+            'rss_before_mb': round(self._sampler.start, 2),
+            'rss_after_mb': round(current_rss_mb(), 2),
+            'status': 'ok' if exc_type is None else 'error'
+        })
+        if exc_type is not None:
+            self.record['error'] = f"{exc_type.__name__}: {exc}"
+        record_stage(self.record, self.labels)
+        return False
+
+
+class _NullStage:
+    def rows_out(self, rows):
+        pass
+
+    def flagged(self, counts):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+def stage(name, rows_in=None, **stage_labels):
+    if not settings['enabled']:
+        return NULL_STAGE
+    return Stage(name, None if rows_in is None else int(rows_in), **stage_labels)
+
+
+# Export. The stage name and labels identify a Prometheus series.
+
+def record_stage(record, stage_labels):
+    key = tuple(sorted((k, str(v)) for k, v in stage_labels.items()))
+    line = json.dumps(record, default=str)
+    with _lock:
+        _latest[key] = record
+        os.makedirs(settings['metrics_dir'], exist_ok=True)
+        with open(os.path.join(settings['metrics_dir'], JSONL_FILE), 'a') as file:
+            file.write(line + '\n')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, label_values, value):
+    rendered = ','.join(f'{k}="{_escape(v)}"' for k, v in label_values)
+    return f"{name}{{{rendered}}} {value}"
+
+
+PROM_GAUGES = [
+    ('anomalyze_stage_wall_seconds', 'Wall time of the last run of a pipeline stage.', 'wall_s', 1),
+    ('anomalyze_stage_cpu_seconds', 'Process CPU time of the last run of a pipeline stage.', 'cpu_s', 1),
+    ('anomalyze_stage_peak_rss_delta_bytes', 'Peak RSS growth during the last run of a pipeline stage.',
+     'peak_rss_delta_mb', 2 ** 20),
+    ('anomalyze_stage_rss_after_bytes', 'Resident memory at the end of the last run of a pipeline stage.',
+     'rss_after_mb', 2 ** 20),
+    ('anomalyze_stage_rows_in', 'Rows entering the last run of a pipeline stage.', 'rows_in', 1),
+    ('anomalyze_stage_rows_out', 'Rows leaving the last run of a pipeline stage.', 'rows_out', 1)
+]
+
+
+def prometheus_text():
+    with _lock:
+        latest = list(_latest.items())
+
+    lines = []
+    for name, help_text, field, scale in PROM_GAUGES:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for key, record in latest:
+            if record.get(field) is not None:
+                lines.append(_series(name, key, round(record[field] * scale, 6)))
+
+    lines += ["# HELP anomalyze_stage_success 1 if the last run of a pipeline stage finished without an error.",
+              "# TYPE anomalyze_stage_success gauge"]
+    lines += [_series('anomalyze_stage_success', key, int(record['status'] == 'ok')) for key, record in latest]
+
+    lines += ["# HELP anomalyze_detector_flagged Rows flagged by each detector in the last run of a pipeline stage.",
+              "# TYPE anomalyze_detector_flagged gauge"]
+    for key, record in latest:
+        for detector, count in sorted(record['flagged'].items()):
+            lines.append(_series('anomalyze_detector_flagged', key + (('detector', detector),), count))
+
+    lines += ["# HELP anomalyze_last_run_timestamp_seconds Time the metrics file was written.",
+              "# TYPE anomalyze_last_run_timestamp_seconds gauge",
+              f"anomalyze_last_run_timestamp_seconds {time.time():.3f}"]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=None):
+    path = path or os.path.join(settings['metrics_dir'], PROM_FILE)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(prometheus_text())
+    os.replace(tmp_path, path)
+    return path
+
+
+def flush():
+    if settings['enabled'] and _latest:
+        return write_prometheus()
+    return None
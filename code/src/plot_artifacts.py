@@ -0,0 +1,178 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Plot modes for batch runs:
+#   show      draw interactive figures with pyplot (the default)
+#   headless  skip rendering entirely
+#   artifact  write downsampled PNGs on a background thread
+# The mode comes from --plots or ANOMALYZE_PLOTS. Artifact plots are built
+# from small precomputed inputs (a sample stratified by the anomaly flag, or
+# histogram bins) so the render thread never holds the full frame, and they
+# are drawn with matplotlib's object API on an Agg canvas, which does not
+# touch pyplot's global state.
+
+PLOT_MODES = ['show', 'headless', 'artifact']
+PLOT_DIR = os.environ.get('ANOMALYZE_PLOT_DIR', 'plots')
+MAX_POINTS = 20000
+HISTOGRAM_BINS = 20
+
+
+def plot_mode(mode=None):
+    mode = mode or os.environ.get('ANOMALYZE_PLOTS', 'show')
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot mode '{mode}'. Expected one of {PLOT_MODES}.")
+    return mode
+
+
+# Downsampling: flagged rows are kept up to half of the budget and normal
+# rows fill the rest, so rare anomalies stay visible
+
+def stratified_sample(data, flag_column='Anomaly', max_points=MAX_POINTS, seed=42):
+    if len(data) <= max_points:
+        return data
+    flags = data[flag_column].to_numpy(dtype=bool)
+    flagged = np.flatnonzero(flags)
+    normal = np.flatnonzero(~flags)
+    rng = np.random.default_rng(seed)
+    n_flagged = min(len(flagged), max_points // 2)
+    n_normal = min(len(normal), max_points - n_flagged)
+    keep = np.concatenate([rng.choice(flagged, n_flagged, replace=False),
+                           rng.choice(normal, n_normal, replace=False)])
+    return data.iloc[np.sort(keep)]
+
+
+# Uniform sample of a chunked stream, per stratum: every row gets a random
+# priority and the max_points lowest priorities of each stratum are kept
+
+class StreamSample:
+    def __init__(self, columns, flag_column='Anomaly', max_points=MAX_POINTS, seed=42):
+        self.columns = list(columns) + [flag_column]
+        self.flag_column = flag_column
+        self.max_points = max_points
+        self.rng = np.random.default_rng(seed)
+        self.pool = None
+
+    def add(self, chunk):
+        part = chunk[self.columns].copy()
+        part['_priority'] = self.rng.random(len(part))
+        pool = part if self.pool is None else pd.concat([self.pool, part], ignore_index=True)
+        pool = pool.sort_values('_priority', kind='stable')
+        self.pool = pool.groupby(self.flag_column, sort=False).head(self.max_points)
+
+    def frame(self):
+        if self.pool is None:
+            return pd.DataFrame(columns=self.columns)
+        return stratified_sample(self.pool.drop(columns='_priority'), self.flag_column, self.max_points)
+
+
+# Histogram of every numeric cell without stacking the frame: shared bin
+# edges over the global range, counts summed column by column
+
+def numeric_histogram(data, bins=HISTOGRAM_BINS):
+    columns = [data[col].to_numpy(dtype=float) for col in data.select_dtypes(include=np.number).columns]
+    columns = [values[np.isfinite(values)] for values in columns]
+    columns = [values for values in columns if values.size]
+    if not columns:
+        return np.zeros(bins, dtype=np.int64), np.linspace(0, 1, bins + 1)
+    edges = np.histogram_bin_edges([], bins=bins, range=(min(v.min() for v in columns), max(v.max() for v in columns)))
+    counts = np.zeros(bins, dtype=np.int64)
+    for values in columns:
+        counts += np.histogram(values, bins=edges)[0]
+    return counts, edges
+
+
+def show_histogram(counts, edges, title):
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 6))
+    plt.stairs(counts, edges, fill=True)
+    plt.title(title)
+    plt.xlabel("Value")
+    plt.ylabel("Frequency")
+    plt.grid(True)
+    plt.show()
+
+
+def _figure():
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _save(figure, path):
+    tmp_path = f"{path}.tmp.png"
+    figure.savefig(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def render_scatter(path, x, y, flags, title, xlabel, ylabel):
+    figure = _figure()
+    axes = figure.add_subplot()
+    axes.scatter(x[~flags], y[~flags], s=8, c='blue', label='Normal')
+    axes.scatter(x[flags], y[flags], s=8, c='red', label='Anomaly')
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.grid(True)
+    axes.legend()
+    return _save(figure, path)
+
+
+def render_histogram(path, counts, edges, title):
+    figure = _figure()
+    axes = figure.add_subplot()
+    axes.stairs(counts, edges, fill=True)
+    axes.set_title(title)
+    axes.set_xlabel("Value")
+    axes.set_ylabel("Frequency")
+    axes.grid(True)
+    return _save(figure, path)
+
+
+class ArtifactRenderer:
+    def __init__(self, plot_dir=PLOT_DIR, max_points=MAX_POINTS):
+        self.plot_dir = plot_dir
+        self.max_points = max_points
+        self.futures = []
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='plot-render')
+        os.makedirs(plot_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.plot_dir, f"{name}.png")
+
+    def scatter(self, data, x_column, y_column, name, title, flag_column='Anomaly'):
+        sample = stratified_sample(data, flag_column, self.max_points)
+        x = sample[x_column].to_numpy(dtype=float)
+        y = sample[y_column].to_numpy(dtype=float)
+        flags = sample[flag_column].to_numpy(dtype=bool)
+        future = self._executor.submit(render_scatter, self._path(name), x, y, flags, title, x_column, y_column)
+        self.futures.append(future)
+        return future
+
+    def histogram(self, counts, edges, name, title):
+        future = self._executor.submit(render_histogram, self._path(name), counts, edges, title)
+        self.futures.append(future)
+        return future
+
+    # Wait for pending renders; returns the written paths
+    def close(self):
+        self._executor.shutdown(wait=True)
+        paths = []
+        for future in self.futures:
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                print(f"Warning: failed to render plot: {e}")
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,142 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from pipeline_metrics import stage
+
+
+# Date parsing for the recon feeds. Every date column of a recon (its
+# date_columns) is parsed the same way everywhere: with the formats declared
+# under "date_formats" in recon_config.json, tried in order,
+#
+#   "date_formats": ["%m/%d/%y", "%m/%d/%Y"]                   (every date column)
+#   "date_formats": {"ReconDate": ["%m/%d/%y", "%m/%d/%Y"]}     (per column)
+#
+# or, without formats, by inferring the format of each value separately (so a
+# feed mixing 01/08/24 and 01/14/2024 parses both). Only the distinct values
+# are parsed, once, and mapped back to the rows through their factorized codes;
+# parsed values are also memoized across calls, so chunks, the feature engine,
+# the rules and the history index share them. Values that match no format
+# become NaT and are counted, never dropped silently.
+
+MAX_CACHED_VALUES = 100000
+NEVER = np.datetime64('NaT', 'ns')
+
+_parsed = {}
+
+
+def date_formats(recon_info, col):
+    formats = recon_info.get('date_formats') or []
+    if isinstance(formats, dict):
+        formats = formats.get(col) or []
+    return [formats] if isinstance(formats, str) else list(formats)
+
+
+def _parse_strings(values, formats):
+    values = pd.Series(values, dtype=object)
+    if not formats:
+        return pd.to_datetime(values, errors='coerce', format='mixed').to_numpy(dtype='datetime64[ns]')
+    parsed = np.full(len(values), NEVER)
+    for date_format in formats:
+        pending = np.isnat(parsed)
+        if not pending.any():
+            break
+        parsed[pending] = pd.to_datetime(values[pending], errors='coerce', format=date_format) \
+            .to_numpy(dtype='datetime64[ns]')
+    return parsed
+
+
+# Parse each distinct value once (or take it from the memo)
+
+def parse_unique(uniques, formats):
+    cached = _parsed.setdefault(tuple(formats), pd.Series(dtype='datetime64[ns]'))
+    positions = cached.index.get_indexer(uniques)
+    parsed = np.full(len(uniques), NEVER)
+    parsed[positions >= 0] = cached.to_numpy()[positions[positions >= 0]]
+    missing = positions < 0
+    if missing.any():
+        parsed[missing] = _parse_strings(uniques[missing], formats)
+        if len(cached) + missing.sum() > MAX_CACHED_VALUES:
+            cached = cached.iloc[:0]
+        _parsed[tuple(formats)] = pd.concat([cached, pd.Series(parsed[missing], index=uniques[missing])])
+    return parsed
+
+
+# Parsed dates of a column as datetime64[ns], plus the distinct values that
+# did not parse and how many rows carry them
+
+def parse_dates(values, formats=()):
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.to_numpy(dtype='datetime64[ns]'), {}
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    uniques = np.asarray(uniques, dtype=object).astype(str)
+    parsed = parse_unique(uniques, formats)
+    failed = np.flatnonzero(np.isnat(parsed))
+    failures = {}
+    if len(failed):
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        failures = {str(uniques[i]): int(counts[i]) for i in failed}
+    return np.append(parsed, NEVER)[codes], failures
+
+
+# Dates of the recon's first date column present in the frame (None when
+# there is none)
+
+def date_column(data, recon_info, col=None):
+    columns = [col] if col else recon_info.get('date_columns', [])
+    return next((c for c in columns if c is not None and c in data.columns), None)
+
+
+def date_values(data, recon_info, col=None):
+    col = date_column(data, recon_info, col)
+    if col is None:
+        return None
+    return parse_dates(data[col], date_formats(recon_info, col))[0]
+
+
+def report_failures(recon_name, col, failures, rows):
+    if failures:
+        examples = ', '.join(repr(value) for value in list(failures)[:5])
+        print(f"Warning: {sum(failures.values())} of {rows} values in '{col}' of {recon_name} "
+              f"did not match the date formats and are treated as missing (e.g. {examples}).")
+
+
+# Normalization stage: every date column becomes datetime64[ns]; returns the
+# unparsed row count per column
+
+def normalize_dates(recon_name, recon_info, data):
+    unparsed = {}
+    with stage('dates', rows_in=len(data), recon=recon_name) as s:
+        for col in recon_info.get('date_columns', []):
+            if col not in data.columns or pd.api.types.is_datetime64_any_dtype(data[col].dtype):
+                continue
+            dates, failures = parse_dates(data[col], date_formats(recon_info, col))
+            data[col] = dates
+            unparsed[col] = sum(failures.values())
+            report_failures(recon_name, col, failures, len(data))
+        s.set(unparsed=unparsed)
+    return unparsed
+
+
+def main():
+    from recon_ingest import load_config, load_recon
+    parser = argparse.ArgumentParser(description="Check how the date columns of each recon parse.")
+    parser.add_argument('--config', default='recon_config.json')
+    args = parser.parse_args()
+
+    for recon_name, recon_info in load_config(args.config).items():
+        data = load_recon(recon_name, recon_info)
+        for col in recon_info.get('date_columns', []):
+            if col not in data.columns:
+                print(f"Warning: '{col}' not found in {recon_name} dataset. Skipping.")
+                continue
+            start = time.perf_counter()
+            dates, failures = parse_dates(data[col], date_formats(recon_info, col))
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{recon_name} {col}: {len(dates)} rows, {data[col].nunique()} distinct values, "
+                  f"{sum(failures.values())} unparsed, {elapsed:.1f} ms")
+            report_failures(recon_name, col, failures, len(dates))
+
+
+if __name__ == "__main__":
+    main()
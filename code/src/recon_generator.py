@@ -0,0 +1,314 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# Synthetic recon feeds for load-testing the detectors. Rows are generated in
+# chunks with vectorized NumPy draws and streamed to chunked Parquet (one row
+# group per chunk) or CSV, so memory stays bounded at any row count. Row i
+# belongs to key i % keys and period i // period_rows; key attributes are drawn
+# once from the seed and each fixed block of SEED_BLOCK_ROWS rows draws from its
+# own seeded generator, so a given seed produces the same rows whatever the
+# chunk size. A ground-truth label file records which rows are breaks and
+# which carry injected anomalies.
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+SEED_BLOCK_ROWS = 65_536
+
+IHUB_COLUMNS = ['As of Date', 'Company', 'Account', 'AU', 'Currency', 'Primary Account', 'Secondary Account',
+                'GL Balance', 'iHub Balance', 'Balance Difference', 'Match Status', 'Comment']
+CATALYST_COLUMNS = ['MatchStatus', 'ReconDate', 'Comment', 'QuantityDifference', 'TradeID', 'DeskName', 'Buy_Sell',
+                    'Trade_Date', 'Settle_Date', 'Original_Quantity', 'Original_Price', 'Impact_Price',
+                    'Price_Tolerance', 'Impact_Quantity', 'Quantity_Tolerance', 'Anomaly']
+LABEL_COLUMNS = ['row_id', 'key_id', 'period', 'is_break', 'is_anomaly', 'anomaly_type']
+
+COMPANIES = ['0000', '0002', '0003', '0004']
+CURRENCIES = ['USD', 'EUR', 'GBP']
+PRIMARY_ACCOUNTS = ['ALL OTHER LOANS', 'PERSONAL LOANS']
+SECONDARY_ACCOUNTS = ['DEFERRED COSTS', 'DEFERRED ORIGINATION FEES', 'PRINCIPAL']
+IHUB_COMMENTS = ['Validated by reconciler', 'Pending investigation', 'Data source error', 'Currency conversion issue',
+                 'Out of tolerance range']
+
+DESKS = ['RMDS-Agency OMIs', 'RMDS-Corp Bonds', 'RMDS-Govt Bonds']
+BUY_SELL = ['B', 'S']
+PRICE_TOLERANCE = 0.01
+QUANTITY_TOLERANCE = 1
+CATALYST_COMMENTS = ['[{Factor rounding is causing minor delta in quantity}]',
+                     '[{Manual adjustment pending validation}]',
+                     '[{Discrepancy identified, awaiting action}]',
+                     '[{Data source issue, reconciliation in progress}]']
+CATALYST_STATUS = ['Match', 'Price Break', 'Quantity Break', 'Quantity & Price Break']
+CATALYST_STATUS_COMMENTS = ['[{Valid trade, discrepancy within tolerance}]', '[{Price discrepancy beyond tolerance}]',
+                            '[{Quantity discrepancy beyond tolerance}]']
+
+ANOMALY_TYPES = ['none', 'spike', 'sign_flip', 'quantity_blowup', 'price_jump']
+
+
+def _choice(rng, options, size):
+    return pd.Categorical.from_codes(rng.integers(0, len(options), size), categories=options)
+
+
+def _format_dates(dates, date_format):
+    # Format each distinct date once and index into the result
+    unique, inverse = np.unique(dates, return_inverse=True)
+    return pd.DatetimeIndex(unique).strftime(date_format).to_numpy()[inverse]
+
+
+def _injected(rng, size, anomaly_ratio):
+    return rng.random(size) < anomaly_ratio
+
+
+# Key attributes shared by every chunk
+
+def ihub_keys(rng, keys):
+    return {
+        'Company': _choice(rng, COMPANIES, keys),
+        'Account': rng.integers(1_000_000, 10_000_000, keys).astype(str),
+        'AU': rng.integers(1000, 10000, keys),
+        'Currency': _choice(rng, CURRENCIES, keys),
+        'Primary Account': _choice(rng, PRIMARY_ACCOUNTS, keys),
+        'Secondary Account': _choice(rng, SECONDARY_ACCOUNTS, keys),
+        'base_balance': rng.integers(10_000, 100_000, keys).astype(np.float64),
+    }
+
+
+def catalyst_keys(rng, keys):
+    return {
+        'TradeID': (1_000_000 + (rng.choice(9_000_000, keys, replace=False) if keys <= 9_000_000
+                                 else rng.permutation(keys))).astype(str),
+        'DeskName': _choice(rng, DESKS, keys),
+        'base_price': np.round(rng.uniform(10, 100, keys), 2),
+    }
+
+
+# iHub-style month-end balances: each key's GL balance drifts around its base
+# value; breaks offset the iHub balance, anomalies spike or flip the GL balance
+
+def ihub_chunk(rng, key_table, row_ids, key_ids, periods, start_date, break_ratio, anomaly_ratio):
+    n = len(row_ids)
+    period_index = pd.period_range(pd.Timestamp(start_date).to_period('M') + int(periods.min()),
+                                   periods=int(periods.max() - periods.min()) + 1, freq='M')
+    date_strings = period_index.to_timestamp(how='end').strftime('%m/%d/%Y').to_numpy()[periods - periods.min()]
+
+    gl_balance = np.round(key_table['base_balance'][key_ids] * rng.normal(1, 0.05, n))
+    is_anomaly = _injected(rng, n, anomaly_ratio)
+    anomaly_type = np.where(is_anomaly, rng.integers(1, 3, n), 0)
+    gl_balance = np.where(anomaly_type == 1, gl_balance * rng.uniform(5, 20, n), gl_balance)
+    gl_balance = np.where(anomaly_type == 2, -gl_balance, gl_balance)
+
+    is_break = rng.random(n) < break_ratio
+    offset = rng.integers(-50_000, 50_001, n)
+    offset = np.where(offset == 0, 1, offset)
+    ihub_balance = np.where(is_break, gl_balance + offset, gl_balance)
+    balance_diff = gl_balance - ihub_balance
+
+    comment_codes = np.where(is_break, rng.integers(0, len(IHUB_COMMENTS), n), 0)
+    data = pd.DataFrame({
+        'As of Date': date_strings,
+        'Company': key_table['Company'][key_ids],
+        'Account': key_table['Account'][key_ids],
+        'AU': key_table['AU'][key_ids],
+        'Currency': key_table['Currency'][key_ids],
+        'Primary Account': key_table['Primary Account'][key_ids],
+        'Secondary Account': key_table['Secondary Account'][key_ids],
+        'GL Balance': gl_balance.astype(np.int64),
+        'iHub Balance': ihub_balance.astype(np.int64),
+        'Balance Difference': balance_diff.astype(np.int64),
+        'Match Status': pd.Categorical.from_codes(is_break.astype(np.int8), categories=['Match', 'Break']),
+        'Comment': pd.Categorical.from_codes(comment_codes, categories=IHUB_COMMENTS),
+    }, columns=IHUB_COLUMNS)
+    return data, is_break, is_anomaly, anomaly_type
+
+
+# Catalyst-style daily trade recon: breaks move price and/or quantity beyond
+# tolerance; anomalies blow up the impact quantity or jump the impact price
+
+def catalyst_chunk(rng, key_table, row_ids, key_ids, periods, start_date, break_ratio, anomaly_ratio):
+    n = len(row_ids)
+    recon_dates = np.datetime64(pd.Timestamp(start_date).date()) + periods.astype('timedelta64[D]')
+    trade_dates = recon_dates - rng.integers(1, 6, n).astype('timedelta64[D]')
+    settle_dates = trade_dates + np.timedelta64(2, 'D')
+
+    original_price = np.round(key_table['base_price'][key_ids] * rng.normal(1, 0.02, n), 2)
+    original_quantity = rng.integers(1000, 50_001, n)
+
+    is_break = rng.random(n) < break_ratio
+    break_kind = rng.integers(1, 4, n)
+    price_break = is_break & ((break_kind & 1) > 0)
+    quantity_break = is_break & ((break_kind & 2) > 0)
+    price_delta = np.where(price_break, rng.uniform(PRICE_TOLERANCE * 2, 0.05, n) * rng.choice([-1, 1], n),
+                           rng.uniform(-PRICE_TOLERANCE / 2, PRICE_TOLERANCE / 2, n))
+    quantity_delta = np.where(quantity_break, rng.integers(QUANTITY_TOLERANCE + 1, 4, n) * rng.choice([-1, 1], n),
+                              rng.integers(-QUANTITY_TOLERANCE, QUANTITY_TOLERANCE + 1, n))
+
+    is_anomaly = _injected(rng, n, anomaly_ratio)
+    anomaly_type = np.where(is_anomaly, rng.integers(3, 5, n), 0)
+    quantity_delta = np.where(anomaly_type == 3, original_quantity * rng.integers(10, 100, n), quantity_delta)
+    price_delta = np.where(anomaly_type == 4, original_price * rng.uniform(1, 4, n), price_delta)
+
+    impact_price = original_price + price_delta
+    impact_quantity = original_quantity + quantity_delta
+    price_diff = np.abs(original_price - impact_price)
+    quantity_diff = np.abs(original_quantity - impact_quantity)
+    status = (price_diff > PRICE_TOLERANCE).astype(np.int8) + 2 * (quantity_diff > QUANTITY_TOLERANCE).astype(np.int8)
+    is_break = status > 0
+
+    comment_codes = np.where(status == 3, rng.integers(0, len(CATALYST_COMMENTS), n) + len(CATALYST_STATUS_COMMENTS),
+                             status)
+    data = pd.DataFrame({
+        'MatchStatus': pd.Categorical.from_codes(status, categories=CATALYST_STATUS),
+        'ReconDate': _format_dates(recon_dates, '%m/%d/%Y'),
+        'Comment': pd.Categorical.from_codes(comment_codes, categories=CATALYST_STATUS_COMMENTS + CATALYST_COMMENTS),
+        'QuantityDifference': quantity_diff,
+        'TradeID': key_table['TradeID'][key_ids],
+        'DeskName': key_table['DeskName'][key_ids],
+        'Buy_Sell': _choice(rng, BUY_SELL, n),
+        'Trade_Date': _format_dates(trade_dates, '%m/%d/%Y'),
+        'Settle_Date': _format_dates(settle_dates, '%m/%d/%Y'),
+        'Original_Quantity': original_quantity,
+        'Original_Price': original_price,
+        'Impact_Price': impact_price,
+        'Price_Tolerance': PRICE_TOLERANCE,
+        'Impact_Quantity': impact_quantity,
+        'Quantity_Tolerance': QUANTITY_TOLERANCE,
+        'Anomaly': pd.Categorical.from_codes(is_anomaly.astype(np.int8), categories=['No', 'Yes']),
+    }, columns=CATALYST_COLUMNS)
+    return data, is_break, is_anomaly, anomaly_type
+
+
+FEEDS = {
+    'ihub': (ihub_keys, ihub_chunk, '2024-01-31'),
+    'catalyst': (catalyst_keys, catalyst_chunk, '2024-01-01')
+}
+
+
+# Seeded blocks: yields (data, labels) frames of SEED_BLOCK_ROWS rows
+
+def generate_blocks(feed, rows, keys=1000, period_rows=None, break_ratio=0.5, anomaly_ratio=0.01, seed=0,
+                    start_date=None):
+    if feed not in FEEDS:
+        raise ValueError(f"Unknown feed '{feed}'. Expected one of {sorted(FEEDS)}.")
+    make_keys, make_chunk, default_start = FEEDS[feed]
+    period_rows = period_rows or keys
+    key_table = make_keys(np.random.default_rng([seed, 0]), keys)
+
+    for block, start in enumerate(range(0, rows, SEED_BLOCK_ROWS)):
+        rng = np.random.default_rng([seed, 1, block])
+        row_ids = np.arange(start, min(start + SEED_BLOCK_ROWS, rows), dtype=np.int64)
+        key_ids = row_ids % keys
+        periods = row_ids // period_rows
+        data, is_break, is_anomaly, anomaly_type = make_chunk(rng, key_table, row_ids, key_ids, periods,
+                                                              start_date or default_start, break_ratio, anomaly_ratio)
+        labels = pd.DataFrame({
+            'row_id': row_ids,
+            'key_id': key_ids,
+            'period': periods,
+            'is_break': is_break,
+            'is_anomaly': is_anomaly,
+            'anomaly_type': pd.Categorical.from_codes(anomaly_type, categories=ANOMALY_TYPES),
+        }, columns=LABEL_COLUMNS)
+        yield data, labels
+
+
+# Chunk generator: regroups the seeded blocks into (data, labels) frames of
+# chunk_rows rows
+
+def generate(feed, rows, chunk_rows=DEFAULT_CHUNK_ROWS, **options):
+    pending, pending_rows = [], 0
+    for data, labels in generate_blocks(feed, rows, **options):
+        pending.append((data, labels))
+        pending_rows += len(data)
+        while pending_rows >= chunk_rows:
+            data = pd.concat([frame for frame, _ in pending], ignore_index=True)
+            labels = pd.concat([frame for _, frame in pending], ignore_index=True)
+            yield data.iloc[:chunk_rows].reset_index(drop=True), labels.iloc[:chunk_rows].reset_index(drop=True)
+            pending = [(data.iloc[chunk_rows:], labels.iloc[chunk_rows:])]
+            pending_rows -= chunk_rows
+    if pending_rows:
+        yield (pd.concat([frame for frame, _ in pending], ignore_index=True),
+               pd.concat([frame for _, frame in pending], ignore_index=True))
+
+
+# Streaming writers: one Parquet row group or one CSV append per chunk
+
+class ChunkWriter:
+    def __init__(self, path, file_format):
+        self.path = path
+        self.file_format = file_format
+        self.tmp_path = f"{path}.tmp"
+        self._writer = None
+        self._header = True
+
+    def write(self, frame):
+        if self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.tmp_path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.tmp_path, mode='w' if self._header else 'a', header=self._header, index=False)
+            self._header = False
+
+    # Nothing is written (and no file replaced) when no chunk came in
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self.tmp_path):
+            os.replace(self.tmp_path, self.path)
+
+
+def write_feed(feed, rows, out_dir='.', file_format='parquet', name=None, **options):
+    os.makedirs(out_dir, exist_ok=True)
+    name = name or f"{feed}_synthetic"
+    data_path = os.path.join(out_dir, f"{name}.{file_format}")
+    labels_path = os.path.join(out_dir, f"{name}_labels.{file_format}")
+    data_writer = ChunkWriter(data_path, file_format)
+    labels_writer = ChunkWriter(labels_path, file_format)
+
+    counts = {'rows': 0, 'breaks': 0, 'anomalies': 0}
+    for data, labels in generate(feed, rows, **options):
+        data_writer.write(data)
+        labels_writer.write(labels)
+        counts['rows'] += len(data)
+        counts['breaks'] += int(labels['is_break'].sum())
+        counts['anomalies'] += int(labels['is_anomaly'].sum())
+    data_writer.close()
+    labels_writer.close()
+    return data_path, labels_path, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic iHub or Catalyst recon feeds with ground-truth labels.")
+    parser.add_argument('feed', choices=sorted(FEEDS))
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--keys', type=int, default=1000, help="key cardinality (accounts or trade IDs)")
+    parser.add_argument('--period-rows', type=int, default=None,
+                        help="rows per month-end (iHub) or recon day (Catalyst); defaults to --keys")
+    parser.add_argument('--break-ratio', type=float, default=0.5)
+    parser.add_argument('--anomaly-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--start-date', default=None)
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--name', default=None, help="output file stem (default: {feed}_synthetic)")
+    args = parser.parse_args()
+    if args.rows < 1:
+        parser.error("--rows must be at least 1")
+
+    started = time.perf_counter()
+    data_path, labels_path, counts = write_feed(
+        args.feed, args.rows, args.out_dir, args.format, args.name, keys=args.keys, period_rows=args.period_rows,
+        break_ratio=args.break_ratio, anomaly_ratio=args.anomaly_ratio, seed=args.seed, chunk_rows=args.chunk_rows,
+        start_date=args.start_date)
+    print(f"Wrote {counts['rows']} {args.feed} rows ({counts['breaks']} breaks, {counts['anomalies']} injected "
+          f"anomalies) to {data_path} and labels to {labels_path} in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import pandas as pd
+import json
+import os
+import re
+import hashlib
+from dtype_plan import plan_options, apply_plan, stream_plan, frame_mb
+from pipeline_metrics import stage, enabled as metrics_enabled
+
+
+# Shared ingestion layer: every recon feed listed in recon_config.json is parsed
+# from CSV once, typed, and cached on disk as Parquet. Later runs load the cache
+# as long as the source file path, mtime and size and the typed (criteria and
+# derived) columns are unchanged.
+
+CACHE_DIR = os.environ.get('ANOMALYZE_CACHE_DIR', '.recon_cache')
+
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+# Load configuration from recon_config.json
+
+def load_config(config_path='recon_config.json'):
+    with open(config_path, 'r') as file:
+        return json.load(file)
+
+
+# Cache keys
+
+def file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size
+    }
+
+
+# A cache entry holds the typed frame, so its key covers the columns that
+# convert_types makes numeric as well as the source file
+
+def cache_fingerprint(recon_info):
+    numeric = recon_info.get('criteria_columns', []) + recon_info.get('derived_columns', [])
+    return dict(file_fingerprint(recon_info['file_path']), numeric_columns=sorted(set(numeric)))
+
+
+def fingerprint_key(fingerprint):
+    payload = json.dumps(fingerprint, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+def cache_path(recon_name, fingerprint, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{recon_name}_{fingerprint_key(fingerprint)}.parquet")
+
+
+# Column selection
+
+def projection_columns(recon_info):
+    columns = []
+    for group in ['key_columns', 'criteria_columns', 'derived_columns', 'historical_columns', 'date_columns']:
+        for col in recon_info.get(group, []):
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+
+# Typing applied once, before the frame is cached
+
+def convert_types(df, recon_info):
+    for col in recon_info.get('criteria_columns', []) + recon_info.get('derived_columns', []):
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '').str.strip(), errors='coerce')
+    return df
+
+
+# Only this recon's own entries ({recon}_{16 hex}.parquet), so refreshing
+# "iHub" leaves the cache of "iHub_Daily" alone
+
+def _remove_stale_entries(recon_name, keep_path, cache_dir):
+    pattern = re.compile(re.escape(recon_name) + r'_[0-9a-f]{16}\.parquet')
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if pattern.fullmatch(name) and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _select(df, columns):
+    if columns is None:
+        return df
+    return df[[col for col in columns if col in df.columns]]
+
+
+# Compact dtypes from the recon's dtype_plan (frame memory before and after
+# is recorded when metrics are on)
+
+def compact(recon_name, recon_info, df):
+    if plan_options(recon_info) is None:
+        return df
+    with stage('compact', rows_in=len(df), recon=recon_name) as s:
+        before = frame_mb(df) if metrics_enabled() else None
+        apply_plan(df, recon_info)
+        if before is not None:
+            s.set(frame_mb_before=round(before, 2), frame_mb_after=round(frame_mb(df), 2))
+    return df
+
+
+# Load one recon feed through the cache
+
+def load_recon(recon_name, recon_info, columns=None, project=False, cache_dir=CACHE_DIR, use_cache=True):
+    file_path = recon_info['file_path']
+    if project and columns is None:
+        columns = projection_columns(recon_info)
+
+    if not use_cache:
+        return compact(recon_name, recon_info, _select(convert_types(pd.read_csv(file_path), recon_info), columns))
+
+    cached_file = cache_path(recon_name, cache_fingerprint(recon_info), cache_dir)
+
+    if os.path.exists(cached_file):
+        try:
+            if columns is not None:
+                import pyarrow.parquet as pq
+                available = pq.read_schema(cached_file).names
+                columns = [col for col in columns if col in available]
+            df = pd.read_parquet(cached_file, columns=columns)
+            cache_stats['hits'] += 1
+            return compact(recon_name, recon_info, df)
+        except Exception as e:
+            print(f"Warning: ignoring unreadable cache {cached_file}: {e}")
+
+    cache_stats['misses'] += 1
+    df = convert_types(pd.read_csv(file_path), recon_info)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cached_file}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, cached_file)
+        _remove_stale_entries(recon_name, cached_file, cache_dir)
+    except Exception as e:
+        print(f"Warning: could not write ingestion cache for {recon_name}: {e}")
+
+    return compact(recon_name, recon_info, _select(df, columns))
+
+
+# Whole-column (min, max) of the integer columns of a Parquet file, from its
+# row group statistics; columns without statistics are left out
+
+def _integer_ranges(parquet_file):
+    import pyarrow as pa
+    metadata = parquet_file.metadata
+    ranges = {}
+    for j, field in enumerate(parquet_file.schema_arrow):
+        if not pa.types.is_integer(field.type):
+            continue
+        stats = [metadata.row_group(i).column(j).statistics for i in range(metadata.num_row_groups)]
+        if stats and all(stat is not None and stat.has_min_max for stat in stats):
+            ranges[field.name] = (min(stat.min for stat in stats), max(stat.max for stat in stats))
+    return ranges
+
+
+# Stream one recon feed in fixed-size chunks without materializing it. The
+# Parquet cache is read batch by batch when it is current; otherwise the CSV is
+# parsed chunk by chunk (the cache is only populated by load_recon). The dtype
+# plan is derived once, from the first chunk, and applied to every chunk so
+# they all share the same dtypes.
+
+def iter_recon_chunks(recon_name, recon_info, chunk_size, columns=None, cache_dir=CACHE_DIR):
+    file_path = recon_info['file_path']
+    cached_file = cache_path(recon_name, cache_fingerprint(recon_info), cache_dir)
+
+    if os.path.exists(cached_file):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(cached_file)
+        if columns is not None:
+            columns = [col for col in columns if col in parquet_file.schema_arrow.names]
+        cache_stats['hits'] += 1
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns))
+        ranges = _integer_ranges(parquet_file)
+    else:
+        cache_stats['misses'] += 1
+        chunks = (_select(convert_types(chunk, recon_info), columns)
+                  for chunk in pd.read_csv(file_path, chunksize=chunk_size))
+        ranges = None
+
+    plan = None
+    for chunk in chunks:
+        if plan is None:
+            plan = stream_plan(chunk, recon_info, ranges)
+        yield apply_plan(chunk, recon_info, plan)
+
+
+def load_datasets(config, project=False, cache_dir=CACHE_DIR, use_cache=True):
+    datasets = {}
+    for recon_name, recon_info in config.items():
+        datasets[recon_name] = load_recon(recon_name, recon_info, project=project,
+                                          cache_dir=cache_dir, use_cache=use_cache)
+    return datasets
+
+
+# Cache hit/miss reporting
+
+def cache_report():
+    total = cache_stats['hits'] + cache_stats['misses']
+    hit_rate = cache_stats['hits'] / total if total else 0.0
+    return {'hits': cache_stats['hits'], 'misses': cache_stats['misses'], 'hit_rate': round(hit_rate, 4)}
+
+
+def print_cache_report():
+    report = cache_report()
+    print(f"Ingestion cache: {report['hits']} hits, {report['misses']} misses "
+          f"(hit rate {report['hit_rate']:.0%}).")
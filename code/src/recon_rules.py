@@ -0,0 +1,97 @@
+import pandas as pd
+import numpy as np
+from recon_dates import date_values
+
+
+# Vectorized rule engine for the recon apps. Rules are read from the
+# "rules" list of each recon in recon_config.json:
+#
+#   {"type": "threshold", "columns": [...], "threshold": 1000}
+#       flags rows where any column exceeds the threshold
+#   {"type": "group_diff", "columns": [...], "group_by": "As of Date", "period": "M", "threshold": 5000}
+#       diffs each column within each period group; a group whose rows all
+#       break is "Not An Anomaly", otherwise "Anomaly"
+#
+# Every output row appears once, with a Breach_Mask bit set for each rule
+# column that breached (bits are numbered across rules in config order).
+
+def default_rules(recon_type, details):
+    if recon_type == 'iHub_Reconciliation':
+        return [{'type': 'group_diff', 'threshold': details.get('anomaly_threshold', 5000)}]
+    return [{'type': 'threshold', 'threshold': details.get('anomaly_threshold', 1000)}]
+
+
+def _rule_columns(rule, details, df):
+    columns = rule.get('columns', details.get('criteria_columns', []))
+    return [col for col in columns if col in df.columns]
+
+
+def _period(df, rule, details):
+    date_col = rule.get('group_by') or details.get('date_columns', [None])[0]
+    dates = pd.Series(date_values(df, details, date_col), index=df.index)
+    return dates.dt.to_period(rule.get('period', 'M'))
+
+
+def threshold_rule(df, rule, details):
+    columns = _rule_columns(rule, details, df)
+    threshold = rule.get('threshold', details.get('anomaly_threshold', 1000))
+    complete = df[columns].notna().all(axis=1).to_numpy()
+
+    mask = np.zeros(len(df), dtype=np.int64)
+    for bit, col in enumerate(columns):
+        mask |= (df[col].to_numpy(dtype=float) > threshold).astype(np.int64) << bit
+    mask[~complete] = 0
+
+    status = np.where(mask > 0, 'Anomaly', None)
+    return mask, status, mask > 0, len(columns)
+
+
+def group_diff_rule(df, rule, details):
+    columns = _rule_columns(rule, details, df)
+    threshold = rule.get('threshold', details.get('anomaly_threshold', 5000))
+    period = _period(df, rule, details)
+    grouped = df.groupby(period)
+    group_size = period.map(period.value_counts()).to_numpy()
+
+    mask = np.zeros(len(df), dtype=np.int64)
+    status = np.full(len(df), None, dtype=object)
+    for bit, col in enumerate(columns):
+        breaks = grouped[col].diff().abs() > threshold
+        mask |= breaks.to_numpy().astype(np.int64) << bit
+        break_count = breaks.groupby(period).transform('sum').to_numpy()
+        col_status = np.where(break_count == group_size - 1, 'Not An Anomaly', 'Anomaly')
+        status = np.where(break_count > 0, col_status, status)
+
+    return mask, status, period.notna().to_numpy(), len(columns)
+
+
+RULE_TYPES = {
+    'threshold': threshold_rule,
+    'group_diff': group_diff_rule
+}
+
+
+def apply_rules(df, rules, details):
+    breach_mask = np.zeros(len(df), dtype=np.int64)
+    status = np.full(len(df), None, dtype=object)
+    keep = np.zeros(len(df), dtype=bool)
+
+    offset = 0
+    for rule in rules:
+        if rule['type'] not in RULE_TYPES:
+            raise ValueError(f"Unknown rule type '{rule['type']}'. Expected one of {sorted(RULE_TYPES)}.")
+        rule_mask, rule_status, rule_keep, n_columns = RULE_TYPES[rule['type']](df, rule, details)
+        breach_mask |= rule_mask << offset
+        status = np.where(pd.notna(rule_status), rule_status, status)
+        keep |= rule_keep
+        offset += n_columns
+
+    detected = df[keep].copy()
+    detected['Anomaly_Status'] = status[keep]
+    detected['Breach_Mask'] = breach_mask[keep]
+    return detected
+
+
+def detect_with_rules(recon_type, details, recon_df):
+    rules = details.get('rules') or default_rules(recon_type, details)
+    return apply_rules(recon_df, rules, details)
@@ -0,0 +1,419 @@
+import io
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+from collections import deque, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from recon_ingest import load_config, convert_types, file_fingerprint
+from recon_dates import normalize_dates
+from feature_engine import fill_missing, build_features
+from anomaly_ensemble import DETECTOR_COLUMNS, model_dtype, model_matrix, score_ensemble, apply_flags, compile_forest
+from model_registry import REGISTRY_DIR, load_ensemble
+from app_cache import feedback_fingerprints
+from Anamoly_Detector import classify_anomalies, load_suppression_index, suppress_known
+
+
+# Long-running local scoring service. The latest registered ensemble of each
+# recon (see model_registry; fit one with Anamoly_Detector.py first) is loaded
+# once and kept warm, together with the recon's suppression index, history
+# index and per-key statistics. Micro-batches of rows are POSTed as JSON or
+# as an Arrow IPC stream to /score/{recon} and go through the same steps as a
+# detector run: typing, date normalization, missing-value fill, features,
+# scoring, suppression and classification. Features that need a window (diffs,
+# rolling statistics, ratio_to_mean) only see the rows of the batch; history
+# lookups and key statistics use the stored indexes, which the service reads
+# but never updates. A background thread polls the registry, the feedback
+# store, the indexes and the config file and swaps in reloaded models without
+# dropping requests. GET /stats reports latency percentiles per recon.
+# IsolationForest is scored through its flattened node table
+# (anomaly_ensemble.compile_forest), which gives the same flags without a
+# joblib dispatch per tree.
+
+HOST = '127.0.0.1'
+PORT = int(os.environ.get('ANOMALYZE_SERVE_PORT', 8765))
+RELOAD_INTERVAL = float(os.environ.get('ANOMALYZE_RELOAD_INTERVAL', 2))
+LATENCY_WINDOW = 10000
+MAX_BODY_BYTES = 64 * 2 ** 20
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+RESULT_COLUMNS = DETECTOR_COLUMNS + ['Anomaly', 'Suppressed', 'Anomaly_Category', 'Anomaly_Reason', 'Key_History',
+                                     'Key_Anomaly']
+
+
+class RequestError(ValueError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _fingerprint(path):
+    return file_fingerprint(path) if path and os.path.exists(path) else None
+
+
+# Files a recon's warm state is loaded from; a change to any of them reloads it
+
+def recon_sources(recon_name, recon_info, registry_dir=REGISTRY_DIR):
+    sources = {'registry': _fingerprint(os.path.join(registry_dir, recon_name, 'index.json'))}
+    if recon_info.get('suppression', True):
+        sources['feedback'] = feedback_fingerprints()
+    if recon_info.get('history_index'):
+        from history_index import index_dir_for
+        sources['history'] = _fingerprint(os.path.join(index_dir_for(recon_name), 'manifest.json'))
+    if recon_info.get('key_stats'):
+        from key_stats_store import store_path
+        sources['key_stats'] = _fingerprint(store_path(recon_name))
+    return sources
+
+
+# Everything needed to score one recon, loaded once per change of its sources
+
+class WarmRecon:
+    def __init__(self, recon_name, recon_info, registry_dir=REGISTRY_DIR):
+        self.recon_name = recon_name
+        self.recon_info = recon_info
+        self.sources = recon_sources(recon_name, recon_info, registry_dir)
+        self.ensemble, self.entry = load_ensemble(recon_name, recon_info, registry_dir=registry_dir)
+        if self.ensemble is None:
+            return
+        self.target_columns = self.entry['target_columns']
+        self.suppression = load_suppression_index(recon_name, recon_info)
+
+        self.history = None
+        if recon_info.get('history_index'):
+            from history_index import history_keys, load_index
+            self.history = load_index(recon_name, [name for name, _ in history_keys(recon_info)])
+
+        self.key_stats = None
+        if recon_info.get('key_stats'):
+            from key_stats_store import load_store
+            self.key_stats = load_store(recon_name)
+
+        # Flatten the IsolationForest for small batches and build the lazily
+        # created DBSCAN neighbour index now, so the first request does not pay
+        # for it and concurrent requests share one
+        self.ensemble['iso_forest_compiled'] = compile_forest(self.ensemble['iso_forest'])
+        score_ensemble(self.ensemble, np.zeros((1, len(self.target_columns)), dtype=model_dtype(recon_info)))
+        self.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    @property
+    def ready(self):
+        return self.ensemble is not None
+
+    def describe(self):
+        if not self.ready:
+            return {'ready': False}
+        return {'ready': True, 'model_file': self.entry['model_file'], 'n_train': self.entry['n_train'],
+                'fitted_at': self.entry['created_at'], 'loaded_at': self.loaded_at,
+                'target_columns': self.target_columns}
+
+    def score(self, data):
+        recon_name, recon_info = self.recon_name, self.recon_info
+        # Raw input columns first; engineered model columns only exist once
+        # the feature steps have run
+        raw = set(recon_info.get('criteria_columns', [])) | set(recon_info.get('derived_columns', []))
+        missing = [col for col in self.target_columns if col in raw and col not in data.columns]
+        if missing:
+            raise RequestError(400, f"Rows lack the input columns {missing}.")
+
+        convert_types(data, recon_info)
+        normalize_dates(recon_name, recon_info, data)
+        fill_missing(data, recon_info)
+        build_features(recon_name, dict(recon_info, history_index=False), data)
+        if self.history is not None:
+            from history_index import history_features
+            history_features(recon_name, recon_info, data, update=False, index=self.history)
+
+        missing = [col for col in self.target_columns if col not in data.columns]
+        if missing:
+            raise RequestError(400, f"Rows lack the columns the model's features need: {missing}.")
+
+        flags = score_ensemble(self.ensemble, model_matrix(data, self.target_columns, model_dtype(recon_info)))
+        apply_flags(data, flags)
+        suppress_known(data, self.suppression, recon_info)
+        classify_anomalies(data, recon_info)
+
+        if self.key_stats is not None:
+            from key_stats_store import score_rows
+            scored = score_rows(data, self.key_stats, recon_info)
+            for col in scored.columns.difference(data.columns):
+                data[col] = scored[col].to_numpy()
+        return data
+
+    def result_columns(self, data):
+        columns = [col for col in self.recon_info.get('key_columns', []) if col in data.columns]
+        columns += [col for col in RESULT_COLUMNS if col in data.columns]
+        columns += [col for col in data.columns if col.startswith(('Is_Historical_', 'Broke_Before_'))
+                    or col.endswith(('_Key_Change', '_Key_Z'))]
+        return columns
+
+
+# Request latency per recon over the last LATENCY_WINDOW requests
+
+class LatencyStats:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(lambda: {'requests': 0, 'rows': 0, 'errors': 0})
+
+    def record(self, recon_name, seconds, rows):
+        with self.lock:
+            self.samples[recon_name].append(seconds * 1000)
+            self.counts[recon_name]['requests'] += 1
+            self.counts[recon_name]['rows'] += rows
+
+    def error(self, recon_name):
+        with self.lock:
+            self.counts[recon_name]['errors'] += 1
+
+    def report(self):
+        with self.lock:
+            samples = {name: np.array(values) for name, values in self.samples.items()}
+            counts = {name: dict(values) for name, values in self.counts.items()}
+        report = {}
+        for name, values in counts.items():
+            latency = samples.get(name, np.array([]))
+            if len(latency):
+                p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+                values.update(p50_ms=round(p50, 2), p90_ms=round(p90, 2), p99_ms=round(p99, 2),
+                              max_ms=round(latency.max(), 2), window=len(latency))
+            report[name] = values
+        return report
+
+
+# Warm recons keyed by name, reloaded when their sources or the config change
+
+class ScoringService:
+    def __init__(self, config_path, recons=None, registry_dir=REGISTRY_DIR):
+        self.config_path = config_path
+        self.recons = recons
+        self.registry_dir = registry_dir
+        self.config_source = None
+        self.models = {}
+        self.stats = LatencyStats()
+        self.reload_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresh()
+
+    def _read_config(self):
+        config = load_config(self.config_path)
+        if self.recons:
+            config = {name: config[name] for name in self.recons if name in config}
+        return config
+
+    def refresh(self, force=False):
+        with self.reload_lock:
+            config_source = _fingerprint(self.config_path)
+            config_changed = force or config_source != self.config_source
+            config = self._read_config() if config_changed else {name: warm.recon_info
+                                                                 for name, warm in self.models.items()}
+            models = {}
+            reloaded = []
+            for recon_name, recon_info in config.items():
+                current = self.models.get(recon_name)
+                if not config_changed and current is not None \
+                        and current.sources == recon_sources(recon_name, recon_info, self.registry_dir):
+                    models[recon_name] = current
+                    continue
+                models[recon_name] = WarmRecon(recon_name, recon_info, self.registry_dir)
+                reloaded.append(recon_name)
+            self.models = models
+            self.config_source = config_source
+
+        for recon_name in reloaded:
+            warm = models[recon_name]
+            if warm.ready:
+                print(f"Loaded {recon_name} model {warm.entry['model_file']} fitted on {warm.entry['n_train']} rows "
+                      f"at {warm.entry['created_at']}.")
+            else:
+                print(f"Warning: no registered model matches the {recon_name} config; run Anamoly_Detector.py "
+                      f"to fit one. Requests for it are refused until then.")
+        return reloaded
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        def poll():
+            while not self.stopped.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Warning: reload failed, keeping the loaded models: {e}")
+        threading.Thread(target=poll, name='model-reload', daemon=True).start()
+
+    def warm(self, recon_name):
+        warm = self.models.get(recon_name)
+        if warm is None:
+            raise RequestError(404, f"Unknown recon '{recon_name}'. Available: {sorted(self.models)}")
+        if not warm.ready:
+            raise RequestError(503, f"No registered model for {recon_name}; run Anamoly_Detector.py first.")
+        return warm
+
+    def score(self, recon_name, data):
+        warm = self.warm(recon_name)
+        scored = warm.score(data)
+        return scored[warm.result_columns(scored)], warm
+
+    def health(self):
+        return {name: warm.describe() for name, warm in self.models.items()}
+
+
+# Request and response bodies: a JSON list of row objects (or {"rows": [...]})
+# or an Arrow IPC stream; the response uses the same format unless Accept asks
+# for the other
+
+def read_rows(body, content_type):
+    if content_type.startswith(ARROW_STREAM):
+        import pyarrow as pa
+        try:
+            return pa.ipc.open_stream(body).read_pandas()
+        except pa.ArrowInvalid as e:
+            raise RequestError(400, f"Invalid Arrow stream: {e}")
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise RequestError(400, f"Invalid JSON: {e}")
+    rows = payload.get('rows') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise RequestError(400, "Expected a list of row objects, or {\"rows\": [...]}.")
+    return pd.DataFrame.from_records(rows)
+
+
+def write_arrow(data):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'anomalyze'
+
+    def setup(self):
+        # Small responses go out at once on TCP (not applicable to Unix sockets)
+        self.disable_nagle_algorithm = self.request.family != socket.AF_UNIX
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, default=str).encode('utf-8'))
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.send_json(200, {'recons': service.health()})
+        elif self.path == '/stats':
+            self.send_json(200, {'recons': service.stats.report()})
+        else:
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self.send_json(413, {'error': f"Batches are limited to {MAX_BODY_BYTES} bytes."})
+            return
+        body = self.rfile.read(length)
+
+        if self.path == '/reload':
+            self.send_json(200, {'reloaded': service.refresh(force=True)})
+            return
+        if not self.path.startswith('/score/'):
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        start = time.perf_counter()
+        recon_name = self.path[len('/score/'):]
+        content_type = self.headers.get('Content-Type', 'application/json')
+        try:
+            service.warm(recon_name)
+            scored, warm = service.score(recon_name, read_rows(body, content_type))
+        except RequestError as e:
+            if recon_name in service.models:
+                service.stats.error(recon_name)
+            self.send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            service.stats.error(recon_name)
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+
+        if ARROW_STREAM in self.headers.get('Accept', content_type):
+            self.send_body(200, write_arrow(scored), ARROW_STREAM)
+        else:
+            self.send_json(200, {'recon': recon_name, 'model_file': warm.entry['model_file'],
+                                 'flagged': int(scored['Anomaly'].sum()),
+                                 'rows': json.loads(scored.to_json(orient='records', date_format='iso'))})
+        service.stats.record(recon_name, time.perf_counter() - start, len(scored))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_server(service, host=HOST, port=PORT, socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(config_path, recons=None, host=HOST, port=PORT, socket_path=None, registry_dir=REGISTRY_DIR,
+          reload_interval=RELOAD_INTERVAL):
+    service = ScoringService(config_path, recons, registry_dir)
+    if reload_interval > 0:
+        service.watch(reload_interval)
+    server = make_server(service, host, port, socket_path)
+    address = socket_path or f"http://{host}:{server.server_address[1]}"
+    print(f"Scoring {', '.join(service.models)} on {address} (POST /score/{{recon}}, GET /stats, GET /health).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stopped.set()
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve warm recon models for low-latency scoring of micro-batches.")
+    parser.add_argument('--config', default='recon_config.json')
+    parser.add_argument('--recon', action='append', help="only serve this recon (repeatable)")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT, help="TCP port (default: ANOMALYZE_SERVE_PORT or 8765)")
+    parser.add_argument('--socket', default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--model-dir', default=REGISTRY_DIR, help="model registry to load from")
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL,
+                        help="seconds between checks for new models (0 disables hot reload)")
+    args = parser.parse_args(argv)
+    serve(args.config, args.recon, args.host, args.port, args.socket, args.model_dir, args.reload_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from feedback_store import FEEDBACK_DB, query_feedback
+
+
+# Known-false-positive suppression. Analyst feedback is folded into a hashed
+# index of signatures (the recon's key_columns plus a log-scale band of one
+# value column); the latest feedback per signature wins. Scoring hashes each
+# row the same way and checks membership with a hash-table lookup, so benign
+# breaks that were already reviewed are not re-flagged or re-notified.
+
+DEFAULT_SUPPRESS_TYPES = ['False Positive', 'True Negative']
+DEFAULT_TTL_DAYS = 90
+DEFAULT_BANDS_PER_DECADE = 4
+MISSING_BAND = np.iinfo(np.int64).min
+
+
+def band_column(recon_info):
+    if recon_info.get('suppression_band_column'):
+        return recon_info['suppression_band_column']
+    columns = recon_info.get('derived_columns', []) + recon_info.get('criteria_columns', [])
+    return columns[0] if columns else None
+
+
+def value_bands(values, bands_per_decade=DEFAULT_BANDS_PER_DECADE):
+    values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    bands = np.sign(values) * np.floor(np.log10(1 + np.abs(values)) * bands_per_decade)
+    return np.where(np.isnan(bands), MISSING_BAND, bands).astype(np.int64)
+
+
+# Signatures: key values as strings (so 5 from a CSV and 5 from a JSON
+# feedback entry hash alike) plus the value band, hashed to uint64
+
+def signatures(keys, bands):
+    frame = keys.astype(object).where(keys.notna(), None).astype(str).reset_index(drop=True)
+    frame['__band'] = bands
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def row_signatures(data, recon_info):
+    key_columns = [col for col in recon_info.get('key_columns', []) if col in data.columns]
+    column = band_column(recon_info)
+    values = data[column] if column in data.columns else np.full(len(data), np.nan)
+    bands = value_bands(values, recon_info.get('suppression_bands_per_decade', DEFAULT_BANDS_PER_DECADE))
+    return signatures(data[key_columns], bands)
+
+
+# Build the index from the feedback store. Entries older than the TTL, or
+# recorded against another model_version of the recon, are ignored.
+
+def build_index(recon_type, recon_info, db_path=FEEDBACK_DB, now=None):
+    empty = {'signatures': pd.Index([], dtype='uint64'), 'entries': 0}
+    if not os.path.exists(db_path):
+        return empty
+
+    now = time.time() if now is None else now
+    ttl_days = recon_info.get('suppression_ttl_days', DEFAULT_TTL_DAYS)
+    since = now - ttl_days * 86400 if ttl_days else None
+    feedback = query_feedback(recon_type=recon_type, since=since, model_version=recon_info.get('model_version'),
+                              db_path=db_path)
+    if feedback.empty:
+        return empty
+
+    key_columns = recon_info.get('key_columns', [])
+    keys = pd.DataFrame([json.loads(values) for values in feedback['key_values']], columns=key_columns)
+    column = band_column(recon_info)
+    band_values = [json.loads(values).get(column) for values in feedback['feature_values']]
+    bands = value_bands(band_values, recon_info.get('suppression_bands_per_decade', DEFAULT_BANDS_PER_DECADE))
+
+    latest = pd.DataFrame({'signature': signatures(keys, bands), 'feedback_type': feedback['feedback_type']})
+    latest = latest.drop_duplicates('signature', keep='last')
+    suppress_types = recon_info.get('suppress_feedback_types', DEFAULT_SUPPRESS_TYPES)
+    suppressed = latest.loc[latest['feedback_type'].isin(suppress_types), 'signature']
+    return {'signatures': pd.Index(suppressed.to_numpy(), dtype='uint64'), 'entries': len(suppressed)}
+
+
+# Mark suppressed rows. Only rows currently flagged are suppressed; their
+# Anomaly flag is cleared and a Suppressed column records the decision (the
+# column is only added when the index has entries).
+
+def apply_suppression(data, index, recon_info, flag_column='Anomaly'):
+    if index['entries'] == 0 or data.empty:
+        return 0
+    suppressed = pd.Index(row_signatures(data, recon_info)).isin(index['signatures'])
+    if flag_column in data.columns:
+        suppressed &= data[flag_column].to_numpy(dtype=bool)
+        data[flag_column] = data[flag_column].to_numpy(dtype=bool) & ~suppressed
+    data['Suppressed'] = suppressed
+    return int(suppressed.sum())
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from anomaly_ensemble import DENSITY_SAMPLE_ROWS, DBSCAN_EPS, DBSCAN_MIN_SAMPLES, fit_density_outliers
+
+
+# The "large" profile must give DBSCAN's noise label well past the sample
+# size, where a min_samples scaled by the sample fraction dropped to 1 and
+# every sampled row became a core point. Rows are spread thinly (about eight
+# neighbours within eps), so exact DBSCAN stays cheap at this size.
+
+def test_density_outliers_match_dbscan_beyond_sample():
+    rng = np.random.default_rng(0)
+    n_rows = 6 * DENSITY_SAMPLE_ROWS
+    side = np.sqrt(n_rows * np.pi * DBSCAN_EPS ** 2 / 8)
+    values = rng.uniform(0, side, size=(n_rows, 2))
+    values[:100] = rng.uniform(10 * side, 20 * side, size=(100, 2))
+
+    artifacts, noise = fit_density_outliers(values)
+    dbscan = DBSCAN(eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES).fit(values)
+
+    assert noise[:100].all()
+    assert noise.sum() > 500
+    np.testing.assert_array_equal(noise, dbscan.labels_ == -1)
+    assert np.isin(artifacts['dbscan_core_indices'], dbscan.core_sample_indices_).all()
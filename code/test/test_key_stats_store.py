@@ -0,0 +1,49 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from key_stats_store import summarize_batch, merge_summaries, update_store, load_store, load_manifest
+
+RECON_INFO = {'key_columns': ['Key'], 'criteria_columns': ['Value'], 'derived_columns': [],
+              'date_columns': ['As of Date']}
+
+
+def feed(keys, values, date):
+    return pd.DataFrame({'Key': keys, 'Value': values, 'As of Date': pd.Timestamp(date)})
+
+
+# Missing values do not count towards a column's mean and M2
+
+def test_missing_values_are_not_counted():
+    first = summarize_batch(feed(['a'] * 4, [1, 3, np.nan, np.nan], '2024-01-31'), RECON_INFO)
+    row = first.iloc[0]
+    assert (row['count'], row['Value__count'], row['Value__m2']) == (4, 2, 2.0)
+
+    merged = merge_summaries(first, summarize_batch(feed(['a'], [5], '2024-02-29'), RECON_INFO), RECON_INFO)
+    row = merged.iloc[0]
+    assert row['Value__count'] == 3
+    assert row['Value__mean'] == 3.0
+    assert row['Value__m2'] == np.var([1, 3, 5]) * 3
+
+
+def _apply(args):
+    store_dir, frame = args
+    return update_store('recon', RECON_INFO, frame, store_dir)
+
+
+# Two writers applying the same feed at once apply it once
+
+def test_concurrent_updates_apply_a_feed_once(tmp_path):
+    store_dir = str(tmp_path)
+    frame = feed(['a', 'b', 'c'], [1.0, 2.0, 3.0], '2024-01-31')
+    with ProcessPoolExecutor(2) as pool:
+        applied = sorted(pool.map(_apply, [(store_dir, frame)] * 2))
+
+    assert applied == [0, 3]
+    assert load_store('recon', store_dir)['count'].tolist() == [1, 1, 1]
+    assert len(load_manifest('recon', store_dir)['feeds']) == 1
+    assert not os.path.exists(os.path.join(store_dir, 'recon.lock'))
@@ -0,0 +1,94 @@
+import os
+import sys
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import partition_runner
+from partition_runner import (HISTOGRAM_BINS, ShardFailure, histogram_percentile, merge_moments, merged_scaler,
+                              run_pass, _shard_file, _write_json)
+
+
+# The merged-histogram percentile stays within one bin of np.percentile, also
+# when some distances lie beyond the histogram's upper edge
+
+@pytest.mark.parametrize('upper_scale', [1.5, 0.9])
+@pytest.mark.parametrize('q', [50, 95, 99])
+def test_histogram_percentile_matches_numpy(upper_scale, q):
+    distances = np.random.default_rng(0).exponential(2.0, 100000)
+    upper = float(np.percentile(distances, 99.5)) * upper_scale
+    shards = np.array_split(distances, 4)
+    counts = np.sum([np.histogram(shard, bins=HISTOGRAM_BINS, range=(0, upper))[0] for shard in shards], axis=0)
+    above = sum(int((shard > upper).sum()) for shard in shards)
+
+    cutoff = histogram_percentile(counts, above, upper, float(distances.max()), q)
+    assert abs(cutoff - np.percentile(distances, q)) <= upper / HISTOGRAM_BINS
+
+
+# Per-shard moments merged with Chan's update give the scaler fitted on all rows
+
+def test_merged_moments_match_standard_scaler():
+    rng = np.random.default_rng(1)
+    values = rng.normal([10, -3, 0], [5, 0.1, 0], size=(20000, 3))
+    results = []
+    for shard in np.array_split(values, [1, 7000, 7000, 15000]):
+        mean = shard.mean(axis=0) if len(shard) else np.zeros(3)
+        results.append({'rows': len(shard), 'mean': mean.tolist(), 'm2': ((shard - mean) ** 2).sum(axis=0).tolist()})
+
+    scaler = merged_scaler(*merge_moments(results))
+    expected = StandardScaler().fit(values)
+
+    assert scaler.n_samples_seen_ == len(values)
+    np.testing.assert_allclose(scaler.mean_, expected.mean_, atol=1e-9)
+    np.testing.assert_allclose(scaler.var_, expected.var_, atol=1e-9)
+    np.testing.assert_allclose(scaler.transform(values), expected.transform(values), atol=1e-9)
+
+
+# Shard retries: a shard that fails once is retried, finished shards are not
+# run again, and a shard that keeps failing stops the pass
+
+def _job(tmp_path, shards):
+    return {'recon_name': 'recon', 'recon_info': {}, 'shards': shards, 'dir': str(tmp_path), 'rows': [10] * shards}
+
+
+def test_failed_shard_is_retried_and_finished_shards_are_not_rerun(tmp_path, monkeypatch):
+    job = _job(tmp_path, 3)
+    _write_json(_shard_file(job, 'profile', 0, 'json'), {'shard': 0, 'attempt': 1, 'result': {'rows': 10}})
+    calls = []
+
+    def task(job, shard):
+        calls.append(shard)
+        if shard == 1 and calls.count(1) == 1:
+            raise OSError("disk hiccup")
+        return {'rows': 10}
+
+    monkeypatch.setitem(partition_runner.SHARD_TASKS, 'profile', task)
+    run_pass(job, 'profile', max_attempts=2)
+
+    assert sorted(calls) == [1, 1, 2]
+    for shard in range(3):
+        assert os.path.exists(_shard_file(job, 'profile', shard, 'json'))
+        assert not os.path.exists(_shard_file(job, 'profile', shard, 'lock'))
+    assert not os.path.exists(_shard_file(job, 'profile', 1, 'failed'))
+
+
+def test_shard_failing_every_attempt_stops_the_pass(tmp_path, monkeypatch):
+    job = _job(tmp_path, 2)
+    calls = []
+
+    def task(job, shard):
+        calls.append(shard)
+        if shard == 0:
+            raise ValueError("bad rows")
+        return {'rows': 10}
+
+    monkeypatch.setitem(partition_runner.SHARD_TASKS, 'profile', task)
+    with pytest.raises(ShardFailure) as failure:
+        run_pass(job, 'profile', max_attempts=2)
+
+    assert calls.count(0) == 2
+    assert calls.count(1) == 1
+    assert list(failure.value.errors) == [0]
+    assert os.path.exists(_shard_file(job, 'profile', 0, 'failed'))
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import threading
+import http.client
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from recon_generator import generate
+from recon_ingest import load_recon
+from anomaly_ensemble import DETECTOR_COLUMNS
+from Anamoly_Detector import detect_recon
+from scoring_service import ScoringService, make_server
+
+RECON = 'iHub_Reconciliation'
+RECON_INFO = {'file_path': 'ihub.csv', 'key_columns': ['Company', 'Account', 'AU', 'Currency'],
+              'criteria_columns': ['GL Balance', 'iHub Balance'], 'derived_columns': ['Balance Difference'],
+              'date_columns': ['As of Date'], 'suppression': False}
+
+
+def post(port, path, rows):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', path, json.dumps(rows), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+# A batch POSTed to the warm service gets the flags a score-only detector run
+# gives the same rows; rows without the model's input columns get a 400
+
+def test_served_flags_match_detector(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data, _ = next(generate('ihub', 600, keys=50, anomaly_ratio=0.05, seed=3))
+    data.to_csv('ihub.csv', index=False)
+    with open('recon_config.json', 'w') as file:
+        json.dump({RECON: RECON_INFO}, file)
+
+    detect_recon(RECON, RECON_INFO, load_recon(RECON, RECON_INFO), plot=False)
+    expected = detect_recon(RECON, RECON_INFO, load_recon(RECON, RECON_INFO), score_only=True, plot=False)
+
+    server = make_server(ScoringService('recon_config.json'), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = server.server_address[1]
+        batch = pd.read_csv('ihub.csv').iloc[::7]
+        status, payload = post(port, f'/score/{RECON}', json.loads(batch.to_json(orient='records')))
+        assert status == 200
+        served = pd.DataFrame(payload['rows'])
+        for col in DETECTOR_COLUMNS + ['Anomaly']:
+            np.testing.assert_array_equal(served[col].astype(bool).to_numpy(),
+                                          expected[col].iloc[::7].astype(bool).to_numpy(), err_msg=col)
+        assert payload['flagged'] == int(expected['Anomaly'].iloc[::7].sum()) > 0
+
+        status, payload = post(port, f'/score/{RECON}',
+                               json.loads(batch.drop(columns=['GL Balance']).to_json(orient='records')))
+        assert status == 400
+        assert 'GL Balance' in payload['error']
+    finally:
+        server.shutdown()
+        server.server_close()